@@ -7,8 +7,12 @@ and a main area for symptom inputs. The "Diagnose" button runs the inference
 engine and displays the top diagnoses with color-coded recommendations.
 """
 
+import re
+
 import streamlit as st
-from inference_engine import diagnose, diagnose_with_explanation
+import knowledge_base
+from inference_engine import diagnose_with_explanation, get_compiled_kb
+from kb_registry import KBRegistry
 
 # Configure page with custom styling
 st.set_page_config(
@@ -19,8 +23,7 @@ st.set_page_config(
 )
 
 # Minimalist HCI-compliant styling
-st.markdown("""
-    <style>
+PAGE_CSS = """
     /* Clean minimalist color scheme */
     :root {
         --primary: #0066CC;
@@ -249,8 +252,57 @@ st.markdown("""
             text-align: left;
         }
     }
-    </style>
-    """, unsafe_allow_html=True)
+"""
+
+
+# Streamlit re-executes this script on every interaction. Everything below
+# that does not depend on widget values is computed once per server process
+# (st.cache_resource) and shared by all sessions.
+
+# Prefer fragments (Streamlit >= 1.37, experimental from 1.33) so changing a
+# symptom input reruns only the assessment panel, not the whole page.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+@st.cache_resource
+def _minified_css() -> str:
+    """Return PAGE_CSS with comments and redundant whitespace stripped."""
+    css = re.sub(r"/\*.*?\*/", "", PAGE_CSS, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};:,])\s*", r"\1", css).strip()
+
+
+@st.cache_resource
+def load_kb_registry() -> KBRegistry:
+    """Watch knowledge_base.py and hot-swap the compiled KB when it is edited.
+
+    Created once per server process; the engine then reads the current
+    snapshot on every call, so CF edits apply without restarting Streamlit.
+    """
+    return KBRegistry(knowledge_base.__file__).install().start()
+
+
+@st.cache_resource(max_entries=4096)
+def _cached_diagnosis(profile_bitmask: int, kb_token: int, _patient_profile):
+    """Explained ranking per scoring-relevant profile, shared across sessions.
+
+    Only the bitmask and the compiled KB's cache token (unique per
+    CompiledKB, unlike its version) form the cache key (Streamlit does not
+    hash underscore-prefixed arguments), so demographics do not fragment the
+    cache. Engine results are immutable, which lets every session share the
+    same object without copying.
+    """
+    return tuple(diagnose_with_explanation(_patient_profile))
+
+
+def run_diagnosis(patient_profile):
+    """Diagnose a profile through the cross-session result cache."""
+    load_kb_registry()
+    ckb = get_compiled_kb()
+    return _cached_diagnosis(ckb.encode_bitmask(patient_profile), ckb.cache_token, patient_profile)
+
+
+st.markdown(f"<style>{_minified_css()}</style>", unsafe_allow_html=True)
 
 
 def main():
@@ -282,7 +334,23 @@ def main():
 
     # Main content area
     st.markdown("<div class='main-container'>", unsafe_allow_html=True)
-    
+
+    assessment_panel(age, gender)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    # Footer
+    st.markdown("""
+    <div class='footer'>
+        <p>Respiratory Disease Expert System | Version 1.0</p>
+        <p>Evidence-based diagnostic assistant for educational purposes</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+
+@_fragment
+def assessment_panel(age, gender):
+    """Symptom inputs and results; reruns on its own when a symptom changes."""
     # Symptom input section
     st.markdown("<h2 class='section-title'>Symptom Assessment</h2>", unsafe_allow_html=True)
     
@@ -363,8 +431,8 @@ def main():
         diagnose_button = st.button("Analyze Symptoms", key="diagnose_btn", use_container_width=True)
 
     if diagnose_button:
-        # Run inference with explanation support
-        results_with_expl = diagnose_with_explanation(patient_profile)
+        # Run inference with explanation support (cached across sessions)
+        results_with_expl = run_diagnosis(patient_profile)
 
         if not results_with_expl:
             st.error("Unable to process input. Please check your entries.")
@@ -465,16 +533,6 @@ def main():
                 for p in best_expl['penalties']:
                     desc = p.get('explain', '')
                     st.markdown(f"- {p['symptom']} (penalty={round(p['penalty'],2)} of cf={p['cf']}): {desc}")
-    
-    st.markdown("</div>", unsafe_allow_html=True)
-
-    # Footer
-    st.markdown("""
-    <div class='footer'>
-        <p>Respiratory Disease Expert System | Version 1.0</p>
-        <p>Evidence-based diagnostic assistant for educational purposes</p>
-    </div>
-    """, unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
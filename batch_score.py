@@ -0,0 +1,132 @@
+"""
+Headless batch scorer for patient profiles.
+
+Usage:
+  python batch_score.py [INPUT] [--format jsonl|csv] [--chunk-size N] [--top-k K]
+
+Reads patient profiles from INPUT (or stdin when INPUT is omitted or '-'),
+scores them through the inference engine in fixed-size chunks and writes one
+JSON line of ranked results per profile to stdout (or --output). Throughput
+is reported on stderr.
+
+Design notes:
+- Profiles are read lazily and only one chunk is held in memory at a time,
+  so arbitrarily large input files are processed in constant memory.
+- Each chunk is scored with a single diagnose_batch() call; the chunk size
+  trades per-call overhead against memory and output latency.
+- This module does not import Streamlit and can run on any headless host.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from inference_engine import diagnose_batch, get_profile_schema
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_TOP_K = 3
+
+
+def read_profiles(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield patient profiles one at a time from a JSONL or CSV stream."""
+    if fmt == "csv":
+        schema = get_profile_schema()
+        for row in csv.DictReader(stream):
+            yield schema.parse_text_row(row)
+    elif fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise ValueError(f"Unsupported input format: {fmt!r}")
+
+
+def iter_chunks(profiles: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Group a profile stream into lists of at most ``chunk_size`` profiles."""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    it = iter(profiles)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def score_stream(profiles: Iterable[Dict[str, Any]], out: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 top_k: int = DEFAULT_TOP_K, log: Optional[TextIO] = None, report_every: int = 10) -> Dict[str, float]:
+    """Score a profile stream chunk by chunk and write JSONL results to ``out``.
+
+    Each output line holds the input ``id`` (when present), the zero-based row
+    number and the top-k ranking as [disease, percent] pairs. Every
+    ``report_every`` chunks a progress line is written to ``log``.
+
+    Returns summary statistics: rows, chunks, seconds and rows_per_sec.
+    """
+    start = time.perf_counter()
+    rows = 0
+    chunks = 0
+    for chunk in iter_chunks(profiles, chunk_size):
+        batch = diagnose_batch(chunk, top_k=top_k)
+        lines = []
+        for i, profile in enumerate(chunk):
+            record = {"row": rows + i, "ranking": batch.ranked(i)}
+            if "id" in profile:
+                record["id"] = profile["id"]
+            lines.append(json.dumps(record))
+        out.write("\n".join(lines) + "\n")
+        rows += len(chunk)
+        chunks += 1
+        if log is not None and report_every and chunks % report_every == 0:
+            elapsed = time.perf_counter() - start
+            log.write(f"{rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/sec)\n")
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def _guess_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Score patient profiles from JSONL or CSV in bounded memory.")
+    parser.add_argument("input", nargs="?", default="-", help="input file, or '-' for stdin (default)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="input format (default: from extension, else jsonl)")
+    parser.add_argument("--output", "-o", default="-", help="output JSONL file, or '-' for stdout (default)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="profiles scored per batch")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="ranked diseases written per profile")
+    parser.add_argument("--report-every", type=int, default=10, help="chunks between progress lines (0 disables)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or _guess_format(args.input)
+    src = sys.stdin if args.input == "-" else open(args.input, newline="" if fmt == "csv" else None)
+    dst = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        stats = score_stream(read_profiles(src, fmt), dst, chunk_size=args.chunk_size, top_k=args.top_k,
+                             log=sys.stderr, report_every=args.report_every)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+    sys.stderr.write(
+        f"Scored {stats['rows']} rows in {stats['chunks']} chunks of {stats['chunk_size']} "
+        f"in {stats['seconds']:.2f}s ({stats['rows_per_sec']:,.0f} rows/sec)\n"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
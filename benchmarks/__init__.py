@@ -0,0 +1 @@
+"""Performance benchmarks for the inference engine (run from the repository root)."""
@@ -0,0 +1,640 @@
+"""
+Local load generator for the Streamlit app and the engine entry points.
+
+Usage (from the repository root):
+  python -m benchmarks.load_test [--target engine|app|service] [--users 4] [--processes 1]
+      [--duration 10] [--entry diagnose_with_explanation] [--batch-size 64]
+      [--mix clinical=0.6,triage=0.3,random=0.1] [--think-ms 0] [--cold]
+      [--interval 0.5] [--output load_results.json]
+
+Targets:
+- engine: every simulated user calls one engine entry point (--entry:
+  diagnose, diagnose_with_explanation or diagnose_batch with --batch-size
+  profiles per call) in a closed loop. The result cache and the answer table
+  keep their defaults unless --cold is given.
+- app: every simulated user drives app.py's main() through Streamlit's
+  AppTest: load the page, set each input its profile needs (one rerun per
+  widget, as a browser triggers them), then click "Analyze Symptoms".
+  Latencies are recorded per step as app.load, app.input and app.analyze.
+  AppTest reruns the whole script where a browser reruns only the
+  assessment fragment, so app.input is an upper bound.
+- service: starts diagnosis_service.py on 127.0.0.1 at a free port; every
+  user POSTs /diagnose over its own keep-alive connection.
+
+Profile mixes (--mix, weights are relative):
+- clinical: a patient with one disease of the KB. Each of its symptoms is
+  present with probability CF, every other symptom with NOISE_RATE.
+- triage: one or two symptoms, as early in an assessment.
+- random: benchmarks.synthetic.synthetic_profile().
+
+The JSON report has p50/p95/p99/mean/max latency and throughput per
+operation, sessions and profiles per second, and a timeline sampled every
+--interval seconds with the operations completed per second and each
+process's CPU % and RSS.
+
+Design notes:
+- Users are split over --processes worker processes, one thread per user,
+  so a run can model one server process or a pool of them. AppTest keeps
+  process-global state and fails when used from several threads, so the app
+  target runs one user per process and ignores --processes.
+- Workers warm up (compile the KB, load the page once) before a common
+  start signal. Only operations that complete inside the --duration window
+  that follows are counted.
+- CPU and RSS are read from /proc, so the process columns are empty off
+  Linux. Everything runs on localhost; nothing leaves the machine.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.synthetic import synthetic_profile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SCRIPT = os.path.join(REPO_ROOT, "app.py")
+SERVICE_SCRIPT = os.path.join(REPO_ROOT, "diagnosis_service.py")
+
+TARGETS = ("engine", "app", "service")
+ENGINE_ENTRIES = ("diagnose", "diagnose_with_explanation", "diagnose_batch")
+MIX_KINDS = ("clinical", "triage", "random")
+DEFAULT_MIX = "clinical=0.6,triage=0.3,random=0.1"
+NOISE_RATE = 0.05
+TOP_K = 5
+
+# app.py widgets, looked up by label.
+APP_AGE, APP_GENDER, APP_SMOKING = "Age", "Gender", "Smoking history:"
+APP_RADIOS = {"fever": "Select fever level:", "cough": "Select cough type:"}
+APP_CHECKBOXES = {
+    "shortness_of_breath": "Shortness of Breath",
+    "wheezing": "Wheezing",
+    "chest_pain": "Chest Pain",
+    "fatigue": "Fatigue",
+    "loss_taste_smell": "Loss of Taste/Smell",
+}
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "clinical=0.6,triage=0.4" into {kind: weight}."""
+    weights: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in MIX_KINDS:
+            raise ValueError(f"unknown profile kind {kind!r} (expected one of {', '.join(MIX_KINDS)})")
+        try:
+            weights[kind] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"weight of {kind!r} is not a number: {weight!r}") from None
+        if weights[kind] < 0:
+            raise ValueError(f"weight of {kind!r} must not be negative")
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("the profile mix needs at least one positive weight")
+    return weights
+
+
+class ProfileMix:
+    """Seeded stream of patient profiles drawn from a weighted mix of kinds."""
+
+    def __init__(self, spec: str = DEFAULT_MIX, seed: int = 0):
+        from inference_engine import get_compiled_kb
+
+        weights = parse_mix(spec)
+        self.kinds = list(weights)
+        self.weights = [weights[k] for k in self.kinds]
+        self.rng = random.Random(seed)
+        ckb = get_compiled_kb()
+        schema = ckb.schema
+        self._keys = schema.keys
+        self._field_of = {f"{field}_{value}": (field, value)
+                          for field, values in schema.multi_valued.items() for value in values}
+        self._rules: List[List[Tuple[str, float]]] = []
+        for d_idx in range(len(ckb.diseases)):
+            row = ckb.cf[d_idx]
+            self._rules.append([(ckb.symptoms[s], float(row[s])) for s in np.flatnonzero(row > 0)
+                                if ckb.symptoms[s] in schema.key_index])
+
+    def _base(self) -> Dict[str, Any]:
+        return {"age": self.rng.randint(0, 100), "gender": self.rng.choice(("Female", "Male", "Other"))}
+
+    def _set(self, profile: Dict[str, Any], key: str) -> None:
+        if key in self._field_of:
+            field, value = self._field_of[key]
+            profile.setdefault(field, value)
+        else:
+            profile[key] = True
+
+    def clinical(self) -> Dict[str, Any]:
+        profile = self._base()
+        for key, cf in self._rules[self.rng.randrange(len(self._rules))]:
+            if self.rng.random() < cf:
+                self._set(profile, key)
+        for key in self._keys:
+            if self.rng.random() < NOISE_RATE:
+                self._set(profile, key)
+        return profile
+
+    def triage(self) -> Dict[str, Any]:
+        profile = self._base()
+        for key in self.rng.sample(self._keys, min(self.rng.randint(1, 2), len(self._keys))):
+            self._set(profile, key)
+        return profile
+
+    def random(self) -> Dict[str, Any]:
+        return synthetic_profile(self.rng)
+
+    def draw(self) -> Dict[str, Any]:
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        return getattr(self, kind)()
+
+
+class Recorder:
+    """Latencies of one worker, keyed by operation; drops what ends after ``deadline``."""
+
+    def __init__(self, deadline: float = float("inf")):
+        self.deadline = deadline
+        self.ops: Dict[str, Tuple[array, array]] = {}
+        self.errors: Dict[str, int] = {}
+        self.sessions = 0
+        self.profiles = 0
+        self._lock = threading.Lock()
+
+    def record(self, op: str, seconds: float, ok: bool = True) -> bool:
+        """Record one operation; True if it succeeded and ended inside the window."""
+        end = time.time()
+        if end > self.deadline:
+            return False
+        with self._lock:
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+                return False
+            ends, latencies = self.ops.setdefault(op, (array("d"), array("d")))
+            ends.append(end)
+            latencies.append(seconds)
+        return True
+
+    def session_done(self, profiles: int) -> None:
+        with self._lock:
+            self.sessions += 1
+            self.profiles += profiles
+
+    def timed(self, op: str, func: Callable[[], Any]) -> bool:
+        """Run ``func`` and record its latency (an exception counts as an error)."""
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            return self.record(op, time.perf_counter() - start, ok=False)
+        return self.record(op, time.perf_counter() - start)
+
+    def payload(self) -> Dict[str, Any]:
+        return {
+            "ops": {op: (ends.tolist(), latencies.tolist()) for op, (ends, latencies) in self.ops.items()},
+            "errors": dict(self.errors),
+            "sessions": self.sessions,
+            "profiles": self.profiles,
+        }
+
+
+class EngineUser:
+    """Calls one engine entry point per session."""
+
+    def __init__(self, config: Dict[str, Any], mix: ProfileMix):
+        import inference_engine
+
+        self.mix = mix
+        self.entry = config["entry"]
+        self.batch_size = config["batch_size"] if self.entry == "diagnose_batch" else 1
+        self.func = getattr(inference_engine, self.entry)
+
+    def session(self, recorder: Recorder) -> None:
+        if self.entry == "diagnose_batch":
+            profiles = [self.mix.draw() for _ in range(self.batch_size)]
+            ok = recorder.timed(self.entry, lambda: self.func(profiles, top_k=TOP_K))
+        else:
+            profile = self.mix.draw()
+            ok = recorder.timed(self.entry, lambda: self.func(profile))
+        if ok:
+            recorder.session_done(self.batch_size)
+
+
+class ServiceUser:
+    """POSTs one profile to the local diagnosis service per session."""
+
+    def __init__(self, config: Dict[str, Any], mix: ProfileMix):
+        self.mix = mix
+        self.port = config["service_port"]
+        self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+
+    def _post(self, body: bytes) -> None:
+        try:
+            self.conn.request("POST", f"/diagnose?top_k={TOP_K}", body, {"Content-Type": "application/json"})
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+
+    def session(self, recorder: Recorder) -> None:
+        body = json.dumps(self.mix.draw()).encode()
+        if recorder.timed("http.diagnose", lambda: self._post(body)):
+            recorder.session_done(1)
+
+
+def _labelled(widgets: Any, label: str) -> Any:
+    return next(w for w in widgets if w.label == label)
+
+
+def _app_inputs(at: Any, profile: Dict[str, Any]) -> Iterator[None]:
+    """Set the widgets ``profile`` needs, one at a time, yielding after each."""
+    age = min(max(int(profile.get("age", 35)), 0), 120)
+    if age != 35:
+        _labelled(at.slider, APP_AGE).set_value(age)
+        yield
+    if profile.get("gender", "Female") != "Female":
+        _labelled(at.selectbox, APP_GENDER).set_value(profile["gender"])
+        yield
+    for field, label in APP_RADIOS.items():
+        value = profile.get(field)
+        if isinstance(value, str) and value != "none":
+            _labelled(at.radio, label).set_value(value.capitalize())
+            yield
+    if profile.get("smoking_history"):
+        _labelled(at.selectbox, APP_SMOKING).set_value("Yes")
+        yield
+    for key, label in APP_CHECKBOXES.items():
+        if profile.get(key):
+            _labelled(at.checkbox, label).check()
+            yield
+
+
+class AppUser:
+    """Drives app.py through one assessment per session with Streamlit's AppTest."""
+
+    def __init__(self, config: Dict[str, Any], mix: ProfileMix):
+        from streamlit.testing.v1 import AppTest
+
+        # AppTest logs a bare-mode warning per session; a logger filter
+        # survives Streamlit re-installing its handlers.
+        logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+            lambda record: record.levelno >= logging.ERROR)
+        self.mix = mix
+        self.timeout = config.get("app_timeout", 60)
+        self._app_test = AppTest
+
+    def session(self, recorder: Recorder) -> None:
+        at = self._app_test.from_file(APP_SCRIPT, default_timeout=self.timeout)
+
+        def step(op: str) -> bool:
+            # Script errors are reported in at.exception rather than raised.
+            start = time.perf_counter()
+            try:
+                ok = not at.run().exception
+            except Exception:
+                ok = False
+            return recorder.record(op, time.perf_counter() - start, ok)
+
+        if not step("app.load"):
+            return
+        try:
+            for _ in _app_inputs(at, self.mix.draw()):
+                if not step("app.input"):
+                    return
+            at.button(key="diagnose_btn").click()
+        except (StopIteration, KeyError, ValueError):
+            recorder.record("app.input", 0.0, ok=False)
+            return
+        if step("app.analyze"):
+            recorder.session_done(1)
+
+
+USER_CLASSES = {"engine": EngineUser, "app": AppUser, "service": ServiceUser}
+
+
+def _user_loop(user: Any, recorder: Recorder, think_sec: float, rng: random.Random) -> None:
+    while time.time() < recorder.deadline:
+        user.session(recorder)
+        if think_sec > 0:
+            time.sleep(rng.expovariate(1.0 / think_sec))
+
+
+def _worker(config: Dict[str, Any], worker_id: int, n_users: int, start_time: Any, start: Any,
+            results: Any) -> None:
+    """Run ``n_users`` users in threads and put the recorded samples on ``results``."""
+    if config["cold"] and config["target"] == "engine":
+        import inference_engine
+
+        inference_engine.configure_result_cache(0)
+        inference_engine.set_answer_table_enabled(False)
+    seeds = [config["seed"] * 1_000_003 + worker_id * 1_009 + u for u in range(n_users)]
+    users = [USER_CLASSES[config["target"]](config, ProfileMix(config["mix"], seed)) for seed in seeds]
+    warm_up = Recorder()
+    for user in users:
+        user.session(warm_up)
+    results.put(("ready", worker_id, None))
+    start.wait()
+
+    recorder = Recorder(start_time.value + config["duration"])
+    think_sec = config["think_ms"] / 1000.0
+    threads = [threading.Thread(target=_user_loop, args=(user, recorder, think_sec, random.Random(seed)),
+                                daemon=True)
+               for user, seed in zip(users, seeds)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(("done", worker_id, recorder.payload()))
+
+
+def read_process_stats(pid: int) -> Optional[Tuple[float, int]]:
+    """(CPU seconds used, resident bytes) of ``pid`` from /proc, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as fh:
+            fields = fh.read().rpartition(")")[2].split()
+        with open(f"/proc/{pid}/statm") as fh:
+            pages = int(fh.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / _CLK_TCK, pages * _PAGE_SIZE
+
+
+class ProcessSampler:
+    """CPU % (since the previous sample) and RSS of named processes."""
+
+    def __init__(self, pids: Dict[str, int]):
+        self.pids = pids
+        self._last: Dict[str, Tuple[float, float]] = {}
+        self.sample()
+
+    def sample(self) -> Dict[str, Dict[str, float]]:
+        now = time.monotonic()
+        stats = {}
+        for name, pid in self.pids.items():
+            current = read_process_stats(pid)
+            if current is None:
+                continue
+            cpu_sec, rss = current
+            last = self._last.get(name)
+            self._last[name] = (now, cpu_sec)
+            if last is None or now <= last[0]:
+                continue
+            stats[name] = {
+                "cpu_percent": round(100.0 * (cpu_sec - last[1]) / (now - last[0]), 1),
+                "rss_mb": round(rss / 2 ** 20, 1),
+            }
+        return stats
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_service(port: int, timeout: float = 30.0) -> subprocess.Popen:
+    """Start diagnosis_service.py on 127.0.0.1:``port`` and wait for /health."""
+    proc = subprocess.Popen([sys.executable, SERVICE_SCRIPT, "--host", "127.0.0.1", "--port", str(port)],
+                            cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"diagnosis service exited with status {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("diagnosis service did not become ready")
+
+
+def _wait_for(results: Any, kind: str, procs: List[Any], timeout: float) -> Dict[int, Any]:
+    """Collect one ``kind`` message per worker, failing fast if a worker dies."""
+    received: Dict[int, Any] = {}
+    deadline = time.monotonic() + timeout
+    while len(received) < len(procs):
+        try:
+            msg_kind, worker_id, payload = results.get(timeout=0.5)
+        except Exception:  # queue.Empty
+            dead = [p for p in procs if p.exitcode not in (None, 0)]
+            if dead:
+                raise RuntimeError(f"load worker exited with status {dead[0].exitcode}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"timed out waiting for workers ({kind})")
+            continue
+        if msg_kind == kind:
+            received[worker_id] = payload
+    return received
+
+
+def _percentile_stats(latencies: np.ndarray) -> Dict[str, Optional[float]]:
+    if not len(latencies):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    ms = latencies * 1e3
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def summarise(payloads: List[Dict[str, Any]], start_time: float, duration: float,
+              samples: List[Tuple[float, Dict[str, Dict[str, float]]]]) -> Dict[str, Any]:
+    """Merge worker payloads and process samples into the report's metric sections."""
+    ends: Dict[str, List[float]] = {}
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for payload in payloads:
+        for op, (op_ends, op_latencies) in payload["ops"].items():
+            ends.setdefault(op, []).extend(op_ends)
+            latencies.setdefault(op, []).extend(op_latencies)
+        for op, count in payload["errors"].items():
+            errors[op] = errors.get(op, 0) + count
+
+    ops = {}
+    for op in sorted(set(latencies) | set(errors)):
+        op_latencies = np.asarray(latencies.get(op, []))
+        ops[op] = {"count": len(op_latencies), "errors": errors.get(op, 0),
+                   **_percentile_stats(op_latencies),
+                   "per_sec": round(len(op_latencies) / duration, 2)}
+
+    all_ends = np.concatenate([np.asarray(e) for e in ends.values()]) if ends else np.empty(0)
+    edges = [0.0] + [t for t, _ in samples]
+    completed, _ = np.histogram(all_ends - start_time, bins=edges) if len(edges) > 1 else (np.empty(0), None)
+    timeline = [
+        {"t": round(t, 2), "ops_per_sec": round(float(n) / max(t - prev, 1e-9), 1), "processes": stats}
+        for (t, stats), prev, n in zip(samples, edges, completed)
+    ]
+
+    processes: Dict[str, Dict[str, float]] = {}
+    for name in sorted({name for _, stats in samples for name in stats}):
+        cpu = [stats[name]["cpu_percent"] for _, stats in samples if name in stats]
+        rss = [stats[name]["rss_mb"] for _, stats in samples if name in stats]
+        processes[name] = {"cpu_percent_mean": round(float(np.mean(cpu)), 1),
+                           "cpu_percent_max": round(float(np.max(cpu)), 1),
+                           "rss_mb_max": round(float(np.max(rss)), 1)}
+
+    sessions = sum(p["sessions"] for p in payloads)
+    profiles = sum(p["profiles"] for p in payloads)
+    return {
+        "ops": ops,
+        "throughput": {"sessions": sessions, "sessions_per_sec": round(sessions / duration, 2),
+                       "profiles_per_sec": round(profiles / duration, 2)},
+        "processes": processes,
+        "timeline": timeline,
+    }
+
+
+def run_load(target: str = "engine", users: int = 4, processes: int = 1, duration: float = 10.0,
+             entry: str = "diagnose_with_explanation", batch_size: int = 64, mix: str = DEFAULT_MIX,
+             think_ms: float = 0.0, cold: bool = False, interval: float = 0.5, seed: int = 0,
+             startup_timeout: float = 120.0) -> Dict[str, Any]:
+    """Run one load test and return the JSON-serialisable report."""
+    if target not in TARGETS:
+        raise ValueError(f"unknown target {target!r}")
+    if entry not in ENGINE_ENTRIES:
+        raise ValueError(f"unknown engine entry point {entry!r}")
+    parse_mix(mix)
+    users = max(1, users)
+    processes = users if target == "app" else max(1, min(processes, users))
+    config = {"target": target, "entry": entry, "batch_size": batch_size, "mix": mix, "think_ms": think_ms,
+              "cold": cold, "seed": seed, "duration": duration}
+
+    service = None
+    pids: Dict[str, int] = {}
+    if target == "service":
+        config["service_port"] = _free_port()
+        service = _start_service(config["service_port"])
+        pids["service"] = service.pid
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    start = ctx.Event()
+    start_time = ctx.Value("d", 0.0)
+    per_worker = [users // processes + (1 if w < users % processes else 0) for w in range(processes)]
+    procs = [ctx.Process(target=_worker, args=(config, w, n, start_time, start, results), daemon=True)
+             for w, n in enumerate(per_worker)]
+    try:
+        for proc in procs:
+            proc.start()
+        _wait_for(results, "ready", procs, startup_timeout)
+        pids.update({f"worker-{w}": proc.pid for w, proc in enumerate(procs)})
+        sampler = ProcessSampler(pids)
+        start_time.value = time.time()
+        start.set()
+        samples: List[Tuple[float, Dict[str, Dict[str, float]]]] = []
+        tick = 1
+        while True:
+            elapsed = time.time() - start_time.value
+            wait = min(tick * interval, duration) - elapsed
+            if wait > 0:
+                time.sleep(wait)
+            elapsed = time.time() - start_time.value
+            samples.append((min(elapsed, duration), sampler.sample()))
+            if elapsed >= duration:
+                break
+            tick += 1
+        payloads = _wait_for(results, "done", procs, startup_timeout + duration)
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    report = summarise([payloads[w] for w in sorted(payloads)], start_time.value, duration, samples)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "target": target,
+            "users": users,
+            "processes": processes,
+            "duration_sec": duration,
+            "entry": entry if target == "engine" else None,
+            "batch_size": batch_size if target == "engine" and entry == "diagnose_batch" else None,
+            "mix": parse_mix(mix),
+            "think_ms": think_ms,
+            "cold": cold,
+            "interval_sec": interval,
+            "seed": seed,
+        },
+        **report,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the app, service or engine on localhost.")
+    parser.add_argument("--target", choices=TARGETS, default="engine")
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes the users are split over (app: one per user)")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds after warm-up")
+    parser.add_argument("--entry", choices=ENGINE_ENTRIES, default="diagnose_with_explanation",
+                        help="engine entry point (engine target)")
+    parser.add_argument("--batch-size", type=int, default=64, help="profiles per diagnose_batch() call")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted profile kinds: clinical, triage, random")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's sessions")
+    parser.add_argument("--cold", action="store_true", help="disable the result cache and answer table (engine)")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between CPU/RSS samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_results.json", help="where to write the JSON report")
+    args = parser.parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    report = run_load(args.target, args.users, args.processes, args.duration, args.entry, args.batch_size,
+                      args.mix, args.think_ms, args.cold, args.interval, args.seed)
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+
+    print(f"{'operation':24s} {'count':>8s} {'errors':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'ops/s':>9s}")
+    for op, stats in report["ops"].items():
+        p50, p95, p99 = (f"{stats[k]:9.2f}" if stats[k] is not None else f"{'-':>9s}"
+                         for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{op:24s} {stats['count']:8d} {stats['errors']:7d} {p50} {p95} {p99} {stats['per_sec']:9.1f}")
+    throughput = report["throughput"]
+    print(f"\nsessions/s {throughput['sessions_per_sec']:.1f}, profiles/s {throughput['profiles_per_sec']:.1f}")
+    for name, stats in report["processes"].items():
+        print(f"{name:12s} cpu mean {stats['cpu_percent_mean']:6.1f}%  max {stats['cpu_percent_max']:6.1f}%  "
+              f"rss max {stats['rss_mb_max']:8.1f} MB")
+    print(f"\nReport written to {args.output}")
+    return 0 if not any(stats["errors"] for stats in report["ops"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Latency and throughput benchmarks for the inference engine.
+
+Usage (from the repository root):
+  python -m benchmarks.run_benchmarks [--sizes 10,1000,100000] [--calls 200]
+      [--output bench_results.json] [--baseline baseline.json] [--threshold 0.25]
+
+For every synthetic KB size the suite measures:
+- diagnose(): per-call latency percentiles, with the result cache and answer
+  table disabled ("cold") and, after one untimed pass over the same profiles,
+  with default settings ("warm");
+- diagnose(top_k=5) cold latency;
+- diagnose_with_explanation() cold latency, including reading the top
+  explanation's evidence as the UI does;
+- diagnose_batch(): profiles per second, scored in chunks small enough to
+  keep the dense (chunk, n_diseases) score matrix under BATCH_MAX_CELLS.
+
+Results are written as JSON. Each metric records whether lower or higher is
+better; with --baseline the run exits with status 1 if any metric is worse
+than the baseline by more than --threshold (a fraction, 0.25 = 25%).
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import inference_engine
+from batch_score import iter_chunks
+from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+from inference_engine import (
+    compile_knowledge_base,
+    configure_result_cache,
+    diagnose,
+    diagnose_batch,
+    diagnose_with_explanation,
+    set_answer_table_enabled,
+    use_compiled_kb,
+)
+from result_cache import DEFAULT_MAXSIZE
+
+BATCH_MAX_CELLS = 20_000_000
+
+Metrics = Dict[str, Dict[str, object]]
+
+
+def _latency_metrics(prefix: str, func: Callable, profiles: List[dict], metrics: Metrics) -> None:
+    timings = np.empty(len(profiles))
+    for i, profile in enumerate(profiles):
+        start = time.perf_counter()
+        func(profile)
+        timings[i] = time.perf_counter() - start
+    timings *= 1e6
+    for name, value in (("p50_us", np.percentile(timings, 50)), ("p95_us", np.percentile(timings, 95)),
+                        ("p99_us", np.percentile(timings, 99)), ("mean_us", timings.mean())):
+        metrics[f"{prefix}.{name}"] = {"value": round(float(value), 2), "unit": "us", "better": "lower"}
+
+
+def _explain_top(profile: dict) -> None:
+    results = diagnose_with_explanation(profile)
+    results[0][2]["matched"]
+
+
+def bench_kb_size(n_diseases: int, calls: int, batch_size: int, extra_symptoms: int = 0,
+                  rules_per_disease: int = 6, seed: int = 0) -> Metrics:
+    """Run every benchmark against one synthetic KB and return its metrics."""
+    metrics: Metrics = {}
+    prefix = f"kb{n_diseases}"
+    ckb = compile_knowledge_base(synthetic_kb(n_diseases, extra_symptoms, rules_per_disease, seed))
+    profiles = list(synthetic_profiles(calls, seed=seed + 1, schema=ckb.schema))
+    use_compiled_kb(ckb)
+    try:
+        configure_result_cache(0)
+        set_answer_table_enabled(False)
+        _latency_metrics(f"{prefix}.diagnose.cold", diagnose, profiles, metrics)
+        _latency_metrics(f"{prefix}.diagnose_top5.cold", lambda p: diagnose(p, top_k=5), profiles, metrics)
+        _latency_metrics(f"{prefix}.diagnose_with_explanation.cold", _explain_top, profiles, metrics)
+
+        configure_result_cache(DEFAULT_MAXSIZE)
+        set_answer_table_enabled(True)
+        inference_engine.clear_result_cache()
+        for profile in profiles:
+            diagnose(profile)
+        _latency_metrics(f"{prefix}.diagnose.warm", diagnose, profiles, metrics)
+
+        batch = list(synthetic_profiles(batch_size, seed=seed + 2, schema=ckb.schema))
+        chunk_size = max(1, min(batch_size, BATCH_MAX_CELLS // n_diseases))
+        start = time.perf_counter()
+        for chunk in iter_chunks(batch, chunk_size):
+            diagnose_batch(chunk, top_k=5)
+        elapsed = time.perf_counter() - start
+        metrics[f"{prefix}.diagnose_batch.profiles_per_sec"] = {
+            "value": round(batch_size / elapsed, 1), "unit": "profiles/s", "better": "higher",
+        }
+    finally:
+        use_compiled_kb(None)
+        configure_result_cache(DEFAULT_MAXSIZE)
+        set_answer_table_enabled(True)
+        inference_engine.clear_result_cache()
+    return metrics
+
+
+def run(sizes: List[int], calls: int, batch_size: int, extra_symptoms: int = 0,
+        rules_per_disease: int = 6) -> Dict[str, object]:
+    """Run the suite for all KB sizes and return the JSON-serialisable report."""
+    metrics: Metrics = {}
+    for n_diseases in sizes:
+        metrics.update(bench_kb_size(n_diseases, calls, batch_size, extra_symptoms, rules_per_disease))
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "sizes": sizes,
+            "calls": calls,
+            "batch_size": batch_size,
+            "extra_symptoms": extra_symptoms,
+            "rules_per_disease": rules_per_disease,
+        },
+        "metrics": metrics,
+    }
+
+
+def find_regressions(report: Dict[str, object], baseline: Dict[str, object], threshold: float) -> List[str]:
+    """Describe every metric that is worse than the baseline by more than ``threshold``."""
+    regressions = []
+    for name, base in baseline["metrics"].items():
+        current = report["metrics"].get(name)
+        if current is None or not base["value"]:
+            continue
+        change = (current["value"] - base["value"]) / base["value"]
+        worse = change > threshold if base["better"] == "lower" else change < -threshold
+        if worse:
+            regressions.append(f"{name}: {base['value']} -> {current['value']} {base['unit']} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the diagnosis engine on synthetic knowledge bases.")
+    parser.add_argument("--sizes", default="10,1000,100000", help="comma-separated disease counts")
+    parser.add_argument("--calls", type=int, default=200, help="profiles timed per latency benchmark")
+    parser.add_argument("--batch-size", type=int, default=2000, help="profiles per diagnose_batch() call")
+    parser.add_argument("--extra-symptoms", type=int, default=0, help="synthetic symptom keys added to the KB")
+    parser.add_argument("--rules-per-disease", type=int, default=6, help="rules per disease (sparsity)")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    report = run(sizes, args.calls, args.batch_size, args.extra_symptoms, args.rules_per_disease)
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    for name, metric in report["metrics"].items():
+        print(f"{name:55s} {metric['value']:>14,.2f} {metric['unit']}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = find_regressions(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f" - {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
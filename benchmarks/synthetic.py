@@ -0,0 +1,66 @@
+"""
+Synthetic knowledge bases and patient profile streams for benchmarking.
+
+The generated KBs use the engine's real symptom keys (fever_*, cough_*, and
+the boolean symptoms) plus ``extra_symptoms`` padding keys ("synthetic0",
+"synthetic1", ...: no underscore, so they are always boolean fields), so
+that profiles drawn by synthetic_profiles() actually hit rules. Pass the
+compiled KB's ``schema`` to draw the padding symptoms too; by default
+profiles use the bundled KB's fields. ``rules_per_disease`` controls
+sparsity: each disease gets that many rules drawn uniformly from the symptom
+pool. Everything is seeded and reproducible.
+"""
+
+import random
+from typing import Any, Dict, Iterator, List, Optional
+
+from knowledge_base import MULTI_VALUED_FIELDS, get_symptom_keys
+from profile_schema import ProfileSchema
+
+# Profile fields of the bundled KB; synthetic KBs and profiles reuse them.
+_SCHEMA = ProfileSchema(get_symptom_keys(), MULTI_VALUED_FIELDS)
+
+
+def engine_symptom_keys() -> List[str]:
+    """Symptom keys the engine's profile encoder can produce."""
+    return list(_SCHEMA.keys)
+
+
+def synthetic_kb(n_diseases: int, extra_symptoms: int = 0, rules_per_disease: int = 6,
+                 seed: int = 0) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Return a random KB in the same shape as KNOWLEDGE_BASE."""
+    rng = random.Random(seed)
+    symptoms = engine_symptom_keys() + [f"synthetic{i}" for i in range(extra_symptoms)]
+    per_disease = min(rules_per_disease, len(symptoms))
+    kb = {}
+    for d in range(n_diseases):
+        kb[f"Disease {d}"] = {
+            symptom: {"cf": round(rng.uniform(0.05, 1.0), 2), "explain": f"Synthetic rule {d}/{symptom}"}
+            for symptom in rng.sample(symptoms, per_disease)
+        }
+    return kb
+
+
+def synthetic_profile(rng: random.Random, symptom_rate: float = 0.3,
+                      schema: Optional[ProfileSchema] = None) -> Dict[str, Any]:
+    """Draw one profile over ``schema``'s fields (default: the bundled KB's).
+
+    Each boolean symptom is present with ``symptom_rate``.
+    """
+    schema = schema if schema is not None else _SCHEMA
+    profile: Dict[str, Any] = {"age": rng.randint(0, 100), "gender": rng.choice(("Female", "Male", "Other"))}
+    for field, values in schema.multi_valued.items():
+        profile[field] = rng.choice(values + (None,))
+    for field in schema.boolean:
+        profile[field] = rng.random() < symptom_rate
+    return profile
+
+
+def synthetic_profiles(n: Optional[int] = None, seed: int = 0, symptom_rate: float = 0.3,
+                       schema: Optional[ProfileSchema] = None) -> Iterator[Dict[str, Any]]:
+    """Yield ``n`` synthetic profiles over ``schema`` (an endless stream when ``n`` is None)."""
+    rng = random.Random(seed)
+    count = 0
+    while n is None or count < n:
+        yield synthetic_profile(rng, symptom_rate, schema)
+        count += 1
@@ -0,0 +1,240 @@
+"""
+Asynchronous HTTP JSON service for the inference engine.
+
+Usage:
+  python diagnosis_service.py [--host 127.0.0.1] [--port 8080]
+                              [--batch-window-ms 2] [--max-batch 512] [--metrics]
+
+Endpoints:
+  POST /diagnose        body: profile object       -> {"ranking": [[disease, percent], ...]}
+  POST /diagnose/batch  body: list of profiles      -> {"rankings": [[[disease, percent], ...], ...]}
+  GET  /health                                       -> {"status": "ok", ...}
+  GET  /metrics                                      -> Prometheus text (engine metrics, result cache)
+Both diagnose endpoints accept an optional ``top_k`` query parameter.
+
+Design notes:
+- Built only on asyncio streams from the standard library (HTTP/1.1 with
+  keep-alive), so it runs anywhere the engine runs and does not import
+  Streamlit.
+- Concurrent single-profile requests are coalesced by a MicroBatcher: the
+  first request opens a window of ``batch_window_ms``; everything arriving
+  within it (up to ``max_batch``) is scored with one diagnose_batch() call.
+  The window bounds the extra latency a request can see, so it is the knob
+  for trading p99 latency against throughput.
+- /diagnose/batch bodies can hold any number of profiles, so they are
+  scored (and their rankings built) in the loop's default thread pool; the
+  event loop keeps accepting connections and serving /health and
+  micro-batched singles while a large batch runs.
+- Engine instrumentation is off unless started with --metrics; /metrics
+  then exposes latency, encode/score time, rules evaluated and batch-size
+  histograms for scraping (see engine_metrics).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+import inference_engine
+from inference_engine import diagnose_batch
+
+DEFAULT_BATCH_WINDOW_MS = 2.0
+DEFAULT_MAX_BATCH = 512
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+def _rank_batch(profiles: List[Dict[str, Any]], top_k: Optional[int]) -> List[List[Tuple[str, float]]]:
+    """Score a /diagnose/batch body; runs off the event loop."""
+    batch = diagnose_batch(profiles, top_k=top_k)
+    return [batch.ranked(row) for row in range(len(batch))]
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-profile diagnoses into batched engine calls."""
+
+    def __init__(self, batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS, max_batch: int = DEFAULT_MAX_BATCH):
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.batches = 0
+        self.profiles = 0
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def diagnose(self, profile: Dict[str, Any]) -> List[Tuple[str, float]]:
+        """Queue one profile and wait for its full ranking."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((profile, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            batch = diagnose_batch([profile for profile, _ in pending])
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self.batches += 1
+        self.profiles += len(pending)
+        for row, (_, future) in enumerate(pending):
+            if not future.done():
+                future.set_result(batch.ranked(row))
+
+
+class DiagnosisService:
+    """Minimal HTTP/1.1 server exposing the diagnose endpoints."""
+
+    def __init__(self, batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS, max_batch: int = DEFAULT_MAX_BATCH):
+        self.batcher = MicroBatcher(batch_window_ms, max_batch)
+        self.started = time.time()
+        self.requests = 0
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "invalid Content-Length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                status, payload = await self.dispatch(method, target, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Union[Dict[str, Any], str]]:
+        """Route one request and return (status, JSON payload or plain-text body)."""
+        self.requests += 1
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        try:
+            top_k = int(query["top_k"][0]) if "top_k" in query else None
+        except ValueError:
+            return 400, {"error": "top_k must be an integer"}
+        if top_k is not None and top_k < 0:
+            return 400, {"error": "top_k must not be negative"}
+
+        if url.path == "/health":
+            return 200, {
+                "status": "ok",
+                "uptime_sec": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "batches": self.batcher.batches,
+                "batched_profiles": self.batcher.profiles,
+            }
+        if url.path == "/metrics":
+            return 200, inference_engine.metrics_prometheus()
+        if url.path not in ("/diagnose", "/diagnose/batch"):
+            return 404, {"error": f"unknown path {url.path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            data = json.loads(body or b"null")
+        except ValueError:
+            return 400, {"error": "body is not valid JSON"}
+
+        if url.path == "/diagnose":
+            if not isinstance(data, dict):
+                return 400, {"error": "expected a profile object"}
+            ranking = await self.batcher.diagnose(data)
+            return 200, {"ranking": ranking[:top_k]}
+
+        if not isinstance(data, list) or not all(isinstance(p, dict) for p in data):
+            return 400, {"error": "expected a list of profile objects"}
+        rankings = await asyncio.get_running_loop().run_in_executor(None, _rank_batch, data, top_k)
+        return 200, {"rankings": rankings}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Union[Dict[str, Any], str],
+                       keep_alive: bool) -> None:
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+                max_batch: int = DEFAULT_MAX_BATCH) -> None:
+    """Run the service until cancelled."""
+    service = DiagnosisService(batch_window_ms, max_batch)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Diagnosis service listening on {addresses} "
+          f"(batch window {batch_window_ms} ms, max batch {max_batch})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="HTTP JSON service for the diagnosis engine.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help="how long the first queued request waits for others to join its batch")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="flush a batch early once this many requests are queued")
+    parser.add_argument("--metrics", action="store_true", help="record engine metrics for GET /metrics")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        inference_engine.enable_metrics()
+    try:
+        asyncio.run(serve(args.host, args.port, args.batch_window_ms, args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
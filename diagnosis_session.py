@@ -0,0 +1,206 @@
+"""
+Incremental diagnosis for interactive what-if exploration.
+
+A DiagnosisSession keeps, for one patient, the present symptoms and every
+disease's percentage. Adding or removing a symptom only touches the diseases
+that have a rule for it (the symptom's postings list in the compiled KB's
+inverted index); every other disease keeps its score. The ranking is rebuilt
+from the score array when it is next requested.
+
+Design notes:
+- The session pins the CompiledKB it was created with, so all of its
+  answers come from one KB version even if the engine's KB is swapped
+  meanwhile. Call rebase() to move to the current KB.
+- Affected diseases are re-summed over the present symptoms
+  (CompiledKB.present_support) rather than adjusted by +/- the toggled CF.
+  That keeps the cost at O(affected diseases x present symptoms) while
+  producing bit-identical scores to diagnose(): repeated add/subtract would
+  accumulate rounding error and could move a score across a rounding
+  boundary.
+- Rankings keep KB order between ties, as in diagnose(). A full ranking
+  is a stable sort of the score array, cached until the next change; a
+  top-k request selects its k diseases with a partial selection over the
+  cached scores (O(diseases), no full sort) and only builds those k
+  records, so a toggle followed by ranked(top_k) stays cheaper than a
+  stateless diagnose(top_k=...).
+- When the KB uses derived facts, the session keeps a rule_network
+  WorkingMemory: setting a base symptom propagates only through the join
+  nodes that test it, and the derived facts that change are applied like
+  symptom toggles.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from inference_engine import (
+    PENALTY_FRACTION, CompiledKB, Explanation, _check_top_k, _mask_indices, _normalise, _select_top_k,
+    get_compiled_kb,
+)
+from results import RankedResults
+
+
+class DiagnosisSession:
+    """Scores of one patient that are updated symptom by symptom."""
+
+    def __init__(self, patient_profile: Optional[Dict[str, Any]] = None, ckb: Optional[CompiledKB] = None):
+        self.diseases_rescored = 0
+        self._reset(ckb if ckb is not None else get_compiled_kb())
+        if patient_profile is not None:
+            self.update(patient_profile)
+
+    def _reset(self, ckb: CompiledKB) -> None:
+        self._ckb = ckb
+        self._wm = ckb.network.working_memory() if ckb.network is not None else None
+        self._mask = 0
+        self._percents = ckb.baseline_percentages().copy()
+        self._order: Optional[np.ndarray] = None
+        self._top: Optional[Tuple[int, np.ndarray]] = None
+
+    @property
+    def kb_version(self) -> int:
+        return self._ckb.version
+
+    @property
+    def mask(self) -> int:
+        """Present symptoms as a bitmask (bit i = symptom i of the KB)."""
+        return self._mask
+
+    @property
+    def present(self) -> List[str]:
+        """Present symptom keys in KB order."""
+        return [s for i, s in enumerate(self._ckb.symptoms) if self._mask >> i & 1]
+
+    def is_present(self, symptom_key: str) -> bool:
+        if self._wm is not None and symptom_key not in self._ckb.symptom_index:
+            if symptom_key not in self._ckb.network.rules:
+                self._check_base_fact(symptom_key)
+            return self._wm.is_present(symptom_key)
+        return bool(self._mask >> self._symptom(symptom_key) & 1)
+
+    def _symptom(self, symptom_key: str) -> int:
+        try:
+            return self._ckb.symptom_index[symptom_key]
+        except KeyError:
+            raise KeyError(f"Unknown symptom key: {symptom_key!r}") from None
+
+    def _check_base_fact(self, symptom_key: str) -> None:
+        network = self._ckb.network
+        if symptom_key in network.rules:
+            raise ValueError(f"{symptom_key!r} is a derived fact and cannot be set directly")
+        if symptom_key not in self._ckb.symptom_index and symptom_key not in network.conditions:
+            raise KeyError(f"Unknown symptom key: {symptom_key!r}")
+
+    def _sync(self, changed: List[str]) -> bool:
+        """Apply working-memory changes to the KB symptoms they touch."""
+        index = self._ckb.symptom_index
+        for fact in changed:
+            s_idx = index.get(fact)
+            if s_idx is not None:
+                self._apply(s_idx, self._wm.is_present(fact))
+        return bool(changed)
+
+    def _apply(self, s_idx: int, present: bool) -> bool:
+        if bool(self._mask >> s_idx & 1) == present:
+            return False
+        self._mask ^= 1 << s_idx
+        affected = self._ckb.inverted_index()[s_idx][0]
+        if affected.size:
+            ckb = self._ckb
+            support = ckb.present_support(affected, _mask_indices(self._mask))
+            raw = (1.0 + PENALTY_FRACTION) * support - ckb.penalty_base[affected]
+            self._percents[affected] = _normalise(raw, ckb.max_scores[affected])
+            self.diseases_rescored += affected.size
+            self._order = self._top = None
+        return True
+
+    def set_symptom(self, symptom_key: str, present: bool = True) -> bool:
+        """Mark a symptom key present or absent. Returns True if anything changed."""
+        if self._wm is None:
+            return self._apply(self._symptom(symptom_key), bool(present))
+        self._check_base_fact(symptom_key)
+        if present:
+            return self._sync(self._wm.assert_fact(symptom_key))
+        return self._sync(self._wm.retract_fact(symptom_key))
+
+    def toggle(self, symptom_key: str) -> bool:
+        """Flip a symptom key; returns its new presence."""
+        self.set_symptom(symptom_key, not self.is_present(symptom_key))
+        return self.is_present(symptom_key)
+
+    def update(self, patient_profile: Dict[str, Any]) -> List[str]:
+        """Move to a new profile, rescoring only for the symptoms that differ.
+
+        Returns the symptom keys that changed.
+        """
+        if self._wm is not None:
+            before = self._mask
+            self._sync(self._wm.set_facts(self._ckb.schema.present(patient_profile)))
+            return [self._ckb.symptoms[i] for i in _mask_indices(before ^ self._mask)]
+        target = self._ckb.encode_bitmask(patient_profile)
+        diff = target ^ self._mask
+        changed = []
+        while diff:
+            low = diff & -diff
+            s_idx = low.bit_length() - 1
+            self._apply(s_idx, bool(target & low))
+            changed.append(self._ckb.symptoms[s_idx])
+            diff ^= low
+        return changed
+
+    def scores(self) -> np.ndarray:
+        """Read-only view of the current percentages, in KB disease order."""
+        view = self._percents.view()
+        view.setflags(write=False)
+        return view
+
+    def _ranking(self, top_k: Optional[int]) -> np.ndarray:
+        """Disease indices of the current ranking (the first ``top_k``), best first."""
+        top_k = _check_top_k(top_k)
+        n_diseases = len(self._percents)
+        if self._order is None and (top_k is None or top_k >= n_diseases):
+            self._order = np.argsort(-self._percents, kind="stable")
+        if self._order is not None:
+            return self._order[:top_k]
+        if self._top is None or self._top[0] != top_k:
+            d_idx, _ = _select_top_k(np.arange(n_diseases), self._percents, top_k)
+            self._top = (top_k, d_idx)
+        return self._top[1]
+
+    def ranked(self, top_k: Optional[int] = None) -> RankedResults:
+        """Current ranking as diagnose() would return it for this profile."""
+        diseases, percents = self._ckb.diseases, self._percents
+        return RankedResults(((diseases[i], float(percents[i])) for i in self._ranking(top_k)),
+                             self._ckb.version)
+
+    def ranked_with_explanation(self, top_k: Optional[int] = None) -> RankedResults:
+        """Current ranking with lazy Explanation objects, as diagnose_with_explanation()."""
+        ckb, percents, mask = self._ckb, self._percents, self._mask
+        return RankedResults(
+            ((ckb.diseases[i], float(percents[i]), Explanation(ckb, int(i), mask, float(percents[i])))
+             for i in self._ranking(top_k)),
+            ckb.version,
+        )
+
+    def what_if(self, symptom_key: str, present: bool = True, top_k: Optional[int] = None) -> RankedResults:
+        """Ranking if ``symptom_key`` were set to ``present``; the session itself is left unchanged."""
+        before = self.is_present(symptom_key)
+        if before == bool(present):
+            return self.ranked(top_k)
+        cached = self._order, self._top
+        self.set_symptom(symptom_key, present)
+        try:
+            return self.ranked(top_k)
+        finally:
+            self.set_symptom(symptom_key, before)
+            self._order, self._top = cached
+
+    def rebase(self, ckb: Optional[CompiledKB] = None) -> None:
+        """Re-score the current symptoms against ``ckb`` (default: the engine's current KB)."""
+        present = sorted(self._wm.asserted) if self._wm is not None else self.present
+        self._reset(ckb if ckb is not None else get_compiled_kb())
+        for key in present:
+            try:
+                self.set_symptom(key, True)
+            except (KeyError, ValueError):
+                pass
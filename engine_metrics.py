@@ -0,0 +1,190 @@
+"""
+Opt-in instrumentation for the inference engine.
+
+inference_engine.enable_metrics() installs an EngineMetrics collector; from
+then on every diagnose(), diagnose_with_explanation() and diagnose_batch()
+call records:
+
+- total latency, time spent encoding the profile and time spent scoring
+  (histograms, seconds);
+- the number of rules evaluated, i.e. rules whose symptom is present in the
+  profile (summed over the batch for diagnose_batch(), zero for cache and
+  table hits) (histogram);
+- which path answered the call: "cache" (result cache), "table"
+  (precomputed answer table), "top_k" (bound-pruned selection), "full"
+  (sparse scoring of the whole KB) or "batch" (counter);
+- profiles per diagnose_batch() call (histogram).
+
+Result-cache hit rates come from the cache's own counters and are added at
+export time. Metrics are exported as a plain dict (snapshot()) or in the
+Prometheus text exposition format (render_prometheus()).
+
+Design notes:
+- When metrics are disabled the engine only checks one module global per
+  call, so the hot path pays next to nothing.
+- Histograms use fixed, Prometheus-style cumulative buckets, so recording is
+  a bisect plus two additions and memory does not grow with traffic.
+- One lock guards all updates because Streamlit calls the engine from
+  several threads.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the latency buckets: 10 us .. 2.5 s.
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+# Upper bounds of the rule-count and batch-size buckets (powers of four).
+COUNT_BUCKETS: Tuple[float, ...] = tuple(float(4 ** i) for i in range(13))
+
+METRIC_PREFIX = "diagnosis_engine"
+
+_HELP = {
+    "call_seconds": "Latency of engine entry points.",
+    "encode_seconds": "Time spent encoding profiles into symptom indices or presence matrices.",
+    "score_seconds": "Time from encoded profile to ranked result, including cache and table lookups.",
+    "rules_evaluated": "Rules evaluated per call.",
+    "batch_size": "Profiles per diagnose_batch() call.",
+}
+
+
+def _format_bound(bound: float) -> str:
+    return str(int(bound)) if bound == int(bound) else repr(bound)
+
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus semantics (cumulative on export)."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate the ``q`` quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.bounds, self.counts):
+            running += n
+            cumulative.append((bound, running))
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": cumulative,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class EngineMetrics:
+    """Collector for engine call statistics, labelled by entry point."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._histograms: Dict[Tuple[str, str], Histogram] = {}
+            self._calls: Dict[Tuple[str, str], int] = {}
+
+    def _histogram(self, name: str, entry: str, bounds: Sequence[float]) -> Histogram:
+        hist = self._histograms.get((name, entry))
+        if hist is None:
+            hist = self._histograms[(name, entry)] = Histogram(bounds)
+        return hist
+
+    def record_call(self, entry: str, source: str, seconds: float, encode_seconds: float,
+                    score_seconds: float, rules: int) -> None:
+        """Record one single-profile call answered by ``source``."""
+        with self._lock:
+            self._calls[(entry, source)] = self._calls.get((entry, source), 0) + 1
+            self._histogram("call_seconds", entry, LATENCY_BUCKETS).observe(seconds)
+            self._histogram("encode_seconds", entry, LATENCY_BUCKETS).observe(encode_seconds)
+            self._histogram("score_seconds", entry, LATENCY_BUCKETS).observe(score_seconds)
+            self._histogram("rules_evaluated", entry, COUNT_BUCKETS).observe(rules)
+
+    def record_batch(self, entry: str, size: int, seconds: float, encode_seconds: float,
+                     score_seconds: float, rules: int) -> None:
+        """Record one batch call over ``size`` profiles."""
+        self.record_call(entry, "batch", seconds, encode_seconds, score_seconds, rules)
+        with self._lock:
+            self._histogram("batch_size", entry, COUNT_BUCKETS).observe(size)
+
+    def snapshot(self, cache_stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Return every metric as plain Python data.
+
+        Layout: {"calls": {entry: {source: n}}, "histograms": {name: {entry:
+        histogram}}, "cache": cache_stats}. Histogram dicts hold count, sum,
+        cumulative (upper bound, count) buckets and estimated p50/p95/p99.
+        """
+        with self._lock:
+            calls: Dict[str, Dict[str, int]] = {}
+            for (entry, source), n in sorted(self._calls.items()):
+                calls.setdefault(entry, {})[source] = n
+            histograms: Dict[str, Dict[str, Any]] = {}
+            for (name, entry), hist in sorted(self._histograms.items()):
+                histograms.setdefault(name, {})[entry] = hist.snapshot()
+        return {"calls": calls, "histograms": histograms, "cache": dict(cache_stats or {})}
+
+    def render_prometheus(self, cache_stats: Optional[Dict[str, Any]] = None) -> str:
+        """Return the metrics in the Prometheus text exposition format (version 0.0.4)."""
+        snap = self.snapshot(cache_stats)
+        lines = [
+            f"# HELP {METRIC_PREFIX}_calls_total Engine calls by entry point and answering path.",
+            f"# TYPE {METRIC_PREFIX}_calls_total counter",
+        ]
+        for entry, sources in snap["calls"].items():
+            for source, n in sources.items():
+                lines.append(f'{METRIC_PREFIX}_calls_total{{entry="{entry}",source="{source}"}} {n}')
+
+        for name, by_entry in snap["histograms"].items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {_HELP[name]}")
+            lines.append(f"# TYPE {metric} histogram")
+            for entry, hist in by_entry.items():
+                for bound, n in hist["buckets"]:
+                    lines.append(f'{metric}_bucket{{entry="{entry}",le="{_format_bound(bound)}"}} {n}')
+                lines.append(f'{metric}_bucket{{entry="{entry}",le="+Inf"}} {hist["count"]}')
+                lines.append(f'{metric}_sum{{entry="{entry}"}} {hist["sum"]!r}')
+                lines.append(f'{metric}_count{{entry="{entry}"}} {hist["count"]}')
+
+        cache = snap["cache"]
+        if cache:
+            for key, kind, help_text in (
+                ("hits", "counter", "Result cache hits."),
+                ("misses", "counter", "Result cache misses."),
+                ("size", "gauge", "Entries in the result cache."),
+                ("maxsize", "gauge", "Capacity of the result cache."),
+                ("hit_rate", "gauge", "Result cache hits / lookups since the last clear."),
+            ):
+                metric = f"{METRIC_PREFIX}_cache_{key}" + ("_total" if kind == "counter" else "")
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {cache.get(key, 0)}")
+        return "\n".join(lines) + "\n"
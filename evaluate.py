@@ -0,0 +1,295 @@
+"""
+Ranking-accuracy evaluation on labelled clinical vignettes.
+
+Usage:
+  python evaluate.py CASES [--format jsonl|csv] [--label-field label]
+                     [--top-k 1,3] [--chunk-size 10000] [--cache scores.sqlite]
+
+CASES holds one patient profile per line (JSONL) or row (CSV) plus the
+expected disease in ``--label-field``. The runner reports top-k accuracy,
+per-disease recall and the top-1 confusion matrix (see EVALUATION.md).
+
+Design notes:
+- Cases are streamed in chunks (batch_score.read_profiles / iter_chunks),
+  so case files far larger than memory are evaluated in constant memory.
+  Within a chunk, cases with the same present symptoms are scored once.
+- Scores are cached per disease, keyed by (disease fingerprint, case key).
+  The fingerprint hashes the disease name, its rules' symptoms and CFs and
+  the penalty fraction, i.e. everything its score depends on; the case key
+  is the sorted list of present KB symptoms. After a KB edit only diseases
+  whose rules changed (and cases presenting newly added symptoms) are
+  rescored; every other score comes from the cache.
+- The cache is a SQLite table. By default it lives in a private temporary
+  file that SQLite deletes on close: only its page cache (a few MB) is held
+  in RAM, but nothing is reused across runs. --cache names a file that keeps
+  scores between runs; ":memory:" keeps every score in RAM, which is fastest
+  but grows with cases x diseases.
+- Rankings use the same formula, rounding and stable tie order as
+  diagnose().
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from batch_score import DEFAULT_CHUNK_SIZE, iter_chunks, read_profiles
+from inference_engine import PENALTY_FRACTION, CompiledKB, _normalise, get_compiled_kb, sum_present_cfs
+
+DEFAULT_LABEL_FIELD = "label"
+DEFAULT_TOP_K = (1, 3)
+
+# Case keys per SQLite "IN (...)" query (below SQLite's variable limit).
+_QUERY_BATCH = 500
+
+
+def disease_fingerprints(ckb: CompiledKB) -> List[str]:
+    """Return one hash per disease covering everything its score depends on."""
+    fingerprints = []
+    for d_idx, disease in enumerate(ckb.diseases):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{PENALTY_FRACTION!r}\x00{disease}".encode("utf-8"))
+        s_indices, cfs = ckb.rule_row(d_idx)
+        for s_idx, cf in sorted(zip(s_indices.tolist(), cfs.tolist()), key=lambda rule: ckb.symptoms[rule[0]]):
+            digest.update(f"\x00{ckb.symptoms[s_idx]}={cf!r}".encode("utf-8"))
+        fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+class ScoreCache:
+    """SQLite-backed store of disease scores keyed by (disease fingerprint, case key).
+
+    ``path`` "" (the default) is a temporary on-disk database deleted on
+    close, so memory stays bounded by SQLite's page cache; ":memory:" holds
+    the whole table in RAM.
+    """
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " disease_fp TEXT NOT NULL, case_key TEXT NOT NULL, percent REAL NOT NULL,"
+            " PRIMARY KEY (disease_fp, case_key)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scores_case ON scores (case_key)")
+
+    def lookup(self, case_keys: Sequence[str], fingerprints: Sequence[str]) -> np.ndarray:
+        """Return a (len(case_keys), len(fingerprints)) array of cached scores, NaN where missing."""
+        row_of = {key: i for i, key in enumerate(case_keys)}
+        col_of = {fp: j for j, fp in enumerate(fingerprints)}
+        scores = np.full((len(case_keys), len(fingerprints)), np.nan)
+        for start in range(0, len(case_keys), _QUERY_BATCH):
+            batch = case_keys[start:start + _QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            query = f"SELECT disease_fp, case_key, percent FROM scores WHERE case_key IN ({placeholders})"
+            for fp, key, percent in self._conn.execute(query, batch):
+                j = col_of.get(fp)
+                if j is not None:
+                    scores[row_of[key], j] = percent
+        return scores
+
+    def store(self, rows: Iterable[Tuple[str, str, float]]) -> None:
+        """Insert (disease fingerprint, case key, percent) rows."""
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", rows)
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class EvaluationReport:
+    """Accumulated accuracy statistics.
+
+    Attributes:
+      top_k: the k values tracked, ascending.
+      cases: number of labelled cases evaluated.
+      hits: {k: cases whose label is within the top k}.
+      per_disease: {label: {"cases": n, k: hits, ...}}.
+      confusion: {label: Counter(top-1 prediction -> n)}.
+      scored, reused: disease scores computed vs taken from the cache.
+      kb_version: version of the knowledge base evaluated.
+    """
+
+    def __init__(self, top_k: Sequence[int] = DEFAULT_TOP_K, kb_version: Optional[int] = None):
+        self.top_k = tuple(sorted(set(top_k)))
+        self.kb_version = kb_version
+        self.cases = 0
+        self.hits: Dict[int, int] = {k: 0 for k in self.top_k}
+        self.per_disease: Dict[str, Dict[Any, int]] = defaultdict(lambda: dict.fromkeys(("cases",) + self.top_k, 0))
+        self.confusion: Dict[str, Counter] = defaultdict(Counter)
+        self.scored = 0
+        self.reused = 0
+
+    def add(self, label: str, label_rank: Optional[int], predicted: str) -> None:
+        """Record one case whose label ranked ``label_rank`` (0 = first, None = not in the KB)."""
+        self.cases += 1
+        stats = self.per_disease[label]
+        stats["cases"] += 1
+        for k in self.top_k:
+            if label_rank is not None and label_rank < k:
+                self.hits[k] += 1
+                stats[k] += 1
+        self.confusion[label][predicted] += 1
+
+    def accuracy(self, k: int) -> float:
+        """Fraction of cases whose label is within the top ``k``."""
+        return self.hits[k] / self.cases if self.cases else 0.0
+
+    def recall(self, label: str, k: int = 1) -> float:
+        """Fraction of ``label`` cases whose label is within the top ``k``."""
+        stats = self.per_disease.get(label)
+        return stats[k] / stats["cases"] if stats and stats["cases"] else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "kb_version": self.kb_version,
+            "cases": self.cases,
+            "accuracy": {f"top{k}": self.accuracy(k) for k in self.top_k},
+            "recall": {
+                label: {"cases": stats["cases"], **{f"top{k}": self.recall(label, k) for k in self.top_k}}
+                for label, stats in sorted(self.per_disease.items())
+            },
+            "confusion": {label: dict(row) for label, row in sorted(self.confusion.items())},
+            "scored": self.scored,
+            "reused": self.reused,
+        }
+
+
+def _case_key(ckb: CompiledKB, profile: Dict[str, Any]) -> str:
+    return ",".join(sorted(ckb.symptoms[i] for i in ckb.encode_indices(profile)))
+
+
+def _score_columns(ckb: CompiledKB, presence: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """Percentages of the diseases in ``columns`` only, as (N, len(columns))."""
+    raw = (1.0 + PENALTY_FRACTION) * sum_present_cfs(presence, ckb.cf_rows(columns)) - ckb.penalty_base[columns]
+    return _normalise(raw, ckb.max_scores[columns])
+
+
+def _chunk_scores(ckb: CompiledKB, fingerprints: List[str], cache: ScoreCache, profiles: List[Dict[str, Any]],
+                  report: EvaluationReport) -> Tuple[np.ndarray, List[int]]:
+    """Score the unique presence sets of a chunk, reusing cached disease scores."""
+    rows: Dict[str, int] = {}
+    representatives: List[Dict[str, Any]] = []
+    case_rows = []
+    for profile in profiles:
+        key = _case_key(ckb, profile)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = len(representatives)
+            representatives.append(profile)
+        case_rows.append(row)
+
+    keys = list(rows)
+    scores = cache.lookup(keys, fingerprints)
+    missing = np.isnan(scores)
+    stale = np.flatnonzero(missing.any(axis=0))
+    if stale.size:
+        rescore_rows = np.flatnonzero(missing[:, stale].any(axis=1))
+        presence = ckb.encode_batch([representatives[i] for i in rescore_rows])
+        fresh = _score_columns(ckb, presence, stale)
+        block = scores[np.ix_(rescore_rows, stale)]
+        fill = np.isnan(block)
+        block[fill] = fresh[fill]
+        scores[np.ix_(rescore_rows, stale)] = block
+        rr, cc = np.nonzero(fill)
+        cache.store((fingerprints[stale[c]], keys[rescore_rows[r]], float(block[r, c])) for r, c in zip(rr, cc))
+        report.scored += int(fill.sum())
+    report.reused += int(scores.size - missing.sum())
+    return scores, case_rows
+
+
+def evaluate_cases(cases: Iterable[Dict[str, Any]], label_field: str = DEFAULT_LABEL_FIELD,
+                   top_k: Sequence[int] = DEFAULT_TOP_K, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   cache: Optional[ScoreCache] = None, ckb: Optional[CompiledKB] = None) -> EvaluationReport:
+    """Evaluate labelled cases against ``ckb`` (default: the engine's current KB).
+
+    Pass the same ``cache`` to repeated runs (or a file-backed one across
+    processes) to reuse scores of diseases that did not change. Without one,
+    a temporary on-disk cache is used for this run only.
+    """
+    if cache is None:
+        cache = ScoreCache()
+        try:
+            return evaluate_cases(cases, label_field, top_k, chunk_size, cache, ckb)
+        finally:
+            cache.close()
+    ckb = ckb if ckb is not None else get_compiled_kb()
+    fingerprints = disease_fingerprints(ckb)
+    disease_index = {d: i for i, d in enumerate(ckb.diseases)}
+    report = EvaluationReport(top_k, ckb.version)
+
+    for chunk in iter_chunks(cases, chunk_size):
+        scores, case_rows = _chunk_scores(ckb, fingerprints, cache, chunk, report)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(scores.shape[1]), axis=1)
+        for profile, row in zip(chunk, case_rows):
+            label = str(profile.get(label_field, ""))
+            d_idx = disease_index.get(label)
+            label_rank = int(ranks[row, d_idx]) if d_idx is not None else None
+            predicted = ckb.diseases[order[row, 0]] if len(ckb.diseases) else ""
+            report.add(label, label_rank, predicted)
+    return report
+
+
+def format_report(report: EvaluationReport) -> str:
+    """Render a report as the plain-text tables printed by the CLI."""
+    lines = [f"Cases: {report.cases} (KB version {report.kb_version})"]
+    lines += [f"Top-{k} accuracy: {report.accuracy(k):.1%}" for k in report.top_k]
+    lines.append(f"Scores computed: {report.scored}, reused from cache: {report.reused}")
+    lines.append("")
+    header = f"{'Disease':24s} {'cases':>6s} " + " ".join(f"{f'recall@{k}':>9s}" for k in report.top_k)
+    lines.append(header)
+    for label, stats in sorted(report.per_disease.items()):
+        recalls = " ".join(f"{report.recall(label, k):>9.1%}" for k in report.top_k)
+        lines.append(f"{label:24s} {stats['cases']:>6d} {recalls}")
+
+    predicted = sorted({p for row in report.confusion.values() for p in row})
+    lines.append("")
+    lines.append("Top-1 confusion (rows: label, columns: prediction)")
+    lines.append(f"{'':24s} " + " ".join(f"{p[:10]:>10s}" for p in predicted))
+    for label, row in sorted(report.confusion.items()):
+        lines.append(f"{label:24s} " + " ".join(f"{row.get(p, 0):>10d}" for p in predicted))
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Top-k accuracy of the engine on labelled vignettes.")
+    parser.add_argument("cases", help="labelled cases as JSONL or CSV")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="input format (default: from extension)")
+    parser.add_argument("--label-field", default=DEFAULT_LABEL_FIELD, help="field holding the expected disease")
+    parser.add_argument("--top-k", default=",".join(map(str, DEFAULT_TOP_K)), help="comma-separated k values")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="cases scored per chunk")
+    parser.add_argument("--cache", default="",
+                        help="SQLite file to keep scores in between runs (default: a temporary file deleted on "
+                             "exit, nothing reused); ':memory:' is faster but keeps every score in RAM")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.cases.lower().endswith(".csv") else "jsonl")
+    top_k = [int(k) for k in args.top_k.split(",") if k]
+    cache = ScoreCache(args.cache)
+    try:
+        with open(args.cases, newline="" if fmt == "csv" else None) as fh:
+            report = evaluate_cases(read_profiles(fh, fmt), args.label_field, top_k, args.chunk_size, cache)
+    finally:
+        cache.close()
+
+    if args.json:
+        print(json.dumps(report.as_dict(), indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
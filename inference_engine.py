@@ -23,147 +23,1024 @@ for clarity and grading. More advanced CF combination rules exist (e.g., MYCIN
 style combination), but they are out of scope for this assignment.
 """
 
-from typing import Dict, List, Tuple, Any
-from knowledge_base import KNOWLEDGE_BASE
+import itertools
+from collections.abc import Mapping
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple, Any, Optional
 
+import numpy as np
 
-def _disease_max_score(disease_rules: Dict[str, float]) -> float:
-    """Return the maximum (sum) of positive CFs for a disease.
+import knowledge_base
+from engine_metrics import EngineMetrics
+from knowledge_base import DERIVED_FACTS, KNOWLEDGE_BASE
+from profile_schema import ProfileSchema
+from result_cache import LRUCache
+from results import CompactBatchResults, DiagnosisRecord, RankedResults
+from rule_network import DerivedRules, RuleNetwork
 
-    We use this to normalise the raw score into a percentage.
+# Fraction of an expected-but-absent symptom's CF subtracted from the score.
+PENALTY_FRACTION = 0.5
+
+# The profile space of a KB's schema is finite (4 x 4 x 2**6 = 1024 profiles
+# for the bundled KB), so the ranked answer for every reachable presence set
+# can be precomputed. The table is skipped when it would hold more than this
+# many (disease, score) cells, i.e. for very large knowledge bases.
+ANSWER_TABLE_MAX_CELLS = 2_000_000
+
+# Number of "n largest CFs" sums kept per disease for top-k upper bounds.
+TOP_K_BOUND_DEPTH = 16
+# Rows densified at a time when a from_rules() KB needs per-row dense sums.
+_DENSE_BLOCK_CELLS = 1_000_000
+_BOUND_SLACK = 1e-9
+_answer_table_enabled = True
+
+# Recently computed results keyed by (kind, profile bitmask); see result_cache.
+_result_cache = LRUCache()
+# Source of CompiledKB.cache_token values.
+_cache_tokens = itertools.count()
+
+# Installed by enable_metrics(); None keeps the hot path uninstrumented.
+_metrics: Optional[EngineMetrics] = None
+
+
+class CompiledKB:
+    """Dense, read-only form of a knowledge base used on the scoring hot path.
+
+    The per-disease rule dicts are flattened into a disease x symptom CF
+    matrix (zero where a disease has no rule for a symptom). Because every
+    rule either adds its CF (symptom present) or subtracts
+    PENALTY_FRACTION * CF (symptom absent), the raw score of a disease is
+
+        raw = (1 + PENALTY_FRACTION) * sum(cf of present) - PENALTY_FRACTION * sum(all cf)
+
+    so scoring a profile only needs the per-disease sum of the CFs of its
+    present symptoms. The second term and the normalising max score do not
+    depend on the patient and are precomputed here.
+
+    Every scoring path (dense batches, the answer table, the inverted index,
+    incremental sessions) computes that sum with the same kernel: starting
+    from 0.0, the present symptoms' CFs are added one at a time in ascending
+    symptom index (see sum_present_cfs). Adding the 0.0 of a missing rule
+    leaves a float unchanged, so skipping diseases without a rule gives the
+    same bits, and all paths land on the same 0.1 rounding boundaries. A
+    BLAS matrix product would not: its summation order depends on the
+    matrix shape and the library.
+
+    For very large knowledge bases the same formula is evaluated sparsely
+    through an inverted index (symptom -> diseases with a rule for it): only
+    diseases mentioned by a present symptom need a score, every other disease
+    keeps its precomputed "nothing present" baseline.
+
+    When disease rules reference derived facts (``derived``, in the format
+    of knowledge_base.DERIVED_FACTS), a RuleNetwork is compiled for just the
+    facts they need and every encoder adds the derived facts to the present
+    set, so the scoring paths treat them like ordinary symptoms.
     """
-    total = 0.0
-    for v in disease_rules.values():
-        if isinstance(v, dict):
-            total += max(0.0, float(v.get("cf", 0.0)))
+
+    def __init__(self, kb: Dict[str, Dict[str, Any]], version: int = 0, derived: Optional[DerivedRules] = None):
+        diseases = tuple(kb.keys())
+        symptoms = tuple(knowledge_base.get_symptom_keys(kb))
+        symptom_index = {s: i for i, s in enumerate(symptoms)}
+
+        cf = np.zeros((len(diseases), len(symptoms)), dtype=np.float64)
+        explains: Dict[Tuple[int, int], str] = {}
+        for d_idx, rules in enumerate(kb.values()):
+            for symptom_key, rule_val in rules.items():
+                s_idx = symptom_index[symptom_key]
+                if isinstance(rule_val, dict):
+                    cf[d_idx, s_idx] = float(rule_val.get("cf", 0.0))
+                    explains[(d_idx, s_idx)] = rule_val.get("explain", "")
+                else:
+                    cf[d_idx, s_idx] = float(rule_val)
+                    explains[(d_idx, s_idx)] = ""
+        self._set_arrays(diseases, symptoms, cf, explains, version)
+        self._set_network(derived)
+
+    @classmethod
+    def from_arrays(cls, diseases, symptoms, cf: np.ndarray, explains: Optional[Dict[Tuple[int, int], str]] = None,
+                    version: int = 0, max_scores: Optional[np.ndarray] = None,
+                    penalty_base: Optional[np.ndarray] = None, derived: Optional[DerivedRules] = None) -> "CompiledKB":
+        """Build a CompiledKB around existing arrays without copying them.
+
+        Used to wrap arrays that live outside the Python heap (shared memory,
+        memory-mapped files). ``max_scores`` and ``penalty_base`` are derived
+        from ``cf`` when not supplied.
+        """
+        self = cls.__new__(cls)
+        self._set_arrays(tuple(diseases), tuple(symptoms), cf, explains or {}, version, max_scores, penalty_base)
+        self._set_network(derived)
+        return self
+
+    @classmethod
+    def from_rules(cls, diseases, symptoms, rule_disease: np.ndarray, rule_symptom: np.ndarray,
+                   rule_cf: np.ndarray, explains: Optional[Dict[Tuple[int, int], str]] = None,
+                   version: int = 0, max_scores: Optional[np.ndarray] = None,
+                   penalty_base: Optional[np.ndarray] = None, derived: Optional[DerivedRules] = None) -> "CompiledKB":
+        """Build a CompiledKB from one (disease, symptom, CF) triplet per rule.
+
+        The triplets are kept grouped by disease (KB order within a disease)
+        and every scoring and explanation path reads them through the
+        inverted index or a disease's row, so the dense ``cf`` matrix is only
+        built if someone reads ``cf`` itself (e.g. sharding, sensitivity).
+        ``max_scores`` and ``penalty_base`` are derived a block of rows at a
+        time when not supplied.
+        """
+        rule_disease, rule_symptom, rule_cf = (np.asarray(a) for a in (rule_disease, rule_symptom, rule_cf))
+        if len(rule_disease) and (np.diff(rule_disease) < 0).any():
+            order = np.argsort(rule_disease, kind="stable")
+            rule_disease, rule_symptom, rule_cf = rule_disease[order], rule_symptom[order], rule_cf[order]
+        self = cls.__new__(cls)
+        self._set_arrays(tuple(diseases), tuple(symptoms), None, explains or {}, version, max_scores, penalty_base,
+                         rules=(rule_disease, rule_symptom, rule_cf))
+        self._set_network(derived)
+        return self
+
+    def _set_network(self, derived: Optional[DerivedRules]) -> None:
+        needed = [s for s in self.symptoms if s in derived] if derived else []
+        # Only rules feeding symptoms the diseases use are kept; the rule
+        # definitions stay available (e.g. for shipping to worker processes).
+        self.derived = {f: derived[f] for f in RuleNetwork(derived, needed).rules} if needed else None
+        self.network: Optional[RuleNetwork] = RuleNetwork(self.derived) if needed else None
+
+    @property
+    def schema(self) -> ProfileSchema:
+        """Profile fields of this KB: its symptom keys, grouped by
+        knowledge_base.MULTI_VALUED_FIELDS (see profile_schema).
+
+        Derived facts are not profile fields; the base facts their rules test
+        are, even when no disease has a rule for them.
+        """
+        if self._schema is None:
+            keys = list(self.symptoms)
+            if self.network is not None:
+                keys += sorted(self.network.conditions)
+                keys = [k for k in keys if k not in self.network.rules]
+            schema = ProfileSchema(keys, knowledge_base.MULTI_VALUED_FIELDS)
+            # _schema is the "built" flag other threads test, so publish the
+            # columns it needs first.
+            self._schema_columns = np.array([self.symptom_index.get(k, -1) for k in schema.keys],
+                                            dtype=np.intp)
+            self._schema = schema
+        return self._schema
+
+    def _present(self, patient_profile: Dict[str, Any]) -> set:
+        """Present symptom keys of a profile, including derived facts."""
+        present = self.schema.present(patient_profile)
+        return present if self.network is None else self.network.closure(present)
+
+    def _set_arrays(self, diseases, symptoms, cf, explains, version, max_scores=None, penalty_base=None, rules=None):
+        self.version = version
+        # Identifies this instance in result caches; versions are caller
+        # supplied and may repeat across KBs.
+        self.cache_token = next(_cache_tokens)
+        self.diseases: Tuple[str, ...] = diseases
+        self.symptoms: Tuple[str, ...] = symptoms
+        self.symptom_index: Dict[str, int] = {s: i for i, s in enumerate(symptoms)}
+        if cf is not None and cf.flags.writeable:
+            cf.setflags(write=False)
+        self._cf = cf
+        self._rules = rules
+        self._row_ptr = None
+        if rules is not None:
+            self._row_ptr = np.searchsorted(rules[0], np.arange(len(diseases) + 1))
+        self.explains = explains
+        if max_scores is None:
+            max_scores = self._row_sums(lambda rows: np.clip(rows, 0.0, None))
+        if penalty_base is None:
+            penalty_base = PENALTY_FRACTION * self._row_sums(lambda rows: rows)
+        self.max_scores = max_scores
+        self.penalty_base = penalty_base
+        self._present_weight = 1.0 + PENALTY_FRACTION
+        self._answer_table: Optional[Dict[int, Tuple[Tuple[str, float], ...]]] = None
+        self._postings: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        self._disease_rules: Optional[List[Tuple[int, ...]]] = None
+        self._baseline: Optional[np.ndarray] = None
+        self._baseline_order: Optional[np.ndarray] = None
+        self._bound_sums: Optional[np.ndarray] = None
+        self._rule_counts: Optional[np.ndarray] = None
+        self._schema: Optional[ProfileSchema] = None
+
+    @property
+    def cf(self) -> np.ndarray:
+        """Read-only (n_diseases, n_symptoms) CF matrix, densified on first use for from_rules() KBs."""
+        if self._cf is None:
+            rule_disease, rule_symptom, rule_cf = self._rules
+            cf = np.zeros((len(self.diseases), len(self.symptoms)))
+            cf[rule_disease, rule_symptom] = rule_cf
+            cf.setflags(write=False)
+            self._cf = cf
+        return self._cf
+
+    def _row_sums(self, transform: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Per-disease ``transform(cf row).sum()``, densifying at most _DENSE_BLOCK_CELLS at a time.
+
+        Rows are summed exactly as ``transform(cf).sum(axis=1)`` would, so a
+        from_rules() KB gets the bits of its dense equivalent.
+        """
+        if self._cf is not None:
+            return transform(self._cf).sum(axis=1)
+        n_diseases, n_symptoms = len(self.diseases), len(self.symptoms)
+        sums = np.zeros(n_diseases)
+        step = max(1, _DENSE_BLOCK_CELLS // max(1, n_symptoms))
+        rule_disease, rule_symptom, rule_cf = self._rules
+        for start in range(0, n_diseases, step):
+            stop = min(start + step, n_diseases)
+            lo, hi = self._row_ptr[start], self._row_ptr[stop]
+            block = np.zeros((stop - start, n_symptoms))
+            block[rule_disease[lo:hi] - start, rule_symptom[lo:hi]] = rule_cf[lo:hi]
+            sums[start:stop] = transform(block).sum(axis=1)
+        return sums
+
+    def rule_row(self, d_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(symptom indices, CFs) of one disease's rules, in knowledge-base order."""
+        if self._rules is not None:
+            lo, hi = self._row_ptr[d_idx], self._row_ptr[d_idx + 1]
+            return self._rules[1][lo:hi], self._rules[2][lo:hi]
+        s_indices = np.array(self.disease_rules(d_idx), dtype=np.intp)
+        return s_indices, self.cf[d_idx, s_indices]
+
+    def rule_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(disease, symptom, CF) per rule, grouped by disease in knowledge-base order."""
+        if self._rules is not None:
+            return self._rules
+        rule_disease = np.repeat(np.arange(len(self.diseases)),
+                                 [len(self.disease_rules(d)) for d in range(len(self.diseases))])
+        rule_symptom = np.array([s for d in range(len(self.diseases)) for s in self.disease_rules(d)],
+                                dtype=np.intp)
+        return rule_disease, rule_symptom, self.cf[rule_disease, rule_symptom]
+
+    def cf_rows(self, d_idx: np.ndarray) -> np.ndarray:
+        """Dense CF rows of the diseases ``d_idx``, as ``cf[d_idx]`` without densifying the whole KB."""
+        if self._cf is not None:
+            return self._cf[d_idx]
+        d_idx = np.asarray(d_idx, dtype=np.intp)
+        lo, hi = self._row_ptr[d_idx], self._row_ptr[d_idx + 1]
+        counts = hi - lo
+        rule_pos = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        rows = np.zeros((len(d_idx), len(self.symptoms)))
+        rows[np.repeat(np.arange(len(d_idx)), counts), self._rules[1][rule_pos]] = self._rules[2][rule_pos]
+        return rows
+
+    def symptom_cfs(self, d_idx: np.ndarray, s_idx: int) -> np.ndarray:
+        """CF of symptom ``s_idx`` for each disease in ``d_idx`` (0.0 where it has no rule)."""
+        if self._cf is not None:
+            return self._cf[d_idx, s_idx]
+        post_d, post_cf = self.inverted_index()[s_idx]
+        cfs = np.zeros(len(d_idx))
+        pos = np.searchsorted(post_d, d_idx)
+        found = pos < len(post_d)
+        found[found] = post_d[pos[found]] == d_idx[found]
+        cfs[found] = post_cf[pos[found]]
+        return cfs
+
+    def encode(self, patient_profile: Dict[str, Any]) -> np.ndarray:
+        """Return the 0/1 presence vector for a patient profile."""
+        presence = np.zeros(len(self.symptoms), dtype=np.float64)
+        for key in self._present(patient_profile):
+            s_idx = self.symptom_index.get(key)
+            if s_idx is not None:
+                presence[s_idx] = 1.0
+        return presence
+
+    def encode_indices(self, patient_profile: Dict[str, Any]) -> List[int]:
+        """Return the sorted symptom indices present in a patient profile."""
+        index = self.symptom_index
+        return sorted(index[key] for key in self._present(patient_profile) if key in index)
+
+    def encode_bitmask(self, patient_profile: Dict[str, Any]) -> int:
+        """Return the presence set of a profile as an integer (bit i = symptom i)."""
+        mask = 0
+        for key in self._present(patient_profile):
+            s_idx = self.symptom_index.get(key)
+            if s_idx is not None:
+                mask |= 1 << s_idx
+        return mask
+
+    def answer_table(self) -> Optional[Dict[int, Tuple[Tuple[str, float], ...]]]:
+        """Return the bitmask -> ranked results table, building it on first use.
+
+        Every profile the engine understands is enumerated, scored in one
+        batch and stored under its bitmask. Returns None when the table would
+        exceed ANSWER_TABLE_MAX_CELLS. The table belongs to this CompiledKB,
+        so a KB change (which produces a new CompiledKB) also rebuilds it.
+        """
+        if self._answer_table is None:
+            if self.schema.n_profiles * len(self.diseases) > ANSWER_TABLE_MAX_CELLS:
+                return None
+            profiles = list(self.schema.profiles())
+            percents = self.percentages(self.encode_batch(profiles))
+            order = np.argsort(-percents, axis=1, kind="stable")
+            table = {}
+            for row, profile in enumerate(profiles):
+                scores = percents[row]
+                table[self.encode_bitmask(profile)] = tuple(
+                    (self.diseases[i], float(scores[i])) for i in order[row]
+                )
+            self._answer_table = table
+        return self._answer_table
+
+    def encode_batch(self, profiles, text: bool = False) -> np.ndarray:
+        """Return an (N, n_symptoms) 0/1 presence matrix for many profiles.
+
+        ``profiles`` is a sequence of profile dicts, a columnar mapping of
+        profile field -> sequence/array of N values (e.g. the columns of a
+        DataFrame) or a NumPy structured array; see ProfileSchema.encode.
+        ``text=True`` parses string columns as CSV text. Derived facts are
+        evaluated column-wise for the whole batch.
+        """
+        schema = self.schema
+        base = schema.encode(profiles, text)
+        presence = np.zeros((base.shape[0], len(self.symptoms)), dtype=np.float64)
+        used = self._schema_columns >= 0
+        presence[:, self._schema_columns[used]] = base[:, used]
+        if self.network is not None:
+            absent = np.zeros(base.shape[0], dtype=bool)
+            key_index = schema.key_index
+            derived = self.network.derive_columns(
+                lambda fact: base[:, key_index[fact]] if fact in key_index else absent
+            )
+            for fact, col in derived.items():
+                s_idx = self.symptom_index.get(fact)
+                if s_idx is not None:
+                    presence[:, s_idx] = col
+        return presence
+
+    def raw_scores(self, presence: np.ndarray) -> np.ndarray:
+        """Raw (un-normalised) scores for one presence vector or a matrix of them."""
+        if self._cf is None:
+            return self._present_weight * self._sum_present_postings(presence) - self.penalty_base
+        return self._present_weight * sum_present_cfs(presence, self.cf) - self.penalty_base
+
+    def _sum_present_postings(self, presence: np.ndarray) -> np.ndarray:
+        """sum_present_cfs() through the inverted index: same order, same bits, no dense matrix."""
+        single = presence.ndim == 1
+        present = np.atleast_2d(presence).astype(bool)
+        support = np.zeros((present.shape[0], len(self.diseases)))
+        postings = self.inverted_index()
+        for s in np.flatnonzero(present.any(axis=0)):
+            d_idx, cfs = postings[s]
+            rows = np.flatnonzero(present[:, s])
+            support[np.ix_(rows, d_idx)] += cfs
+        return support[0] if single else support
+
+    def percentages(self, presence: np.ndarray) -> np.ndarray:
+        """Clamped, normalised percentages rounded to one decimal place."""
+        return _normalise(self.raw_scores(presence), self.max_scores)
+
+    def disease_rules(self, d_idx: int) -> Tuple[int, ...]:
+        """Symptom indices a disease has rules for, in knowledge-base order."""
+        if self._rules is not None:
+            return tuple(self.rule_row(d_idx)[0].tolist())
+        if self._disease_rules is None:
+            rules: List[List[int]] = [[] for _ in self.diseases]
+            if self.explains:
+                for rule_d, rule_s in self.explains:
+                    rules[rule_d].append(rule_s)
+            else:
+                for rule_d, rule_s in zip(*np.nonzero(self.cf)):
+                    rules[rule_d].append(int(rule_s))
+            self._disease_rules = [tuple(r) for r in rules]
+        return self._disease_rules[d_idx]
+
+    def inverted_index(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return the postings list per symptom: (disease indices, CFs), built on first use."""
+        if self._postings is None:
+            postings = []
+            if self._cf is None:
+                rule_disease, rule_symptom, rule_cf = self._nonzero_rules()
+                order = np.lexsort((rule_disease, rule_symptom))
+                bounds = np.searchsorted(rule_symptom[order], np.arange(len(self.symptoms) + 1))
+                for start, stop in zip(bounds[:-1], bounds[1:]):
+                    rows = order[start:stop]
+                    postings.append((rule_disease[rows].astype(np.int32), rule_cf[rows]))
+            else:
+                for s_idx in range(len(self.symptoms)):
+                    column = self.cf[:, s_idx]
+                    d_idx = np.flatnonzero(column).astype(np.int32)
+                    postings.append((d_idx, column[d_idx]))
+            self._postings = postings
+        return self._postings
+
+    def _nonzero_rules(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The from_rules() triplets of rules with a non-zero CF (the non-zeros of ``cf``)."""
+        rule_disease, rule_symptom, rule_cf = self._rules
+        nonzero = rule_cf != 0.0
+        return rule_disease[nonzero], rule_symptom[nonzero], rule_cf[nonzero]
+
+    def symptom_rule_counts(self) -> np.ndarray:
+        """Number of diseases with a rule for each symptom."""
+        if self._rule_counts is None:
+            if self._cf is None:
+                self._rule_counts = np.bincount(self._nonzero_rules()[1], minlength=len(self.symptoms))
+            else:
+                self._rule_counts = np.count_nonzero(self.cf, axis=0)
+        return self._rule_counts
+
+    def baseline_percentages(self) -> np.ndarray:
+        """Percentages of every disease when no symptom is present."""
+        if self._baseline is None:
+            self._baseline = _normalise(-self.penalty_base, self.max_scores)
+        return self._baseline
+
+    def _gather_present(self, s_indices: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (referenced disease indices, summed CF of their present symptoms).
+
+        The postings lists are added in ascending symptom order, the order of
+        sum_present_cfs(), so the sums are bit-identical to the dense path.
+        """
+        postings = self.inverted_index()
+        s_indices = sorted(s_indices)
+        n_diseases = len(self.diseases)
+        support = np.zeros(n_diseases)
+        hit = np.zeros(n_diseases, dtype=bool)
+        for s in s_indices:
+            d_idx, cfs = postings[s]
+            support[d_idx] += cfs
+            hit[d_idx] = True
+        touched = np.flatnonzero(hit).astype(np.int32)
+        return touched, support[touched]
+
+    def present_support(self, d_idx: np.ndarray, s_indices: List[int]) -> np.ndarray:
+        """Summed CF of the present symptoms ``s_indices`` for diseases ``d_idx``.
+
+        Same summation order as sum_present_cfs(), so the sums are
+        bit-identical to every other scoring path.
+        """
+        support = np.zeros(len(d_idx))
+        for s in sorted(s_indices):
+            support += self.symptom_cfs(d_idx, s)
+        return support
+
+    def score_present(self, s_indices: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Score only the diseases referenced by the present symptoms.
+
+        Returns (disease indices, percentages) for those diseases; every other
+        disease scores baseline_percentages(). Cost is proportional to the
+        length of the postings lists of ``s_indices``, not to the KB size.
+        """
+        if not s_indices:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        touched, support = self._gather_present(s_indices)
+        raw = self._present_weight * support - self.penalty_base[touched]
+        return touched, _normalise(raw, self.max_scores[touched])
+
+    def _upper_bounds(self, d_idx: np.ndarray, n_present: int) -> np.ndarray:
+        """Highest percentage diseases ``d_idx`` could reach with ``n_present`` symptoms present.
+
+        Uses the precomputed sum of each disease's ``n_present`` largest CFs;
+        beyond TOP_K_BOUND_DEPTH symptoms it falls back to every positive CF.
+        """
+        if self._bound_sums is None:
+            depth = min(TOP_K_BOUND_DEPTH, len(self.symptoms))
+            if self._cf is None:
+                top_cfs = self._top_rule_cfs(depth)
+            else:
+                top_cfs = -np.sort(-self.cf, axis=1)[:, :depth]
+            self._bound_sums = np.cumsum(top_cfs, axis=1)
+        if 0 < n_present <= self._bound_sums.shape[1]:
+            best_support = self._bound_sums[d_idx, n_present - 1]
+        else:
+            best_support = self.max_scores[d_idx]
+        # The bound is summed in a different order than the exact score; a
+        # little slack keeps rounding from pushing it below that score.
+        best_support = best_support + _BOUND_SLACK
+        raw = self._present_weight * best_support - self.penalty_base[d_idx]
+        return _normalise(raw, self.max_scores[d_idx])
+
+    def _top_rule_cfs(self, depth: int) -> np.ndarray:
+        """The first ``depth`` entries of each dense CF row sorted descending, built from the triplets.
+
+        A dense row is its positive CFs, then zeros (symptoms without a rule),
+        then its negative CFs, each in descending order.
+        """
+        rule_disease, _, rule_cf = self._nonzero_rules()
+        order = np.lexsort((-rule_cf, rule_disease))
+        rule_disease, rule_cf = rule_disease[order], rule_cf[order]
+        row_start = np.searchsorted(rule_disease, np.arange(len(self.diseases) + 1))
+        position = np.arange(len(rule_disease)) - row_start[rule_disease]
+        n_rules = np.diff(row_start)
+        negative = rule_cf < 0.0
+        position[negative] += len(self.symptoms) - n_rules[rule_disease[negative]]
+        keep = position < depth
+        top_cfs = np.zeros((len(self.diseases), depth))
+        top_cfs[rule_disease[keep], position[keep]] = rule_cf[keep]
+        return top_cfs
+
+    def top_k(self, s_indices: List[int], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (disease indices, percentages) of the k best diseases, best first.
+
+        Equivalent to the first k entries of a full stable ranking, but:
+        - diseases not referenced by a present symptom score their baseline,
+          and the baseline ranking is precomputed, so only the first k of
+          them (skipping referenced ones) are ever looked at;
+        - referenced diseases whose upper bound falls below the k-th best
+          baseline candidate are dropped before exact scoring;
+        - the survivors are ranked by partial selection, not a full sort.
+        """
+        if k <= 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        baseline = self.baseline_percentages()
+        if self._baseline_order is None:
+            self._baseline_order = np.argsort(-baseline, kind="stable")
+
+        if s_indices:
+            touched, support = self._gather_present(s_indices)
         else:
-            total += max(0.0, float(v))
-    return total
+            touched, support = np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        # The k best diseases that no present symptom mentions
+        prefix = self._baseline_order[: k + len(touched)]
+        untouched = prefix[~np.isin(prefix, touched, assume_unique=True)][:k]
 
+        if len(untouched) == k and len(touched):
+            threshold = baseline[untouched[-1]]
+            keep = self._upper_bounds(touched, len(s_indices)) >= threshold
+            touched, support = touched[keep], support[keep]
 
-def diagnose(patient_profile: Dict[str, str or bool]) -> List[Tuple[str, float]]:
+        raw = self._present_weight * support - self.penalty_base[touched]
+        touched_scores = _normalise(raw, self.max_scores[touched])
+
+        cand_idx = np.concatenate([touched.astype(np.intp), untouched.astype(np.intp)])
+        cand_scores = np.concatenate([touched_scores, baseline[untouched]])
+        return _select_top_k(cand_idx, cand_scores, k)
+
+    def percentages_sparse(self, s_indices: List[int]) -> np.ndarray:
+        """Full percentage vector computed through the inverted index."""
+        percents = self.baseline_percentages().copy()
+        touched, scores = self.score_present(s_indices)
+        percents[touched] = scores
+        return percents
+
+
+def sum_present_cfs(presence: np.ndarray, cf: np.ndarray) -> np.ndarray:
+    """Per-disease sum of the CFs of the present symptoms: the engine's one summation kernel.
+
+    presence: (n_symptoms,) or (N, n_symptoms) 0/1 values.
+    cf: (n_diseases, n_symptoms) CFs, or a stack (..., n_diseases, n_symptoms)
+      of CF matrices (e.g. perturbed samples).
+
+    Returns an (..., [N,] n_diseases) array. CFs are added one symptom at a
+    time in ascending symptom index, starting from 0.0, with one masked
+    in-place add per symptom that is present in any row. This is slower than
+    a BLAS product but gives the same bits on every path and machine.
+    """
+    presence = np.asarray(presence)
+    single = presence.ndim == 1
+    present = np.atleast_2d(presence) != 0
+    n_rows = present.shape[0]
+    support = np.zeros(cf.shape[:-2] + (n_rows, cf.shape[-2]))
+    for s in np.flatnonzero(present.any(axis=0)):
+        column = np.ascontiguousarray(cf[..., s])[..., None, :]
+        np.add(support, column, out=support, where=present[:, s, None])
+    return support[..., 0, :] if single else support
+
+
+def _normalise(raw: np.ndarray, max_scores: np.ndarray) -> np.ndarray:
+    """Clamp raw / max to [0, 1] and express it as a percentage with one decimal."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(max_scores > 0.0, raw / max_scores, 0.0)
+    return np.round(np.clip(ratio, 0.0, 1.0) * 100.0, 1)
+
+
+def _check_top_k(top_k: Optional[int]) -> Optional[int]:
+    """Validate a caller-supplied ``top_k``: None or a non-negative integer."""
+    if top_k is None:
+        return None
+    if isinstance(top_k, bool) or not isinstance(top_k, (int, np.integer)):
+        raise ValueError(f"top_k must be a non-negative integer, got {top_k!r}")
+    if top_k < 0:
+        raise ValueError(f"top_k must be a non-negative integer, got {top_k}")
+    return int(top_k)
+
+
+def _select_top_k(d_idx: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pick the k best (score desc, then index asc) entries via partial selection."""
+    if k <= 0:
+        return d_idx[:0], scores[:0]
+    if len(scores) > k:
+        kth_best = -np.partition(-scores, k - 1)[k - 1]
+        keep = scores > kth_best
+        # Of the entries tied with the k-th best, only the lowest indices
+        # fit; many diseases often share a score (e.g. 0 %), so do not sort
+        # them all.
+        ties = np.flatnonzero(scores == kth_best)
+        needed = k - int(np.count_nonzero(keep))
+        if needed < len(ties):
+            ties = ties[np.argpartition(d_idx[ties], needed - 1)[:needed]]
+        keep[ties] = True
+        d_idx, scores = d_idx[keep], scores[keep]
+    order = np.lexsort((d_idx, -scores))[:k]
+    return d_idx[order], scores[order]
+
+
+_compiled_kb: Optional[CompiledKB] = None
+# Optional source of the current CompiledKB (a fixed KB or a KBRegistry);
+# when set, it replaces compiling KNOWLEDGE_BASE.
+_kb_provider: Optional[Callable[[], CompiledKB]] = None
+
+
+# Versions handed to ad-hoc KBs compiled from a dict. They count down from
+# -1 so they never collide with KNOWLEDGE_BASE versions (0, 1, 2, ...).
+_adhoc_versions = itertools.count(-1, -1)
+
+
+def compile_knowledge_base(kb: Optional[Dict[str, Dict[str, Any]]] = None,
+                           derived: Optional[DerivedRules] = None) -> CompiledKB:
+    """Compile a knowledge base (defaults to KNOWLEDGE_BASE) into a CompiledKB.
+
+    ``derived`` holds derived-fact rules; it defaults to DERIVED_FACTS for
+    KNOWLEDGE_BASE and to none for other knowledge bases.
+    """
+    if kb is None:
+        return CompiledKB(KNOWLEDGE_BASE, version=knowledge_base.get_kb_version(),
+                          derived=DERIVED_FACTS if derived is None else derived)
+    return CompiledKB(kb, version=next(_adhoc_versions), derived=derived)
+
+
+def use_compiled_kb(ckb: Optional[CompiledKB]) -> None:
+    """Serve diagnoses from ``ckb`` (e.g. one loaded by kb_loader) instead of KNOWLEDGE_BASE.
+
+    Pass None to go back to compiling KNOWLEDGE_BASE. Cached results are
+    tied to the CompiledKB instance (its cache_token), so installing a KB
+    whose version matches an earlier one never serves that KB's results.
+    """
+    set_kb_provider(None if ckb is None else (lambda: ckb))
+
+
+def set_kb_provider(provider: Optional[Callable[[], CompiledKB]]) -> None:
+    """Fetch the CompiledKB from ``provider()`` on every call (None restores the default).
+
+    Each engine call asks the provider once and uses that snapshot to the
+    end, so a provider may swap in a new KB at any time without locking.
+    """
+    global _kb_provider
+    _kb_provider = provider
+
+
+def get_compiled_kb() -> CompiledKB:
+    """Return the compiled form of KNOWLEDGE_BASE, rebuilding it if the KB changed."""
+    global _compiled_kb
+    if _kb_provider is not None:
+        return _kb_provider()
+    if _compiled_kb is None or _compiled_kb.version != knowledge_base.get_kb_version():
+        _compiled_kb = compile_knowledge_base()
+    return _compiled_kb
+
+
+def get_profile_schema() -> ProfileSchema:
+    """Return the profile schema of the current knowledge base."""
+    return get_compiled_kb().schema
+
+
+def enumerate_profiles():
+    """Yield one profile for every combination of the current KB's profile fields."""
+    return get_compiled_kb().schema.profiles()
+
+
+def set_answer_table_enabled(enabled: bool) -> None:
+    """Turn the precomputed answer table used by diagnose() on or off."""
+    global _answer_table_enabled
+    _answer_table_enabled = bool(enabled)
+
+
+def configure_result_cache(maxsize: int) -> None:
+    """Set the capacity of the diagnosis result cache (0 disables caching)."""
+    _result_cache.resize(maxsize)
+
+
+def clear_result_cache() -> None:
+    """Empty the diagnosis result cache and reset its statistics."""
+    _result_cache.clear()
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss statistics of the diagnosis result cache."""
+    return _result_cache.stats()
+
+
+def enable_metrics(metrics: Optional[EngineMetrics] = None) -> EngineMetrics:
+    """Start recording call metrics (see engine_metrics) and return the collector."""
+    global _metrics
+    _metrics = metrics if metrics is not None else EngineMetrics()
+    return _metrics
+
+
+def disable_metrics() -> None:
+    """Stop recording call metrics."""
+    global _metrics
+    _metrics = None
+
+
+def get_metrics() -> Optional[EngineMetrics]:
+    """Return the active metrics collector, or None when metrics are disabled."""
+    return _metrics
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """Return recorded metrics plus result-cache statistics as plain data."""
+    return (_metrics or EngineMetrics()).snapshot(_result_cache.stats())
+
+
+def metrics_prometheus() -> str:
+    """Return recorded metrics plus result-cache statistics in Prometheus text format."""
+    return (_metrics or EngineMetrics()).render_prometheus(_result_cache.stats())
+
+
+def _mask_indices(mask: int) -> List[int]:
+    """Symptom indices set in a profile bitmask, ascending."""
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
+    return indices
+
+
+def _record_call(metrics: EngineMetrics, entry: str, ckb: CompiledKB, mask: int, source: str,
+                 start: float, encoded: float) -> None:
+    end = perf_counter()
+    rules = 0
+    if source in ("top_k", "full"):
+        rules = int(ckb.symptom_rule_counts()[_mask_indices(mask)].sum())
+    metrics.record_call(entry, source, end - start, encoded - start, end - encoded, rules)
+
+
+def diagnose(patient_profile: Dict[str, str or bool], top_k: Optional[int] = None) -> List[Tuple[str, float]]:
     """
     Diagnose by forward-chaining through the knowledge base.
 
     patient_profile: mapping of symptom keys to values. For multi-valued
       symptoms we expect string values (e.g., fever: 'high'|'low'|'none'). For
       boolean symptoms, supply True/False.
+    top_k: if given, only the k best diseases are returned. They are selected
+      with bound-based pruning instead of scoring and sorting the whole KB.
+      A negative or non-integer top_k raises ValueError.
 
-    Returns a list of (disease, percentage_score) sorted descending.
+    Returns a list of (disease, percentage_score) sorted descending, as a
+    RankedResults whose ``kb_version`` names the KB snapshot used. The
+    (disease, score) tuples may be shared with the result cache; the list
+    itself is a fresh copy.
     """
-    results: List[Tuple[str, float]] = []
-
-    # Preprocess patient profile into a set of symptom keys that are "present"
-    # Example: if patient_profile['fever'] == 'high' -> present_key = 'fever_high'
-    present = set()
-
-    # Handle fever (multi-valued)
-    fever_val = patient_profile.get("fever")
-    if fever_val in ("high", "low", "none"):
-        present.add(f"fever_{fever_val}")
-
-    # Handle cough (multi-valued)
-    cough_val = patient_profile.get("cough")
-    if cough_val in ("dry", "wet", "blood"):
-        present.add(f"cough_{cough_val}")
-
-    # Handle boolean symptoms
-    for bool_sym in ("shortness_of_breath", "wheezing", "chest_pain", "fatigue", "loss_taste_smell"):
-        if patient_profile.get(bool_sym):
-            present.add(bool_sym)
-
-    # Smoking history: we store as boolean True/False (True -> positive)
-    if patient_profile.get("smoking_history"):
-        present.add("smoking_history")
-    else:
-        # explicit absence can be represented as 'fever_none' style keys for other symptoms
-        pass
-
-    # For every disease compute support (backwards compatible with old KB)
-    for disease, rules in KNOWLEDGE_BASE.items():
-        raw_score = 0.0
-        max_score = _disease_max_score(rules)
-
-        # Defensive: if max_score is zero (shouldn't happen), avoid division by zero
-        if max_score <= 0.0:
-            results.append((disease, 0.0))
-            continue
-
-        # Sum positive evidence and apply penalties for absent expected symptoms
-        for symptom_key, rule_val in rules.items():
-            cf = float(rule_val["cf"]) if isinstance(rule_val, dict) else float(rule_val)
-            if symptom_key in present:
-                raw_score += cf
-            else:
-                penalty_fraction = 0.5
-                raw_score -= cf * penalty_fraction
+    metrics = _metrics
+    if metrics is None:
+        ckb = get_compiled_kb()
+        ranked, _ = _rank_profile(ckb, ckb.encode_bitmask(patient_profile), top_k)
+        return RankedResults(ranked, ckb.version)
 
-        # Normalise and clamp
-        percent = max(0.0, min(1.0, raw_score / max_score)) * 100.0
-        results.append((disease, round(percent, 1)))
+    start = perf_counter()
+    ckb = get_compiled_kb()
+    mask = ckb.encode_bitmask(patient_profile)
+    encoded = perf_counter()
+    ranked, source = _rank_profile(ckb, mask, top_k)
+    result = RankedResults(ranked, ckb.version)
+    _record_call(metrics, "diagnose", ckb, mask, source, start, encoded)
+    return result
 
-    # Sort by descending percentage
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results
 
+def _rank_profile(ckb: CompiledKB, mask: int, top_k: Optional[int]) -> Tuple[tuple, str]:
+    """Return (ranked (disease, percent) tuples, answering path) for diagnose()."""
+    top_k = _check_top_k(top_k)
+    ranked = _result_cache.get(("diagnose", mask), ckb.cache_token)
+    if ranked is not None:
+        return ranked[:top_k], "cache"
 
-def diagnose_with_explanation(patient_profile: Dict[str, str or bool]) -> List[Tuple[str, float, Dict[str, Any]]]:
-    """Diagnose and return structured explanations for each disease.
+    table = ckb.answer_table() if _answer_table_enabled else None
+    ranked = table.get(mask) if table is not None else None
+    if ranked is not None:
+        _result_cache.put(("diagnose", mask), ranked, ckb.cache_token)
+        return ranked[:top_k], "table"
+
+    if top_k is not None:
+        key = ("diagnose_top", top_k, mask)
+        ranked = _result_cache.get(key, ckb.cache_token)
+        if ranked is not None:
+            return ranked, "cache"
+        d_idx, percents = ckb.top_k(_mask_indices(mask), top_k)
+        ranked = tuple((ckb.diseases[i], float(p)) for i, p in zip(d_idx, percents))
+        _result_cache.put(key, ranked, ckb.cache_token)
+        return ranked, "top_k"
+
+    percents = ckb.percentages_sparse(_mask_indices(mask))
+    # Stable sort keeps KB order between diseases with equal scores
+    order = np.argsort(-percents, kind="stable")
+    ranked = tuple((ckb.diseases[i], float(percents[i])) for i in order)
+    _result_cache.put(("diagnose", mask), ranked, ckb.cache_token)
+    return ranked, "full"
 
-    Returns a list of tuples: (disease, percent, explanation_dict)
-    explanation_dict contains: raw_score, max_score, percent, matched, penalties
-    where matched is a list of matched symptom facts and penalties lists absent expectations.
+
+class BatchDiagnosis:
+    """Scores for many profiles, as returned by diagnose_batch().
+
+    Attributes:
+      diseases: disease names, the column order of ``scores``.
+      scores: (N, n_diseases) array of percentages (rounded to 0.1).
+      top_indices: (N, k) disease indices per row, best first; ties keep KB
+        order exactly as diagnose() does.
+      kb_version: version of the knowledge base the scores came from.
     """
-    results: List[Tuple[str, float, Dict[str, Any]]] = []
-
-    # Preprocess profile into present set (reuse logic)
-    present = set()
-    fever_val = patient_profile.get("fever")
-    if fever_val in ("high", "low", "none"):
-        present.add(f"fever_{fever_val}")
-    cough_val = patient_profile.get("cough")
-    if cough_val in ("dry", "wet", "blood"):
-        present.add(f"cough_{cough_val}")
-    for bool_sym in ("shortness_of_breath", "wheezing", "chest_pain", "fatigue", "loss_taste_smell"):
-        if patient_profile.get(bool_sym):
-            present.add(bool_sym)
-    if patient_profile.get("smoking_history"):
-        present.add("smoking_history")
-
-    for disease, rules in KNOWLEDGE_BASE.items():
-        raw_score = 0.0
-        max_score = _disease_max_score(rules)
-        if max_score <= 0.0:
-            expl = {"raw_score": 0.0, "max_score": 0.0, "percent": 0.0, "matched": [], "penalties": []}
-            results.append((disease, 0.0, expl))
-            continue
-
-        matched = []
-        penalties = []
-
-        for symptom_key, rule_val in rules.items():
-            if isinstance(rule_val, dict):
-                cf = float(rule_val.get("cf", 0.0))
-                reason = rule_val.get("explain", "")
-            else:
-                cf = float(rule_val)
-                reason = ""
 
-            if symptom_key in present:
-                raw_score += cf
-                matched.append({"symptom": symptom_key, "cf": cf, "explain": reason})
-            else:
-                penalty_fraction = 0.5
-                pen = cf * penalty_fraction
-                raw_score -= pen
-                penalties.append({"symptom": symptom_key, "penalty": pen, "cf": cf, "explain": reason})
+    def __init__(self, diseases: Tuple[str, ...], scores: np.ndarray, top_indices: np.ndarray,
+                 kb_version: Optional[int] = None):
+        self.diseases = diseases
+        self.scores = scores
+        self.top_indices = top_indices
+        self.kb_version = kb_version
+
+    def __len__(self) -> int:
+        return self.scores.shape[0]
+
+    def ranked(self, row: int) -> List[Tuple[str, float]]:
+        """Return the top-k (disease, percent) list for one profile."""
+        scores = self.scores[row]
+        return [(self.diseases[i], float(scores[i])) for i in self.top_indices[row]]
+
+    def compact(self) -> CompactBatchResults:
+        """Return the top-k rankings as a CompactBatchResults (drops the full score matrix)."""
+        return CompactBatchResults.from_ranked(self.diseases, self.top_indices, self.scores, self.kb_version)
+
+
+def diagnose_batch(profiles, top_k: Optional[int] = None, text: bool = False) -> BatchDiagnosis:
+    """Diagnose many profiles in one vectorised pass.
+
+    profiles: a list of profile dicts, a columnar mapping of profile field
+      -> sequence of values or a NumPy structured array (see
+      CompiledKB.encode_batch).
+    top_k: number of ranked diseases kept per row (default: all); a negative
+      or non-integer value raises ValueError.
+    text: parse string columns as CSV text (see profile_schema).
+
+    ``result.ranked(i)`` equals ``diagnose(profile_i)[:top_k]``.
+    """
+    top_k = _check_top_k(top_k)
+    metrics = _metrics
+    start = perf_counter() if metrics is not None else 0.0
+    ckb = get_compiled_kb()
+    presence = ckb.encode_batch(profiles, text)
+    encoded = perf_counter() if metrics is not None else 0.0
+    percents = ckb.percentages(presence)
+    order = np.argsort(-percents, axis=1, kind="stable")
+    if top_k is not None:
+        order = order[:, :top_k]
+    result = BatchDiagnosis(ckb.diseases, percents, order, ckb.version)
+    if metrics is not None:
+        end = perf_counter()
+        rules = int(presence.sum(axis=0) @ ckb.symptom_rule_counts())
+        metrics.record_batch("diagnose_batch", len(presence), end - start, encoded - start, end - encoded, rules)
+    return result
+
+
+class EvidenceFact(dict):
+    """One matched symptom or penalty of an Explanation: a read-only dict.
+
+    Being a real dict, it serialises with json.dumps and pickles like one;
+    every mutating method raises TypeError, so facts can be shared with the
+    result cache.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("EvidenceFact is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return EvidenceFact, (dict(self),)
+
 
-        percent = max(0.0, min(1.0, raw_score / max_score)) * 100.0
-        expl = {"raw_score": round(raw_score, 3), "max_score": round(max_score, 3), "percent": round(percent, 1), "matched": matched, "penalties": penalties}
-        results.append((disease, round(percent, 1), expl))
+class Explanation(Mapping):
+    """Read-only, lazily materialised explanation of one disease's score.
 
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results
+    Holds only the compiled KB, the disease index and the profile bitmask.
+    The keys raw_score, max_score, percent, matched and penalties are
+    computed when first read, so ranking every disease costs no more than
+    diagnose() and only the explanations that are displayed pay for building
+    evidence lists. matched/penalties are tuples of EvidenceFact dicts with
+    symptom, cf, explain (and penalty) entries, so ``dict(explanation)`` is
+    JSON-serialisable; as_dict() returns plain lists and dicts. Pickling
+    materialises the evidence first and never includes the compiled KB.
+    """
+
+    _KEYS = ("raw_score", "max_score", "percent", "matched", "penalties")
+
+    __slots__ = ("_ckb", "_disease", "_mask", "_percent", "_evidence")
+
+    def __init__(self, ckb: CompiledKB, disease: int, mask: int, percent: float):
+        self._ckb = ckb
+        self._disease = disease
+        self._mask = mask
+        self._percent = percent
+        self._evidence = None
+
+    def _materialise(self) -> Dict[str, Any]:
+        if self._evidence is None:
+            ckb, d_idx = self._ckb, self._disease
+            max_score = float(ckb.max_scores[d_idx])
+            raw_score = 0.0
+            matched = []
+            penalties = []
+            if max_score > 0.0:
+                s_indices, cfs = ckb.rule_row(d_idx)
+                for s_idx, cf in zip(s_indices.tolist(), cfs.tolist()):
+                    fact = {"symptom": ckb.symptoms[s_idx], "cf": cf, "explain": ckb.explains.get((d_idx, s_idx), "")}
+                    if self._mask >> s_idx & 1:
+                        raw_score += cf
+                        matched.append(EvidenceFact(fact))
+                    else:
+                        pen = cf * PENALTY_FRACTION
+                        raw_score -= pen
+                        fact["penalty"] = pen
+                        penalties.append(EvidenceFact(fact))
+            self._evidence = {
+                "raw_score": round(raw_score, 3),
+                "max_score": round(max_score, 3),
+                "matched": tuple(matched),
+                "penalties": tuple(penalties),
+            }
+        return self._evidence
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "percent":
+            return self._percent
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return self._materialise()[key]
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    @property
+    def disease(self) -> str:
+        """Name of the explained disease."""
+        return self._disease if self._ckb is None else self._ckb.diseases[self._disease]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The explanation as plain dicts and lists, as diagnose_with_explanation() used to return it."""
+        evidence = self._materialise()
+        return {
+            "raw_score": evidence["raw_score"],
+            "max_score": evidence["max_score"],
+            "percent": self._percent,
+            "matched": [dict(fact) for fact in evidence["matched"]],
+            "penalties": [dict(fact) for fact in evidence["penalties"]],
+        }
+
+    def __reduce__(self):
+        return _detached_explanation, (self.disease, self._percent, self._materialise())
+
+    def __repr__(self) -> str:
+        return f"Explanation({self.disease!r}, percent={self._percent})"
+
+
+def _detached_explanation(disease: str, percent: float, evidence: Dict[str, Any]) -> Explanation:
+    """Rebuild a pickled Explanation from its materialised evidence, without a compiled KB."""
+    explanation = Explanation.__new__(Explanation)
+    explanation._ckb, explanation._disease, explanation._mask = None, disease, 0
+    explanation._percent, explanation._evidence = percent, evidence
+    return explanation
+
+
+def diagnose_records(patient_profile: Dict[str, str or bool], top_k: Optional[int] = None) -> List[DiagnosisRecord]:
+    """Like diagnose_with_explanation(), but as compact DiagnosisRecord objects."""
+    top_k = _check_top_k(top_k)
+    results = diagnose_with_explanation(patient_profile)
+    return RankedResults((DiagnosisRecord(d, p, expl) for d, p, expl in results[:top_k]), results.kb_version)
+
+
+def diagnose_with_explanation(patient_profile: Dict[str, str or bool]) -> List[Tuple[str, float, Explanation]]:
+    """Diagnose and return structured explanations for each disease.
+
+    Returns a list of tuples: (disease, percent, explanation)
+    explanation is a read-only mapping with: raw_score, max_score, percent,
+    matched, penalties where matched is a tuple of matched symptom facts and
+    penalties lists absent expectations. Explanations are built lazily and
+    shared with the result cache, which is why they cannot be modified;
+    ``dict(explanation)`` or ``explanation.as_dict()`` serialises to JSON.
+    """
+    metrics = _metrics
+    start = perf_counter() if metrics is not None else 0.0
+    ckb = get_compiled_kb()
+    mask = ckb.encode_bitmask(patient_profile)
+    encoded = perf_counter() if metrics is not None else 0.0
+    key = ("explain", mask)
+    cached = _result_cache.get(key, ckb.cache_token)
+    source = "cache"
+    if cached is None:
+        source = "full"
+        percents = ckb.percentages_sparse(_mask_indices(mask))
+        order = np.argsort(-percents, kind="stable")
+        cached = tuple(
+            (ckb.diseases[i], float(percents[i]), Explanation(ckb, int(i), mask, float(percents[i])))
+            for i in order
+        )
+        _result_cache.put(key, cached, ckb.cache_token)
+    result = RankedResults(cached, ckb.version)
+    if metrics is not None:
+        _record_call(metrics, "diagnose_with_explanation", ckb, mask, source, start, encoded)
+    return result
 
 
 def run_verification():
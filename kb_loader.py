@@ -0,0 +1,335 @@
+"""
+Loading knowledge bases from files, with a memory-mapped compiled cache.
+
+Besides the Python literal in knowledge_base.py, a knowledge base can be kept
+in data files:
+
+- JSON: either the same nested shape as KNOWLEDGE_BASE
+  ({disease: {symptom: {"cf": 0.9, "explain": "..."}}}) or a list of rule
+  objects with disease, symptom, cf and explain fields.
+- CSV: one rule per row with columns disease, symptom, cf, explain.
+- SQLite: a table (default ``rules``) with the same four columns.
+
+Rules are validated once and compiled into a binary cache file. Later
+startups memory-map that file instead of parsing the source again, so the
+rule arrays are shared read-only between processes through the page cache.
+The file holds one (disease, symptom, CF) triplet per rule rather than the
+dense disease x symptom matrix, so its size grows with the number of rules,
+not with diseases x symptoms. Scoring, top-k bounds and explanations all
+work from the triplets; the dense matrix is only built in memory by code
+that reads CompiledKB.cf itself (sharding, worker shared memory,
+sensitivity analysis). See CompiledKB.from_rules.
+
+Binary layout (all integers little-endian):
+  magic b"TESKB\\0\\0\\0" | u32 format version | u32 header length | JSON header
+  | 8-byte aligned arrays described in the header:
+    max_scores, penalty_base (float64, one per disease), rule_cf (float64),
+    rule_disease, rule_symptom, rule_explain (int32; one entry per rule in
+    KB order), string offsets (int64) and a UTF-8 string blob holding the
+    disease names, symptom names and interned explanation strings.
+The header records the source file's size and modification time; a cache
+that does not match its source, or was written by another format version,
+is rebuilt.
+"""
+
+import csv
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import knowledge_base
+from inference_engine import CompiledKB
+
+MAGIC = b"TESKB\0\0\0"
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 8
+
+Rules = Dict[str, Dict[str, Dict[str, Any]]]
+
+
+def _rules_from_rows(rows: Iterable[Dict[str, Any]]) -> Rules:
+    kb: Rules = {}
+    for line, row in enumerate(rows, 1):
+        try:
+            disease, symptom, cf = row["disease"], row["symptom"], row["cf"]
+        except KeyError as exc:
+            raise ValueError(f"Rule {line} is missing field {exc.args[0]!r}") from None
+        kb.setdefault(disease, {})[symptom] = {"cf": cf, "explain": row.get("explain") or ""}
+    return kb
+
+
+def load_kb_json(path: str) -> Rules:
+    """Read a knowledge base from a JSON file (nested mapping or list of rules)."""
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    if isinstance(data, list):
+        return _rules_from_rows(data)
+    return data
+
+
+def load_kb_csv(path: str) -> Rules:
+    """Read a knowledge base from a CSV file with disease, symptom, cf, explain columns."""
+    with open(path, newline="", encoding="utf-8") as fh:
+        return _rules_from_rows(csv.DictReader(fh))
+
+
+def load_kb_sqlite(path: str, table: str = "rules") -> Rules:
+    """Read a knowledge base from a SQLite table with disease, symptom, cf, explain columns."""
+    if not table.isidentifier():
+        raise ValueError(f"Invalid table name: {table!r}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(f"SELECT disease, symptom, cf, explain FROM {table} ORDER BY rowid")
+        return _rules_from_rows(dict(row) for row in rows)
+    finally:
+        conn.close()
+
+
+def load_kb(path: str) -> Rules:
+    """Read and validate a knowledge base, choosing the reader from the file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        kb = load_kb_json(path)
+    elif ext == ".csv":
+        kb = load_kb_csv(path)
+    elif ext in (".db", ".sqlite", ".sqlite3"):
+        kb = load_kb_sqlite(path)
+    else:
+        raise ValueError(f"Unsupported knowledge base file type: {path}")
+    return validate_kb(kb)
+
+
+def validate_kb(kb: Rules) -> Rules:
+    """Check structure and CF ranges, returning a normalised copy of the KB.
+
+    CFs are converted to float and must lie in [0.0, 1.0]; explanations are
+    converted to strings. Raises ValueError describing the first problem.
+    """
+    if not isinstance(kb, dict) or not kb:
+        raise ValueError("Knowledge base must be a non-empty mapping of disease -> rules")
+    clean: Rules = {}
+    for disease, rules in kb.items():
+        if not isinstance(disease, str) or not disease:
+            raise ValueError(f"Invalid disease name: {disease!r}")
+        if not isinstance(rules, dict) or not rules:
+            raise ValueError(f"Disease {disease!r} has no rules")
+        clean_rules = {}
+        for symptom, rule in rules.items():
+            if not isinstance(symptom, str) or not symptom:
+                raise ValueError(f"Invalid symptom key {symptom!r} for {disease!r}")
+            raw_cf = rule.get("cf") if isinstance(rule, dict) else rule
+            try:
+                cf = float(raw_cf)
+            except (TypeError, ValueError):
+                raise ValueError(f"CF for {disease!r}/{symptom!r} is not a number: {raw_cf!r}") from None
+            if not 0.0 <= cf <= 1.0:
+                raise ValueError(f"CF for {disease!r}/{symptom!r} is outside [0, 1]: {cf}")
+            explain = rule.get("explain", "") if isinstance(rule, dict) else ""
+            clean_rules[symptom] = {"cf": cf, "explain": str(explain or "")}
+        clean[disease] = clean_rules
+    return clean
+
+
+def source_stamp_of(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def compile_rules(kb: Rules, version: int = 0, derived: Optional[Dict[str, Any]] = None) -> CompiledKB:
+    """Compile a validated KB straight into rule triplets (CompiledKB.from_rules), never densifying it."""
+    symptoms = knowledge_base.get_symptom_keys(kb)
+    symptom_index = {s: i for i, s in enumerate(symptoms)}
+    rule_disease: List[int] = []
+    rule_symptom: List[int] = []
+    rule_cf: List[float] = []
+    explains: Dict[Tuple[int, int], str] = {}
+    for d_idx, rules in enumerate(kb.values()):
+        for symptom, rule in rules.items():
+            s_idx = symptom_index[symptom]
+            rule_disease.append(d_idx)
+            rule_symptom.append(s_idx)
+            rule_cf.append(rule["cf"])
+            explains[(d_idx, s_idx)] = rule["explain"]
+    return CompiledKB.from_rules(
+        kb.keys(), symptoms, np.asarray(rule_disease, dtype=np.int32), np.asarray(rule_symptom, dtype=np.int32),
+        np.asarray(rule_cf, dtype=np.float64), explains=explains, version=version, derived=derived,
+    )
+
+
+def write_compiled_kb(ckb: CompiledKB, path: str, source_stamp: Optional[Dict[str, int]] = None) -> None:
+    """Write a CompiledKB to ``path`` in the binary cache format (atomically)."""
+    rule_disease, rule_symptom, rule_cf = ckb.rule_arrays()
+    strings: List[str] = list(ckb.diseases) + list(ckb.symptoms)
+    interned: Dict[str, int] = {}
+    rule_explain = np.zeros(len(rule_disease), dtype=np.int32)
+    explains = ckb.explains
+    for i, key in enumerate(zip(rule_disease.tolist(), rule_symptom.tolist())):
+        text = explains.get(key, "")
+        if text not in interned:
+            interned[text] = len(strings)
+            strings.append(text)
+        rule_explain[i] = interned[text]
+
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+    arrays = [
+        ("max_scores", np.ascontiguousarray(ckb.max_scores, dtype=np.float64)),
+        ("penalty_base", np.ascontiguousarray(ckb.penalty_base, dtype=np.float64)),
+        ("rule_cf", np.ascontiguousarray(rule_cf, dtype=np.float64)),
+        ("rule_disease", np.asarray(rule_disease, dtype=np.int32)),
+        ("rule_symptom", np.asarray(rule_symptom, dtype=np.int32)),
+        ("rule_explain", rule_explain),
+        ("string_offsets", offsets),
+        ("strings", np.frombuffer(b"".join(encoded), dtype=np.uint8)),
+    ]
+    layout = {}
+    position = 0
+    for name, arr in arrays:
+        position = -(-position // _ALIGN) * _ALIGN
+        layout[name] = {"offset": position, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        position += arr.nbytes
+    header = {
+        "kb_version": ckb.version,
+        "n_diseases": len(ckb.diseases),
+        "n_symptoms": len(ckb.symptoms),
+        "source": source_stamp,
+        "arrays": layout,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(_PREAMBLE.size + len(header_bytes)) // _ALIGN) * _ALIGN
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as fh:
+        fh.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        fh.write(header_bytes)
+        for name, arr in arrays:
+            fh.seek(data_start + layout[name]["offset"])
+            fh.write(arr.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _read_header(mm: mmap.mmap) -> Tuple[Dict[str, Any], int]:
+    magic, fmt_version, header_len = _PREAMBLE.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a compiled knowledge base file")
+    if fmt_version != FORMAT_VERSION:
+        raise ValueError(f"Compiled knowledge base format {fmt_version} is not supported")
+    header = json.loads(mm[_PREAMBLE.size:_PREAMBLE.size + header_len])
+    data_start = -(-(_PREAMBLE.size + header_len) // _ALIGN) * _ALIGN
+    return header, data_start
+
+
+class _RuleExplains(Mapping):
+    """(disease, symptom) -> explanation mapping read from the cache.
+
+    Looking up one rule decodes only its string: rules are stored grouped by
+    disease, so the disease's rules are found by binary search. Iterating
+    decodes every explanation once.
+    """
+
+    def __init__(self, rule_disease, rule_symptom, rule_explain, string_at):
+        self._columns = (rule_disease, rule_symptom, rule_explain)
+        self._string_at = string_at
+        self._data: Optional[Dict[Tuple[int, int], str]] = None
+
+    def _lookup(self, key) -> str:
+        rule_disease, rule_symptom, rule_explain = self._columns
+        d_idx, s_idx = key
+        lo, hi = np.searchsorted(rule_disease, [d_idx, d_idx + 1])
+        hits = np.flatnonzero(rule_symptom[lo:hi] == s_idx)
+        if not len(hits):
+            raise KeyError(key)
+        return self._string_at(int(rule_explain[lo + hits[0]]))
+
+    def _load(self) -> Dict[Tuple[int, int], str]:
+        if self._data is None:
+            rule_disease, rule_symptom, rule_explain = (col.tolist() for col in self._columns)
+            texts = {i: self._string_at(i) for i in set(rule_explain)}
+            self._data = {(d, s): texts[e] for d, s, e in zip(rule_disease, rule_symptom, rule_explain)}
+        return self._data
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        return self._lookup(key)
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+
+def open_compiled_kb(path: str) -> CompiledKB:
+    """Memory-map a compiled knowledge base file and wrap it without copying."""
+    with open(path, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    header, data_start = _read_header(mm)
+
+    def array(name):
+        spec = header["arrays"][name]
+        count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+        arr = np.frombuffer(mm, dtype=np.dtype(spec["dtype"]), count=count, offset=data_start + spec["offset"])
+        return arr.reshape(spec["shape"])
+
+    offsets = array("string_offsets")
+    blob = array("strings")
+
+    def string_at(i: int) -> str:
+        return blob[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+    n_diseases, n_symptoms = header["n_diseases"], header["n_symptoms"]
+    bounds = offsets[: n_diseases + n_symptoms + 1].tolist()
+    names = blob[: bounds[-1]].tobytes()
+    decoded = [names[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(n_diseases + n_symptoms)]
+    rule_disease, rule_symptom = array("rule_disease"), array("rule_symptom")
+    explains = _RuleExplains(rule_disease, rule_symptom, array("rule_explain"), string_at)
+    return CompiledKB.from_rules(
+        decoded[:n_diseases], decoded[n_diseases:], rule_disease, rule_symptom, array("rule_cf"),
+        explains=explains, version=header["kb_version"], max_scores=array("max_scores"),
+        penalty_base=array("penalty_base"),
+    )
+
+
+def content_version(path: str, source_stamp: Optional[Dict[str, int]] = None) -> int:
+    """Derive a KB version number unique to a source file's path, size and mtime."""
+    if source_stamp is None:
+        source_stamp = source_stamp_of(path)
+    digest = hashlib.sha256(f"{os.path.abspath(path)}:{source_stamp}".encode()).digest()
+    return int.from_bytes(digest[:6], "little")
+
+
+def _cache_is_fresh(cache_path: str, stamp: Dict[str, int]) -> bool:
+    try:
+        with open(cache_path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, _ = _read_header(mm)
+    except (OSError, ValueError, struct.error):
+        return False
+    return header.get("source") == stamp
+
+
+def load_compiled_kb(source_path: str, cache_path: Optional[str] = None) -> CompiledKB:
+    """Return a CompiledKB for a KB source file, using or refreshing its binary cache.
+
+    The cache defaults to ``<source_path>.kbc``. When it is missing, stale or
+    unreadable, the source is loaded, validated, compiled and written out
+    before being memory-mapped.
+    """
+    cache_path = cache_path or source_path + ".kbc"
+    stamp = source_stamp_of(source_path)
+    if not _cache_is_fresh(cache_path, stamp):
+        kb = load_kb(source_path)
+        ckb = compile_rules(kb, version=content_version(source_path, stamp))
+        write_compiled_kb(ckb, cache_path, source_stamp=stamp)
+    return open_compiled_kb(cache_path)
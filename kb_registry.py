@@ -0,0 +1,130 @@
+"""
+Hot-reloadable knowledge-base registry.
+
+A KBRegistry owns the current compiled knowledge-base snapshot for one KB
+source (knowledge_base.py or a JSON/CSV/SQLite file understood by
+kb_loader). A background thread watches the source and, when it changes,
+compiles a new immutable snapshot and swaps it in.
+
+Design notes:
+- Snapshots are CompiledKB objects, which are never modified after they are
+  built. Swapping is a single attribute assignment, so readers need no lock:
+  an engine call fetches the snapshot once and finishes on it even if a new
+  one is installed meanwhile, while later calls see the new one.
+- A snapshot's version is derived from the source's path, size and mtime
+  (kb_loader.content_version), so results tagged with ``kb_version`` can be
+  traced back to the KB state that produced them. The version can repeat
+  (an edit that keeps size and mtime, or a forced reload()), so the
+  engine's result cache is keyed on each snapshot's own cache_token
+  instead and never mixes snapshots.
+- If the edited source fails to load or validate, the old snapshot stays in
+  place and the error is kept in ``last_error``.
+"""
+
+import os
+import runpy
+import threading
+from typing import Callable, List, Optional
+
+import inference_engine
+import kb_loader
+from inference_engine import CompiledKB
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def compile_source(path: str) -> CompiledKB:
+    """Compile a KB source file into a fresh CompiledKB snapshot."""
+    if path.endswith(".py"):
+        stamp = kb_loader.source_stamp_of(path)
+        # Execute the module file in a private namespace so the imported
+        # knowledge_base module (and anything holding its dict) is untouched.
+        namespace = runpy.run_path(path)
+        kb = kb_loader.validate_kb(namespace["KNOWLEDGE_BASE"])
+        return kb_loader.compile_rules(kb, version=kb_loader.content_version(path, stamp),
+                                       derived=namespace.get("DERIVED_FACTS"))
+    return kb_loader.load_compiled_kb(path)
+
+
+class KBRegistry:
+    """Holds the current KB snapshot for a source file and hot-swaps it on change."""
+
+    def __init__(self, source_path: str, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.source_path = os.path.abspath(source_path)
+        self.poll_interval = poll_interval
+        self.last_error: Optional[Exception] = None
+        self._listeners: List[Callable[[CompiledKB], None]] = []
+        self._stamp = self._read_stamp()
+        self._snapshot = compile_source(self.source_path)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> CompiledKB:
+        """The current compiled KB (read without locking)."""
+        return self._snapshot
+
+    def current(self) -> CompiledKB:
+        """Return the current snapshot; usable as an inference_engine KB provider."""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """Version number of the current snapshot."""
+        return self._snapshot.version
+
+    def on_swap(self, callback: Callable[[CompiledKB], None]) -> None:
+        """Call ``callback(new_snapshot)`` after every successful swap."""
+        self._listeners.append(callback)
+
+    def install(self) -> "KBRegistry":
+        """Make the inference engine serve every call from this registry's snapshot."""
+        inference_engine.set_kb_provider(self.current)
+        return self
+
+    def _read_stamp(self):
+        try:
+            st = os.stat(self.source_path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def reload(self) -> bool:
+        """Recompile the source now and swap it in. Returns True on success."""
+        try:
+            snapshot = compile_source(self.source_path)
+        except Exception as exc:
+            self.last_error = exc
+            return False
+        self.last_error = None
+        self._snapshot = snapshot
+        for callback in self._listeners:
+            callback(snapshot)
+        return True
+
+    def check(self) -> bool:
+        """Reload if the source changed since the last look. Returns True if swapped."""
+        stamp = self._read_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return self.reload()
+
+    def start(self) -> "KBRegistry":
+        """Start watching the source in a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="kb-registry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the watcher thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.check()
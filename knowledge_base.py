@@ -25,7 +25,75 @@ and tuned to make typical cases distinct (e.g., loss of taste/smell strongly
 supports COVID-19). This is not clinical software.
 """
 
-from typing import Dict
+import copy
+from typing import Any, Dict, Tuple
+
+
+class _TrackedDict(dict):
+    """A dict that records every change to itself or a nested dict with mark_kb_changed().
+
+    KNOWLEDGE_BASE and all of its disease and rule dicts are _TrackedDicts,
+    so editing the KB in place (adding a disease, changing a CF) moves the KB
+    version and the compiled form is rebuilt on the next diagnosis, without
+    callers having to report the edit. Dicts assigned into the KB are copied
+    into _TrackedDicts; edit them through KNOWLEDGE_BASE afterwards. Copies
+    (copy.copy, copy.deepcopy, pickle) are plain dicts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, _tracked(value))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, _tracked(value))
+        mark_kb_changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        mark_kb_changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, _tracked(value))
+        mark_kb_changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        mark_kb_changed()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        mark_kb_changed()
+        return item
+
+    def clear(self):
+        dict.clear(self)
+        mark_kb_changed()
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def _tracked(value: Any) -> Any:
+    return _TrackedDict(value) if isinstance(value, dict) and not isinstance(value, _TrackedDict) else value
+
 
 # Each disease maps to symptom keys with certainty factors (0.0 - 1.0).
 # Symptoms tracked (encoded as keys used across the system):
@@ -37,7 +105,7 @@ from typing import Dict
 # Knowledge entries now include an explanation string alongside the CF value.
 # This supports explainability: each rule is an IF symptom THEN disease with CF
 # and a short explanation of why that symptom supports the disease.
-KNOWLEDGE_BASE: Dict[str, Dict[str, Dict[str, object]]] = {
+KNOWLEDGE_BASE: Dict[str, Dict[str, Dict[str, object]]] = _TrackedDict({
     "Asthma": {
         "wheezing": {"cf": 0.9, "explain": "Wheezing is a hallmark of airway constriction in asthma."},
         "shortness_of_breath": {"cf": 0.8, "explain": "Airflow limitation causes breathlessness."},
@@ -87,20 +155,85 @@ KNOWLEDGE_BASE: Dict[str, Dict[str, Dict[str, object]]] = {
         "fatigue": {"cf": 0.4, "explain": "Fatigue may follow acute respiratory infection."},
         "shortness_of_breath": {"cf": 0.3, "explain": "Mild dyspnea can happen with bronchitis."},
     },
+})
+
+
+# Intermediate facts for multi-level forward chaining (see rule_network.py).
+# A derived fact holds when every key of one of its "when" lists is present;
+# conditions may be symptom keys or other derived facts. Disease rules can
+# reference a derived fact like any symptom key (e.g. "airway_obstruction":
+# {"cf": 0.8, ...}). No disease in KNOWLEDGE_BASE uses them yet, so they do
+# not change current scores.
+DERIVED_FACTS: Dict[str, Dict[str, object]] = {
+    "lower_respiratory_infection": {
+        "when": [["fever_high", "cough_wet"], ["fever_low", "cough_wet"], ["cough_wet", "chest_pain"]],
+        "explain": "Fever or chest pain with a productive cough points to infection below the larynx.",
+    },
+    "systemic_viral_illness": {
+        "when": [["fever_high", "fatigue"], ["fever_low", "fatigue"], ["loss_taste_smell", "fatigue"]],
+        "explain": "Fever or anosmia together with fatigue suggests a systemic viral process.",
+    },
+    "airway_obstruction": {
+        "when": [["wheezing", "shortness_of_breath"]],
+        "explain": "Wheezing with breathlessness indicates narrowed airways.",
+    },
+    "chronic_airway_risk": {
+        "when": [["smoking_history", "airway_obstruction"], ["smoking_history", "cough_wet", "shortness_of_breath"]],
+        "explain": "Airway obstruction or chronic productive cough in a smoker suggests chronic lung disease.",
+    },
+}
+
+
+# Multi-valued profile fields: a field maps to the values it accepts, and
+# value v of field f is the symptom key "f_v", so {"fever": "high"} makes
+# "fever_high" present. The values of one field are mutually exclusive. Any
+# symptom key not declared here is a boolean field of its own name, even if
+# it shares a prefix with other keys (e.g. "pain_chest" and "pain_abdomen").
+MULTI_VALUED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "fever": ("high", "low", "none"),
+    "cough": ("dry", "wet", "blood"),
 }
 
 
-def get_symptom_keys():
+# Version counter for KNOWLEDGE_BASE. The inference engine compiles the KB
+# into dense arrays once and reuses them until this number moves; every edit
+# made through KNOWLEDGE_BASE moves it (see _TrackedDict).
+_KB_VERSION = 0
+
+
+def get_symptom_keys(kb=None):
     """Return the set of symptom keys used across the KB.
 
-    Useful for building interfaces and validating input.
+    Useful for building interfaces and validating input. Pass ``kb`` to inspect
+    a knowledge base other than the module-level KNOWLEDGE_BASE.
     """
+    if kb is None:
+        kb = KNOWLEDGE_BASE
     keys = set()
-    for disease, rules in KNOWLEDGE_BASE.items():
+    for disease, rules in kb.items():
         keys.update(rules.keys())
     return sorted(keys)
 
 
+def get_kb_version() -> int:
+    """Return the current version number of KNOWLEDGE_BASE."""
+    return _KB_VERSION
+
+
+def mark_kb_changed() -> int:
+    """Record that KNOWLEDGE_BASE was modified and return the new version.
+
+    Edits made through KNOWLEDGE_BASE call this themselves; call it directly
+    only for changes the KB cannot see, such as edits to DERIVED_FACTS.
+
+    Compiled views of the KB (see inference_engine.get_compiled_kb) compare
+    against this number and rebuild themselves when it moves.
+    """
+    global _KB_VERSION
+    _KB_VERSION += 1
+    return _KB_VERSION
+
+
 if __name__ == "__main__":
     # Quick inspection when run directly (not executed by Streamlit import)
     print("Defined diseases:")
@@ -0,0 +1,182 @@
+"""
+Multi-process batch diagnosis.
+
+Chunks of patient profiles are fanned out to a pool of worker processes and
+the scored chunks are gathered back in input order.
+
+Design notes:
+- The compiled knowledge base (CF matrix, max scores, penalty constants) is
+  copied once into a single shared-memory block. Workers attach to that block
+  by name when they start and wrap it in a CompiledKB without copying, so the
+  KB is never pickled per task and all workers read the same physical pages.
+- Only the profiles of a chunk travel to a worker, and only the (optionally
+  top-k truncated) scores travel back. Profile encoding runs in the workers,
+  so the parent process is left with I/O and bookkeeping.
+- At most ``max_pending`` chunks are in flight at a time, which keeps memory
+  bounded when the profile source is a large stream.
+"""
+
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from inference_engine import BatchDiagnosis, CompiledKB, _check_top_k, get_compiled_kb
+from results import CompactBatchResults
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class SharedCompiledKB:
+    """A CompiledKB whose numeric arrays live in one shared-memory block.
+
+    The block holds, back to back, the (D, S) CF matrix followed by the
+    per-disease max scores and penalty constants (all float64). ``spec``
+    is the small picklable description workers need to attach to it.
+    """
+
+    def __init__(self, ckb: Optional[CompiledKB] = None):
+        if ckb is None:
+            ckb = get_compiled_kb()
+        n_diseases, n_symptoms = ckb.cf.shape
+        n_values = n_diseases * n_symptoms + 2 * n_diseases
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, n_values * 8))
+        flat = np.ndarray((n_values,), dtype=np.float64, buffer=self._shm.buf)
+        flat[: n_diseases * n_symptoms] = ckb.cf.ravel()
+        flat[n_diseases * n_symptoms: n_diseases * (n_symptoms + 1)] = ckb.max_scores
+        flat[n_diseases * (n_symptoms + 1):] = ckb.penalty_base
+        del flat
+        self.spec: Dict[str, Any] = {
+            "name": self._shm.name,
+            "diseases": ckb.diseases,
+            "symptoms": ckb.symptoms,
+            "version": ckb.version,
+            "derived": ckb.derived,
+        }
+
+    def close(self) -> None:
+        """Release and remove the shared-memory block."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self) -> "SharedCompiledKB":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach_compiled_kb(spec: Dict[str, Any]) -> Tuple[CompiledKB, shared_memory.SharedMemory]:
+    """Wrap the shared block described by ``spec`` in a read-only CompiledKB.
+
+    The returned SharedMemory handle must be kept alive as long as the
+    CompiledKB is used.
+    """
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    n_diseases, n_symptoms = len(spec["diseases"]), len(spec["symptoms"])
+    flat = np.ndarray((n_diseases * (n_symptoms + 2),), dtype=np.float64, buffer=shm.buf)
+    flat.setflags(write=False)
+    cf = flat[: n_diseases * n_symptoms].reshape(n_diseases, n_symptoms)
+    max_scores = flat[n_diseases * n_symptoms: n_diseases * (n_symptoms + 1)]
+    penalty_base = flat[n_diseases * (n_symptoms + 1):]
+    ckb = CompiledKB.from_arrays(spec["diseases"], spec["symptoms"], cf, version=spec["version"],
+                                 max_scores=max_scores, penalty_base=penalty_base, derived=spec.get("derived"))
+    return ckb, shm
+
+
+# Per-worker state, set by _init_worker in each pool process.
+_worker_kb: Optional[CompiledKB] = None
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+
+
+def _init_worker(spec: Dict[str, Any]) -> None:
+    global _worker_kb, _worker_shm
+    _worker_kb, _worker_shm = attach_compiled_kb(spec)
+
+
+def _score_chunk(profiles: List[Dict[str, Any]], top_k: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    percents = _worker_kb.percentages(_worker_kb.encode_batch(profiles))
+    order = np.argsort(-percents, axis=1, kind="stable")
+    if top_k is not None:
+        # Ship back only the top-k scores; ``order`` maps them to diseases.
+        order = order[:, :top_k]
+        percents = np.take_along_axis(percents, order, axis=1)
+    return percents, order
+
+
+def iter_diagnose_parallel(profiles: Iterable[Dict[str, Any]], workers: Optional[int] = None,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE, top_k: Optional[int] = None,
+                           max_pending: Optional[int] = None) -> Iterator[BatchDiagnosis]:
+    """Score a profile stream across a process pool, yielding one BatchDiagnosis per chunk.
+
+    Chunks are yielded in input order. With ``top_k`` set, each yielded
+    BatchDiagnosis carries only the top-k scores per row (its ``scores`` has
+    shape (n, top_k) and ``top_indices`` names the disease of each column).
+    A negative or non-integer ``top_k`` raises ValueError right away.
+    """
+    return _iter_chunks(profiles, workers, chunk_size, _check_top_k(top_k), max_pending)
+
+
+def _iter_chunks(profiles: Iterable[Dict[str, Any]], workers: Optional[int], chunk_size: int,
+                 top_k: Optional[int], max_pending: Optional[int]) -> Iterator[BatchDiagnosis]:
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    it = iter(profiles)
+    with SharedCompiledKB() as shared:
+        diseases, kb_version = shared.spec["diseases"], shared.spec["version"]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            pending = deque()
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(itertools.islice(it, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(_score_chunk, chunk, top_k))
+                if not pending:
+                    break
+                percents, order = pending.popleft().result()
+                yield _chunk_result(diseases, percents, order, top_k, kb_version)
+
+
+def _chunk_result(diseases, percents, order, top_k, kb_version=None) -> BatchDiagnosis:
+    if top_k is None:
+        return BatchDiagnosis(diseases, percents, order, kb_version)
+    return TopKBatchDiagnosis(diseases, percents, order, kb_version)
+
+
+class TopKBatchDiagnosis(BatchDiagnosis):
+    """BatchDiagnosis holding only the top-k scores of each row.
+
+    ``scores[i, j]`` is the score of disease ``top_indices[i, j]``.
+    """
+
+    def ranked(self, row: int) -> List[Tuple[str, float]]:
+        return [(self.diseases[i], float(s)) for i, s in zip(self.top_indices[row], self.scores[row])]
+
+    def compact(self) -> CompactBatchResults:
+        return CompactBatchResults(self.diseases, self.top_indices, self.scores, self.kb_version)
+
+
+def diagnose_parallel(profiles: Iterable[Dict[str, Any]], workers: Optional[int] = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, top_k: Optional[int] = None) -> BatchDiagnosis:
+    """Score all profiles across a process pool and return one combined BatchDiagnosis.
+
+    ``result.ranked(i)`` equals ``diagnose(profiles[i])[:top_k]``.
+    """
+    top_k = _check_top_k(top_k)
+    parts = list(iter_diagnose_parallel(profiles, workers=workers, chunk_size=chunk_size, top_k=top_k))
+    ckb = get_compiled_kb()
+    diseases = ckb.diseases
+    width = len(diseases) if top_k is None else min(top_k, len(diseases))
+    if not parts:
+        empty = np.zeros((0, width))
+        return _chunk_result(diseases, empty, np.zeros((0, width), dtype=np.intp), top_k, ckb.version)
+    scores = np.concatenate([p.scores for p in parts])
+    order = np.concatenate([p.top_indices for p in parts])
+    return _chunk_result(parts[0].diseases, scores, order, top_k, parts[0].kb_version)
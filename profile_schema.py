@@ -0,0 +1,239 @@
+"""
+Patient profile schema derived from the knowledge base's symptom keys.
+
+A ProfileSchema maps profile fields to symptom keys
+(knowledge_base.get_symptom_keys() plus the base facts that derived-fact
+rules test) and an explicit declaration of the multi-valued fields
+(knowledge_base.MULTI_VALUED_FIELDS):
+
+- A declared field groups the keys "<field>_<value>" of its values into one
+  mutually exclusive field: {"fever": "high"} makes "fever_high" present.
+  Only the declared values present among the keys are offered.
+- Every key is also a boolean field of its own name: a truthy
+  {"wheezing": True} makes "wheezing" present. Keys that belong to no
+  declared field are listed in ``boolean`` (so a new boolean symptom needs no
+  code changes, and keys that merely share a prefix stay independent);
+  together with ``multi_valued`` they describe the inputs a UI or profile
+  generator needs to offer.
+
+Design notes:
+- Encoders return a boolean presence matrix with one column per entry of
+  ``keys``. Dict profiles are encoded in one pass over their items.
+  Columnar input (a mapping of field -> values such as a DataFrame, or a
+  NumPy structured array) is encoded one column at a time: a multi-valued
+  string column is factorised once with np.unique and scattered into its key
+  columns; object columns (which may mix None and str) are compared against
+  each of the field's values.
+- Columns follow the dict semantics (Python truthiness, exact values).
+  ``text=True`` treats string columns as CSV text instead: boolean fields
+  are true for "1"/"true"/"yes"/..., and values are matched after
+  stripping and lower-casing.
+"""
+
+import csv
+import itertools
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+import numpy as np
+
+TRUE_STRINGS = frozenset({"1", "true", "t", "yes", "y"})
+
+
+def _group_fields(keys: Tuple[str, ...], declared: Mapping[str, Iterable[str]]) -> Dict[str, Dict[str, str]]:
+    """Return {field: {value: key}} for the keys "<field>_<value>" of the ``declared`` fields."""
+    value_of = {f"{field}_{value}": (field, value) for field, values in declared.items() for value in values}
+    fields: Dict[str, Dict[str, str]] = {}
+    for key in keys:
+        if key in value_of:
+            field, value = value_of[key]
+            fields.setdefault(field, {})[value] = key
+    return fields
+
+
+def parse_bool(text: Any) -> bool:
+    """Interpret a CSV cell as a boolean ("1", "true", "yes", ... are true)."""
+    return str(text or "").strip().lower() in TRUE_STRINGS
+
+
+class ProfileSchema:
+    """Mapping between profile fields and a tuple of symptom keys.
+
+    Attributes:
+      keys: the symptom keys, the column order of every encoded matrix.
+      key_index: key -> column.
+      multi_valued: field -> accepted values, for the declared fields with
+        keys in ``keys``.
+      boolean: keys that are only set through a boolean field.
+
+    ``multi_valued`` (field -> declared values) defaults to none: every key
+    is then a boolean field.
+    """
+
+    def __init__(self, keys: Iterable[str], multi_valued: Optional[Mapping[str, Iterable[str]]] = None):
+        self.keys: Tuple[str, ...] = tuple(dict.fromkeys(keys))
+        self.key_index: Dict[str, int] = {k: i for i, k in enumerate(self.keys)}
+        fields = _group_fields(self.keys, multi_valued or {})
+        self.multi_valued: Dict[str, Tuple[str, ...]] = {f: tuple(values) for f, values in fields.items()}
+        grouped = {key for values in fields.values() for key in values.values()}
+        self.boolean: Tuple[str, ...] = tuple(k for k in self.keys if k not in grouped)
+        self._value_columns: Dict[str, Dict[str, int]] = {
+            f: {value: self.key_index[key] for value, key in values.items()} for f, values in fields.items()
+        }
+
+    def __repr__(self) -> str:
+        return f"ProfileSchema(multi_valued={self.multi_valued!r}, boolean={self.boolean!r})"
+
+    def _present_columns(self, profile: Mapping) -> Iterator[int]:
+        key_index, value_columns = self.key_index, self._value_columns
+        for field, value in profile.items():
+            col = key_index.get(field)
+            if col is not None and value:
+                yield col
+            values = value_columns.get(field)
+            if values is not None and isinstance(value, str):
+                col = values.get(value)
+                if col is not None:
+                    yield col
+
+    def present(self, profile: Mapping) -> Set[str]:
+        """Symptom keys present in one profile dict."""
+        keys = self.keys
+        return {keys[col] for col in self._present_columns(profile)}
+
+    def encode_rows(self, profiles: Iterable[Mapping]) -> np.ndarray:
+        """(N, len(keys)) boolean presence matrix for a sequence of profile dicts."""
+        rows: List[int] = []
+        cols: List[int] = []
+        n_rows = 0
+        for row, profile in enumerate(profiles):
+            for col in self._present_columns(profile):
+                rows.append(row)
+                cols.append(col)
+            n_rows = row + 1
+        presence = np.zeros((n_rows, len(self.keys)), dtype=bool)
+        presence[rows, cols] = True
+        return presence
+
+    def encode_columns(self, columns: Any, text: bool = False) -> np.ndarray:
+        """(N, len(keys)) boolean presence matrix for columnar profiles.
+
+        ``columns`` is a mapping of field -> sequence/array of N values (a
+        DataFrame works) or a NumPy structured array. Fields that are not
+        part of the schema are ignored.
+        """
+        columns = _as_columns(columns)
+        if columns is None:
+            raise TypeError("encode_columns() expects a mapping of columns or a structured array")
+        lengths = {len(col) for col in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All profile columns must have the same length")
+        n_rows = lengths.pop() if lengths else 0
+        presence = np.zeros((n_rows, len(self.keys)), dtype=bool)
+        for field, values in columns.items():
+            key_col = self.key_index.get(field)
+            value_cols = self._value_columns.get(field)
+            if key_col is None and value_cols is None:
+                continue
+            col = np.asarray(values)
+            if key_col is not None:
+                presence[:, key_col] |= _truthy(col, text)
+            if value_cols is not None:
+                codes = _value_codes(col, value_cols, text)
+                rows = np.flatnonzero(codes >= 0)
+                presence[rows, codes[rows]] = True
+        return presence
+
+    def encode(self, profiles: Any, text: bool = False) -> np.ndarray:
+        """Presence matrix for profile dicts or columnar profiles (see encode_columns)."""
+        columns = _as_columns(profiles)
+        if columns is not None:
+            return self.encode_columns(columns, text)
+        return self.encode_rows(profiles)
+
+    def parse_text_row(self, row: Mapping) -> Dict[str, Any]:
+        """Convert the string cells of a CSV row into the value types profiles use."""
+        profile: Dict[str, Any] = dict(row)
+        for field in self.multi_valued:
+            if field in row:
+                profile[field] = (row.get(field) or "").strip().lower() or None
+        for key in self.keys:
+            if key in row:
+                profile[key] = parse_bool(row.get(key))
+        return profile
+
+    @property
+    def n_profiles(self) -> int:
+        """Number of profiles profiles() yields."""
+        count = 2 ** len(self.boolean)
+        for values in self.multi_valued.values():
+            count *= len(values) + 1
+        return count
+
+    def profiles(self) -> Iterator[Dict[str, Any]]:
+        """Yield one profile per combination of field values (None = field not given)."""
+        options = [values + (None,) for values in self.multi_valued.values()]
+        for multi in itertools.product(*options):
+            for flags in itertools.product((False, True), repeat=len(self.boolean)):
+                profile: Dict[str, Any] = dict(zip(self.multi_valued, multi))
+                profile.update(zip(self.boolean, flags))
+                yield profile
+
+
+def _as_columns(obj: Any) -> Any:
+    """Return ``obj`` as a field -> column mapping, or None for a sequence of rows."""
+    if isinstance(obj, Mapping):
+        return obj
+    if isinstance(obj, np.ndarray) and obj.dtype.names:
+        return {name: obj[name] for name in obj.dtype.names}
+    if hasattr(obj, "columns") and hasattr(obj, "__getitem__"):
+        # DataFrame-like
+        return {name: obj[name].to_numpy() if hasattr(obj[name], "to_numpy") else obj[name] for name in obj.columns}
+    return None
+
+
+def _truthy(col: np.ndarray, text: bool) -> np.ndarray:
+    if col.dtype == bool:
+        return col
+    if col.dtype.kind in "iuf":
+        return col != 0
+    if col.dtype.kind == "U":
+        if text:
+            return np.isin(np.char.lower(np.char.strip(col)), list(TRUE_STRINGS))
+        return np.char.str_len(col) > 0
+    if text:
+        return np.fromiter((parse_bool(v) for v in col), dtype=bool, count=len(col))
+    return np.fromiter((bool(v) for v in col), dtype=bool, count=len(col))
+
+
+def _value_codes(col: np.ndarray, value_cols: Dict[str, int], text: bool) -> np.ndarray:
+    """Key column of every cell's value, or -1 when the value is not one of the field's values."""
+    if col.dtype.kind == "U":
+        if text:
+            col = np.char.lower(np.char.strip(col))
+        uniques, inverse = np.unique(col, return_inverse=True)
+        lookup = np.array([value_cols.get(u, -1) for u in uniques.tolist()], dtype=np.intp)
+        return lookup[inverse.reshape(-1)]
+    codes = np.full(len(col), -1, dtype=np.intp)
+    if text:
+        cells = np.array([v.strip().lower() if isinstance(v, str) else v for v in col], dtype=object)
+    else:
+        cells = col if col.dtype == object else col.astype(object)
+    # Object cells cannot be sorted (None mixes with str), so compare against
+    # each of the field's few values instead of factorising.
+    for value, key_col in value_cols.items():
+        codes[cells == value] = key_col
+    return codes
+
+
+def read_csv_columns(stream: TextIO) -> Dict[str, np.ndarray]:
+    """Read a CSV stream into {header: string array}, for encode_columns(..., text=True)."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return {}
+    rows = list(reader)
+    return {
+        name: np.array([row[i] if i < len(row) else "" for row in rows], dtype=str)
+        for i, name in enumerate(header)
+    }
@@ -0,0 +1,254 @@
+"""
+Next-best-question planning for triage.
+
+Given a partial profile, rank_questions() works out for every unasked
+profile field (a boolean symptom, or a multi-valued field such as fever)
+how well its answer is expected to separate the diseases currently ranked
+top-k by diagnose(). build_question_tree() applies that recursively to
+precompile a full question tree, so a live session only walks the tree.
+
+How a question is scored:
+- The current profile and the profile extended by every possible answer of
+  every unasked question (True/False, or each value of a multi-valued field
+  plus None) are scored in one batched call.
+- The candidates are the current top-k diseases, plus any tied with the
+  k-th. For each profile their unclipped scores (raw / max score, before
+  diagnose() clamps them to 0-100 %) are turned into a distribution with a
+  softmax at SCORE_TEMPERATURE; its entropy measures how undecided the
+  ranking is. The unclipped scores matter: early in a triage most diseases
+  sit at 0 % and only the raw scores still tell them apart.
+- The chance of each answer is estimated from the CFs, read as likelihoods:
+  P(symptom present | disease) = BASE_RATE + (1 - BASE_RATE) * CF, and for a
+  multi-valued field each value is weighted the same way while "none of
+  these" gets the rest, normalised per disease. Mixing those with the
+  current candidate distribution gives P(answer).
+- The information gain is the current entropy minus the expected entropy
+  after the answer. Ties keep schema order.
+
+Design notes:
+- The question tree is built breadth first: every open node of one depth is
+  scored in the same batched call, so building the tree costs one batched
+  scoring pass per level rather than one per node.
+- Trees store plain tuples and are converted to JSON-friendly dicts with
+  as_dict(), so they can be shipped to a UI ahead of time.
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from inference_engine import CompiledKB, _normalise, get_compiled_kb
+
+DEFAULT_TOP_K = 3
+BASE_RATE = 0.05
+# Softmax temperature on raw / max scores (0.1 = ten percentage points).
+SCORE_TEMPERATURE = 0.1
+MIN_GAIN = 1e-3
+
+
+class QuestionScore(NamedTuple):
+    """Expected information gain (bits) of asking one profile field."""
+
+    field: str
+    gain: float
+    answers: Tuple[Tuple[Any, float], ...]  # (answer, probability)
+
+
+def _questions(ckb: CompiledKB) -> List[Tuple[str, Tuple[Any, ...]]]:
+    """(field, possible answers) for every question the KB's schema can ask."""
+    schema = ckb.schema
+    questions = [(field, values + (None,)) for field, values in schema.multi_valued.items()]
+    return questions + [(key, (True, False)) for key in schema.boolean]
+
+
+def _answer_likelihoods(ckb: CompiledKB, field: str, answers: Sequence[Any], candidates: np.ndarray) -> np.ndarray:
+    """(len(answers), len(candidates)) P(answer | disease), columns summing to one."""
+    def cf_of(key: str) -> np.ndarray:
+        s_idx = ckb.symptom_index.get(key)
+        return ckb.symptom_cfs(candidates, s_idx) if s_idx is not None else np.zeros(len(candidates))
+
+    if answers == (True, False):
+        present = BASE_RATE + (1.0 - BASE_RATE) * np.clip(cf_of(field), 0.0, 1.0)
+        return np.stack([present, 1.0 - present])
+    values = np.stack([BASE_RATE + (1.0 - BASE_RATE) * np.clip(cf_of(f"{field}_{v}"), 0.0, 1.0)
+                       for v in answers[:-1]])
+    none_of_these = BASE_RATE + (1.0 - BASE_RATE) * (1.0 - np.clip(values.max(axis=0) - BASE_RATE, 0.0, 1.0))
+    weights = np.vstack([values, none_of_these])
+    return weights / weights.sum(axis=0)
+
+
+def _entropy(ratios: np.ndarray) -> np.ndarray:
+    """Entropy in bits of the softmax of each row of raw / max scores."""
+    logits = ratios / SCORE_TEMPERATURE
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    weights = np.exp(logits)
+    probs = weights / weights.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(probs > 0.0, probs * np.log2(probs), 0.0)
+    return -terms.sum(axis=-1)
+
+
+def _softmax(ratios: np.ndarray) -> np.ndarray:
+    weights = np.exp((ratios - ratios.max()) / SCORE_TEMPERATURE)
+    return weights / weights.sum()
+
+
+def _plan(ckb: CompiledKB, profiles: Sequence[Dict[str, Any]], top_k: int
+          ) -> List[Tuple[np.ndarray, np.ndarray, List[QuestionScore]]]:
+    """Score every unasked question of every profile in one batched call.
+
+    Returns, per profile, (current percentages, top-k candidate indices,
+    questions sorted by gain).
+    """
+    questions = _questions(ckb)
+    batch: List[Dict[str, Any]] = []
+    layout = []
+    for profile in profiles:
+        base_row = len(batch)
+        batch.append(profile)
+        asked = []
+        for field, answers in questions:
+            if field in profile:
+                continue
+            asked.append((field, answers, len(batch)))
+            batch.extend({**profile, field: answer} for answer in answers)
+        layout.append((base_row, asked))
+
+    raw = ckb.raw_scores(ckb.encode_batch(batch))
+    percents = _normalise(raw, ckb.max_scores)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(ckb.max_scores > 0.0, raw / ckb.max_scores, 0.0)
+    plans = []
+    for base_row, asked in layout:
+        current = percents[base_row]
+        order = np.argsort(-current, kind="stable")
+        kth = current[order[min(top_k, len(order)) - 1]]
+        candidates = order[current[order] >= kth]
+        prior = _softmax(ratios[base_row, candidates])
+        h_now = float(_entropy(ratios[base_row, candidates]))
+        scored = []
+        for field, answers, first in asked:
+            rows = ratios[first:first + len(answers)][:, candidates]
+            p_answer = _answer_likelihoods(ckb, field, answers, candidates) @ prior
+            gain = h_now - float(p_answer @ _entropy(rows))
+            scored.append(QuestionScore(field, gain, tuple(zip(answers, p_answer.tolist()))))
+        scored.sort(key=lambda q: -q.gain)
+        plans.append((current, candidates, scored))
+    return plans
+
+
+def rank_questions(partial_profile: Dict[str, Any], top_k: int = DEFAULT_TOP_K,
+                   ckb: Optional[CompiledKB] = None) -> List[QuestionScore]:
+    """Unasked questions of ``partial_profile``, best first.
+
+    A field counts as asked when it is a key of the profile (False and None
+    are answers too).
+    """
+    ckb = ckb if ckb is not None else get_compiled_kb()
+    return _plan(ckb, [partial_profile], top_k)[0][2]
+
+
+def next_question(partial_profile: Dict[str, Any], top_k: int = DEFAULT_TOP_K, min_gain: float = MIN_GAIN,
+                  ckb: Optional[CompiledKB] = None) -> Optional[str]:
+    """The field to ask next, or None when no question gains at least ``min_gain`` bits."""
+    ranked = rank_questions(partial_profile, top_k, ckb)
+    return ranked[0].field if ranked and ranked[0].gain >= min_gain else None
+
+
+class QuestionNode:
+    """One node of a question tree.
+
+    Inner nodes have ``field`` (the question) and ``children`` (answer ->
+    node); leaves have ``field`` None. Every node keeps the top-k ranking of
+    the answers that lead to it.
+    """
+
+    __slots__ = ("field", "gain", "ranking", "children")
+
+    def __init__(self, ranking: Tuple[Tuple[str, float], ...]):
+        self.field: Optional[str] = None
+        self.gain = 0.0
+        self.ranking = ranking
+        self.children: Dict[Any, "QuestionNode"] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        node: Dict[str, Any] = {"ranking": [list(item) for item in self.ranking]}
+        if self.field is not None:
+            node.update(ask=self.field, gain=self.gain,
+                        answers=[[answer, child.as_dict()] for answer, child in self.children.items()])
+        return node
+
+
+class QuestionTree:
+    """Precompiled questioning strategy; see build_question_tree()."""
+
+    def __init__(self, root: QuestionNode, kb_version: int, top_k: int):
+        self.root = root
+        self.kb_version = kb_version
+        self.top_k = top_k
+
+    def _walk(self, profile: Dict[str, Any]) -> QuestionNode:
+        node = self.root
+        while node.field is not None and node.field in profile:
+            answer = profile[node.field]
+            if isinstance(next(iter(node.children)), bool):
+                answer = bool(answer)
+            elif answer not in node.children:
+                answer = None
+            node = node.children[answer]
+        return node
+
+    def next_question(self, profile: Dict[str, Any]) -> Optional[str]:
+        """Field to ask next for ``profile``, or None when the tree has nothing left to ask."""
+        return self._walk(profile).field
+
+    def ranking(self, profile: Dict[str, Any]) -> Tuple[Tuple[str, float], ...]:
+        """Top-k ranking at the deepest node ``profile`` reaches."""
+        return self._walk(profile).ranking
+
+    def __len__(self) -> int:
+        count, stack = 0, [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+        return count
+
+    @property
+    def depth(self) -> int:
+        def depth(node: QuestionNode) -> int:
+            return 1 + max((depth(c) for c in node.children.values()), default=0) if node.children else 0
+        return depth(self.root)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"kb_version": self.kb_version, "top_k": self.top_k, "root": self.root.as_dict()}
+
+
+def build_question_tree(top_k: int = DEFAULT_TOP_K, min_gain: float = MIN_GAIN, max_depth: Optional[int] = None,
+                        start: Optional[Dict[str, Any]] = None, ckb: Optional[CompiledKB] = None) -> QuestionTree:
+    """Precompile the question sequence from ``start`` (default: nothing answered).
+
+    Each node asks the question with the highest gain; a branch ends when
+    no question gains ``min_gain`` bits or at ``max_depth`` questions.
+    """
+    ckb = ckb if ckb is not None else get_compiled_kb()
+    start = dict(start or {})
+    frontier: List[Tuple[Dict[str, Any], Optional[QuestionNode], Any]] = [(start, None, None)]
+    root: Optional[QuestionNode] = None
+    depth = 0
+    while frontier:
+        plans = _plan(ckb, [profile for profile, _, _ in frontier], top_k)
+        next_frontier = []
+        for (profile, parent, answer), (current, candidates, scored) in zip(frontier, plans):
+            node = QuestionNode(tuple((ckb.diseases[i], float(current[i])) for i in candidates[:top_k]))
+            if parent is None:
+                root = node
+            else:
+                parent.children[answer] = node
+            if scored and scored[0].gain >= min_gain and (max_depth is None or depth < max_depth):
+                best = scored[0]
+                node.field, node.gain = best.field, best.gain
+                next_frontier.extend(({**profile, best.field: a}, node, a) for a, _ in best.answers)
+        frontier = next_frontier
+        depth += 1
+    return QuestionTree(root, ckb.version, top_k)
@@ -0,0 +1,94 @@
+"""
+Bounded LRU cache for diagnosis results.
+
+Real traffic repeats a small number of symptom combinations, so the inference
+engine keeps recently computed results here, keyed by a canonical form of the
+profile (its symptom bitmask), which ignores non-scoring fields such as age
+and gender.
+
+Design notes:
+- The cache is tagged with a token identifying the compiled knowledge base
+  its entries were computed against (CompiledKB.cache_token, unique per
+  instance). Presenting a different token empties it, so results from
+  another KB are never served, even when two KBs carry the same version
+  number.
+- Values are stored as immutable objects (tuples, read-only mappings); the
+  engine hands out shallow copies of the outer list so callers cannot corrupt
+  cached entries.
+- A lock guards the OrderedDict because Streamlit serves sessions from
+  multiple threads.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+DEFAULT_MAXSIZE = 4096
+
+
+class LRUCache:
+    """Least-recently-used mapping with hit/miss counters and a KB token tag."""
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.token: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, token: Hashable) -> Any:
+        """Return the cached value for ``key`` or None, counting a hit or miss."""
+        with self._lock:
+            if token != self.token:
+                self._data.clear()
+                self.token = token
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, token: Hashable) -> None:
+        """Store ``value`` computed against the KB ``token``, evicting the oldest entry if full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if token != self.token:
+                self._data.clear()
+                self.token = token
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize: int) -> None:
+        """Change the capacity, evicting least-recently-used entries as needed."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(0, maxsize):
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, capacity, hit/miss counts and hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "kb_token": self.token,
+        }
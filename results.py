@@ -0,0 +1,130 @@
+"""
+Compact result types for the inference engine.
+
+The engine's public functions return lists of (disease, percent) tuples, and
+diagnose_with_explanation() adds an explanation mapping per disease. That is
+convenient for the UI but heavy when millions of diagnoses are held in memory
+by batch jobs. This module provides leaner representations that convert
+cheaply back to the tuple format:
+
+- DiagnosisRecord: one ranked disease as a __slots__ object (no per-instance
+  dict), optionally pointing at its lazy explanation.
+- RankedResults: the usual list of tuples, tagged with the KB version.
+- CompactBatchResults: columnar storage for many profiles, i.e. an (N, k)
+  array of disease indices (smallest integer type that fits) and an (N, k)
+  float32 array of percentages, plus one shared tuple of disease names.
+
+Percentages are stored as float32 and rounded back to one decimal place on
+conversion, which restores exactly the values diagnose() returns.
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class RankedResults(list):
+    """A ranking list that also records the KB version it was computed with.
+
+    Behaves exactly like the list diagnose() always returned; ``kb_version``
+    identifies the knowledge-base snapshot used.
+    """
+
+    __slots__ = ("kb_version",)
+
+    def __init__(self, items: Sequence = (), kb_version: Optional[int] = None):
+        super().__init__(items)
+        self.kb_version = kb_version
+
+
+class DiagnosisRecord:
+    """One ranked disease of a diagnosis."""
+
+    __slots__ = ("disease", "percent", "explanation")
+
+    def __init__(self, disease: str, percent: float, explanation: Optional[Any] = None):
+        self.disease = disease
+        self.percent = percent
+        self.explanation = explanation
+
+    def as_tuple(self) -> Tuple[str, float]:
+        """Return the (disease, percent) tuple used by diagnose()."""
+        return (self.disease, self.percent)
+
+    def as_explained_tuple(self) -> Tuple[str, float, Any]:
+        """Return the (disease, percent, explanation) tuple used by diagnose_with_explanation()."""
+        return (self.disease, self.percent, self.explanation)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DiagnosisRecord):
+            return NotImplemented
+        return self.disease == other.disease and self.percent == other.percent
+
+    def __repr__(self) -> str:
+        return f"DiagnosisRecord({self.disease!r}, {self.percent})"
+
+
+def _index_dtype(n_diseases: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_diseases <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class CompactBatchResults:
+    """Top-k rankings of many profiles in two small columnar arrays.
+
+    Attributes:
+      diseases: disease names; ``disease_indices`` point into this tuple.
+      disease_indices: (N, k) disease indices per row, best first.
+      scores: (N, k) float32 percentages matching ``disease_indices``.
+      kb_version: version of the knowledge base the scores came from.
+    """
+
+    __slots__ = ("diseases", "disease_indices", "scores", "kb_version")
+
+    def __init__(self, diseases: Sequence[str], disease_indices: np.ndarray, scores: np.ndarray,
+                 kb_version: Optional[int] = None):
+        self.diseases = tuple(diseases)
+        self.kb_version = kb_version
+        self.disease_indices = np.ascontiguousarray(disease_indices, dtype=_index_dtype(len(self.diseases)))
+        self.scores = np.ascontiguousarray(scores, dtype=np.float32)
+
+    @classmethod
+    def from_ranked(cls, diseases: Sequence[str], top_indices: np.ndarray, full_scores: np.ndarray,
+                    kb_version: Optional[int] = None) -> "CompactBatchResults":
+        """Build from per-row disease order and a full (N, n_diseases) score matrix."""
+        return cls(diseases, top_indices, np.take_along_axis(full_scores, top_indices, axis=1), kb_version)
+
+    def __len__(self) -> int:
+        return self.disease_indices.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the two arrays."""
+        return self.disease_indices.nbytes + self.scores.nbytes
+
+    def ranked(self, row: int) -> List[Tuple[str, float]]:
+        """Return one row in the diagnose() tuple format."""
+        names = self.diseases
+        return [
+            (names[i], round(float(s), 1))
+            for i, s in zip(self.disease_indices[row].tolist(), self.scores[row].tolist())
+        ]
+
+    def records(self, row: int) -> List[DiagnosisRecord]:
+        """Return one row as DiagnosisRecord objects."""
+        return [DiagnosisRecord(d, p) for d, p in self.ranked(row)]
+
+    def to_tuples(self) -> List[List[Tuple[str, float]]]:
+        """Return every row in the diagnose() tuple format."""
+        names = self.diseases
+        rounded = np.round(self.scores.astype(np.float64), 1).tolist()
+        return [
+            [(names[i], s) for i, s in zip(idx_row, score_row)]
+            for idx_row, score_row in zip(self.disease_indices.tolist(), rounded)
+        ]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.ranked(row)
@@ -0,0 +1,282 @@
+"""
+Rete-style network for multi-level forward chaining.
+
+Disease rules map symptom keys to CFs. Derived-fact rules (see
+knowledge_base.DERIVED_FACTS) add intermediate conclusions such as
+"lower_respiratory_infection" that hold when all the facts of one of their
+condition lists hold; disease rules may then reference the derived fact like
+any other symptom key, and derived facts may feed further derived facts.
+
+The network is compiled once per knowledge base:
+
+- one alpha memory per fact (base symptom key or derived fact), holding the
+  join nodes that test that fact;
+- a beta network of join nodes, one per distinct condition prefix. Condition
+  lists are ordered by how often each fact is used, so rules sharing
+  conditions share the nodes that test them and a shared prefix is joined
+  only once;
+- production entries on the join node that completes a condition list,
+  naming the derived fact it supports.
+
+A WorkingMemory holds the state for one patient: the asserted facts, which
+join nodes are active and how many productions currently support each
+derived fact. Asserting or retracting a fact only visits the join nodes in
+that fact's alpha memory and their descendants, and a derived fact changes
+state only when its support count moves between zero and non-zero.
+
+Facts are propositional (symptom keys carry no variables), so a join node
+is active exactly when its parent is active and its own fact is present.
+"""
+
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+DerivedRules = Mapping[str, Mapping[str, Any]]
+
+
+class _JoinNode:
+    __slots__ = ("fact", "parent", "children", "productions")
+
+    def __init__(self, fact: str, parent: int):
+        self.fact = fact
+        self.parent = parent
+        self.children: List[int] = []
+        self.productions: List[str] = []
+
+
+def validate_derived_rules(derived: DerivedRules) -> Dict[str, List[Tuple[str, ...]]]:
+    """Return {derived fact: [condition tuples]} or raise ValueError.
+
+    Every derived fact needs at least one non-empty condition list, and
+    derived facts must not depend on themselves, directly or indirectly.
+    """
+    conditions: Dict[str, List[Tuple[str, ...]]] = {}
+    for fact, rule in derived.items():
+        alternatives = rule.get("when") if isinstance(rule, Mapping) else None
+        if not alternatives or not all(alternatives):
+            raise ValueError(f"Derived fact {fact!r} needs non-empty 'when' condition lists")
+        conditions[fact] = [tuple(dict.fromkeys(str(c) for c in alt)) for alt in alternatives]
+
+    state: Dict[str, int] = {}
+
+    def visit(fact: str, path: Tuple[str, ...]) -> None:
+        if state.get(fact) == 2:
+            return
+        if state.get(fact) == 1:
+            raise ValueError("Derived facts form a cycle: " + " -> ".join(path + (fact,)))
+        state[fact] = 1
+        for alt in conditions[fact]:
+            for cond in alt:
+                if cond in conditions:
+                    visit(cond, path + (fact,))
+        state[fact] = 2
+
+    for fact in conditions:
+        visit(fact, ())
+    return conditions
+
+
+class RuleNetwork:
+    """Compiled alpha/beta network for a set of derived-fact rules."""
+
+    def __init__(self, derived: DerivedRules, needed: Optional[Iterable[str]] = None):
+        """Compile ``derived``; with ``needed``, keep only rules those facts depend on."""
+        conditions = validate_derived_rules(derived)
+        if needed is not None:
+            conditions = _restrict(conditions, needed)
+        self.rules: Dict[str, List[Tuple[str, ...]]] = conditions
+        self.explains: Dict[str, str] = {f: str(derived[f].get("explain", "")) for f in conditions}
+
+        usage = Counter(cond for alts in conditions.values() for alt in alts for cond in alt)
+        self._nodes: List[_JoinNode] = []
+        self._alpha: Dict[str, List[int]] = defaultdict(list)
+        self._roots: List[int] = []
+        prefixes: Dict[Tuple[str, ...], int] = {}
+        for fact, alts in conditions.items():
+            for alt in alts:
+                ordered = sorted(alt, key=lambda c: (-usage[c], c))
+                parent = -1
+                for depth in range(len(ordered)):
+                    prefix = tuple(ordered[: depth + 1])
+                    node_id = prefixes.get(prefix)
+                    if node_id is None:
+                        node_id = prefixes[prefix] = len(self._nodes)
+                        self._nodes.append(_JoinNode(ordered[depth], parent))
+                        self._alpha[ordered[depth]].append(node_id)
+                        (self._nodes[parent].children if parent >= 0 else self._roots).append(node_id)
+                    parent = node_id
+                self._nodes[parent].productions.append(fact)
+        self._alpha = dict(self._alpha)
+        self.order = _topological_order(conditions)
+
+    @property
+    def derived_facts(self) -> Tuple[str, ...]:
+        """Derived facts in dependency order (conditions before conclusions)."""
+        return self.order
+
+    @property
+    def conditions(self) -> Set[str]:
+        """Every fact tested by some join node."""
+        return set(self._alpha)
+
+    @property
+    def n_nodes(self) -> int:
+        """Number of join nodes in the beta network."""
+        return len(self._nodes)
+
+    def working_memory(self) -> "WorkingMemory":
+        return WorkingMemory(self)
+
+    def closure(self, facts: Iterable[str]) -> Set[str]:
+        """Return ``facts`` plus every fact derivable from them."""
+        present = set(facts)
+        for fact in self.order:
+            if fact not in present and any(all(c in present for c in alt) for alt in self.rules[fact]):
+                present.add(fact)
+        return present
+
+    def derive_columns(self, column: Callable[[str], np.ndarray]) -> Dict[str, np.ndarray]:
+        """Evaluate every derived fact for many profiles at once.
+
+        ``column(fact)`` returns the boolean presence column of a base fact.
+        Returns {derived fact: boolean column}, computed in dependency order
+        so each derived column is evaluated once and reused.
+        """
+        cache: Dict[str, np.ndarray] = {}
+
+        def get(fact: str) -> np.ndarray:
+            col = cache.get(fact)
+            if col is None:
+                col = cache[fact] = np.asarray(column(fact), dtype=bool)
+            return col
+
+        for fact in self.order:
+            derived = None
+            for alt in self.rules[fact]:
+                both = np.logical_and.reduce([get(c) for c in alt])
+                derived = both if derived is None else derived | both
+            cache[fact] = derived
+        return {fact: cache[fact] for fact in self.order}
+
+
+def _restrict(conditions: Dict[str, List[Tuple[str, ...]]], needed: Iterable[str]) -> Dict[str, List[Tuple[str, ...]]]:
+    keep: Set[str] = set()
+    stack = [f for f in needed if f in conditions]
+    while stack:
+        fact = stack.pop()
+        if fact in keep:
+            continue
+        keep.add(fact)
+        stack.extend(c for alt in conditions[fact] for c in alt if c in conditions)
+    return {f: alts for f, alts in conditions.items() if f in keep}
+
+
+def _topological_order(conditions: Dict[str, List[Tuple[str, ...]]]) -> Tuple[str, ...]:
+    order: List[str] = []
+    seen: Set[str] = set()
+
+    def visit(fact: str) -> None:
+        if fact in seen:
+            return
+        seen.add(fact)
+        for alt in conditions[fact]:
+            for cond in alt:
+                if cond in conditions:
+                    visit(cond)
+        order.append(fact)
+
+    for fact in conditions:
+        visit(fact)
+    return tuple(order)
+
+
+class WorkingMemory:
+    """Incremental fact state of one patient in a RuleNetwork."""
+
+    def __init__(self, network: RuleNetwork):
+        self.network = network
+        self.asserted: Set[str] = set()
+        self._support: Dict[str, int] = {}
+        self._active = [False] * network.n_nodes
+        self.activations = 0
+
+    def is_present(self, fact: str) -> bool:
+        return fact in self.asserted or self._support.get(fact, 0) > 0
+
+    @property
+    def facts(self) -> Set[str]:
+        """Asserted plus currently derived facts."""
+        return self.asserted | {f for f, n in self._support.items() if n > 0}
+
+    def assert_fact(self, fact: str) -> List[str]:
+        """Assert a base fact. Returns the facts whose presence changed."""
+        if fact in self.asserted:
+            return []
+        was_present = self.is_present(fact)
+        self.asserted.add(fact)
+        changed: List[str] = []
+        if not was_present:
+            self._fact_on(fact, changed)
+        return changed
+
+    def retract_fact(self, fact: str) -> List[str]:
+        """Retract a base fact. Returns the facts whose presence changed."""
+        if fact not in self.asserted:
+            return []
+        self.asserted.discard(fact)
+        changed: List[str] = []
+        if not self.is_present(fact):
+            self._fact_off(fact, changed)
+        return changed
+
+    def _fact_on(self, fact: str, changed: List[str]) -> None:
+        changed.append(fact)
+        nodes = self.network._nodes
+        for node_id in self.network._alpha.get(fact, ()):
+            parent = nodes[node_id].parent
+            if parent < 0 or self._active[parent]:
+                self._activate(node_id, changed)
+
+    def _fact_off(self, fact: str, changed: List[str]) -> None:
+        changed.append(fact)
+        for node_id in self.network._alpha.get(fact, ()):
+            if self._active[node_id]:
+                self._deactivate(node_id, changed)
+
+    def _activate(self, node_id: int, changed: List[str]) -> None:
+        self._active[node_id] = True
+        self.activations += 1
+        node = self.network._nodes[node_id]
+        for fact in node.productions:
+            was_present = self.is_present(fact)
+            self._support[fact] = self._support.get(fact, 0) + 1
+            if not was_present:
+                self._fact_on(fact, changed)
+        for child in node.children:
+            if not self._active[child] and self.is_present(self.network._nodes[child].fact):
+                self._activate(child, changed)
+
+    def _deactivate(self, node_id: int, changed: List[str]) -> None:
+        self._active[node_id] = False
+        self.activations += 1
+        node = self.network._nodes[node_id]
+        for child in node.children:
+            if self._active[child]:
+                self._deactivate(child, changed)
+        for fact in node.productions:
+            self._support[fact] -= 1
+            if not self.is_present(fact):
+                self._fact_off(fact, changed)
+
+    def set_facts(self, facts: Iterable[str]) -> List[str]:
+        """Make ``facts`` the asserted set, applying only the difference."""
+        target = set(facts)
+        changed: List[str] = []
+        for fact in sorted(self.asserted - target):
+            changed += self.retract_fact(fact)
+        for fact in sorted(target - self.asserted):
+            changed += self.assert_fact(fact)
+        return changed
+
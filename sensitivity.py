@@ -0,0 +1,255 @@
+"""
+Monte Carlo sensitivity analysis of rankings under CF perturbations.
+
+Usage:
+  python sensitivity.py [INPUT] [--format jsonl|csv] [--samples 2000]
+                        [--spread 0.2] [--seed 0] [--workers N]
+
+Draws ``samples`` perturbed copies of the compiled CF matrix, each CF scaled
+by an independent factor from U(1 - spread, 1 + spread) and clipped to
+[0, 1], scores every profile from INPUT against every copy and prints, per
+disease, how often its rank changes and how wide its score interval is.
+Without INPUT every profile the engine can distinguish is used.
+
+Design notes:
+- Perturbed copies are scored in blocks: the (samples, D, S) CF stack is
+  summed against the (N, S) presence matrix with the engine's kernel
+  (inference_engine.sum_present_cfs), so the formula, summation order and
+  rounding are those of diagnose(); block size keeps each block's
+  (samples, N, D) score and rank tensors under MAX_BLOCK_CELLS.
+- Statistics are accumulated block by block: each block is reduced to rank
+  flip counts per disease and top-1 keep counts per profile, so memory does
+  not grow with ``samples``. Score intervals need the scores themselves;
+  the report keeps the first draws up to MAX_SCORE_CELLS (draws are i.i.d.,
+  so the first k are a uniform sample of all of them) and a run whose
+  profiles x diseases cannot fit one draw is rejected.
+- Every block draws from its own child of one SeedSequence, so results only
+  depend on ``seed`` and are identical whether blocks run in this process or
+  in a worker pool. Workers read the unperturbed CF matrix from the shared
+  memory block used by parallel.py and receive the presence matrix and
+  baseline ranks once, through the pool initializer.
+- Rankings use a stable sort on the rounded percentages, so ties keep KB
+  order exactly as diagnose() does.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from batch_score import read_profiles
+from inference_engine import (
+    PENALTY_FRACTION, CompiledKB, _normalise, enumerate_profiles, get_compiled_kb, sum_present_cfs,
+)
+from parallel import SharedCompiledKB, attach_compiled_kb
+
+DEFAULT_SAMPLES = 1000
+DEFAULT_SPREAD = 0.2
+MAX_BLOCK_CELLS = 4_000_000
+MAX_SCORE_CELLS = 50_000_000
+
+
+def perturb_cf(cf: np.ndarray, n_samples: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    """Return ``n_samples`` copies of ``cf`` with every CF scaled by U(1 - spread, 1 + spread), clipped to [0, 1]."""
+    factors = rng.uniform(1.0 - spread, 1.0 + spread, size=(n_samples,) + cf.shape)
+    return np.clip(cf * factors, 0.0, 1.0)
+
+
+def score_perturbed(cf_stack: np.ndarray, presence: np.ndarray) -> np.ndarray:
+    """Percentages of every profile under every CF matrix: (samples, N, D) from (samples, D, S) and (N, S)."""
+    raw = (1.0 + PENALTY_FRACTION) * sum_present_cfs(presence, cf_stack)
+    raw -= PENALTY_FRACTION * cf_stack.sum(axis=2)[:, None, :]
+    max_scores = np.clip(cf_stack, 0.0, None).sum(axis=2)[:, None, :]
+    return _normalise(raw, max_scores)
+
+
+def rank_positions(scores: np.ndarray) -> np.ndarray:
+    """Rank (0 = best) of every disease along the last axis, ties broken by KB order."""
+    order = np.argsort(-scores, axis=-1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[-1]), axis=-1)
+    return ranks
+
+
+def _score_block(cf: np.ndarray, presence: np.ndarray, base_ranks: np.ndarray, n_samples: int, spread: float,
+                 seed: np.random.SeedSequence, keep: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score one block and reduce it to (rank flips per disease, top-1 keeps per profile, first ``keep`` scores)."""
+    stack = perturb_cf(cf, n_samples, spread, np.random.default_rng(seed))
+    scores = score_perturbed(stack, presence).astype(np.float32)
+    ranks = rank_positions(scores)
+    flips = np.count_nonzero(ranks != base_ranks[None], axis=(0, 1))
+    base_top = base_ranks.argmin(axis=1)
+    kept_top = np.count_nonzero(ranks[:, np.arange(len(base_top)), base_top] == 0, axis=0)
+    return flips, kept_top, scores[:keep]
+
+
+# Per-worker state, set by _init_worker in each pool process.
+_worker_kb: Optional[CompiledKB] = None
+_worker_shm = None
+_worker_inputs: Tuple[np.ndarray, np.ndarray] = ()
+
+
+def _init_worker(spec: Dict[str, Any], presence: np.ndarray, base_ranks: np.ndarray) -> None:
+    global _worker_kb, _worker_shm, _worker_inputs
+    _worker_kb, _worker_shm = attach_compiled_kb(spec)
+    _worker_inputs = (presence, base_ranks)
+
+
+def _worker_block(n_samples: int, spread: float, seed: np.random.SeedSequence,
+                  keep: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return _score_block(_worker_kb.cf, *_worker_inputs, n_samples, spread, seed, keep)
+
+
+class SensitivityReport:
+    """Outcome of a sensitivity run.
+
+    Attributes:
+      diseases: disease names, the last axis of every array.
+      baseline: (N, D) percentages with the unperturbed KB (as diagnose()).
+      scores: (kept, N, D) float32 percentages under the first ``kept``
+        perturbations (all of them unless capped by MAX_SCORE_CELLS); the
+        source of score_interval().
+      n_samples: number of perturbations the flip rates are computed over.
+      rank_flip_rate: (D,) fraction of (sample, profile) pairs in which the
+        disease's rank differs from its baseline rank.
+      top1_flip_rate: (D,) for profiles where the disease ranks first at
+        baseline, the fraction of samples in which it loses first place
+        (NaN if it is never first).
+      top1_stability: (N,) per profile, fraction of samples keeping the
+        baseline top-1 disease.
+      spread, seed: the perturbation settings used.
+    """
+
+    def __init__(self, diseases: Tuple[str, ...], baseline: np.ndarray, scores: np.ndarray,
+                 spread: float, seed: int, n_samples: int, rank_flips: np.ndarray, top1_kept: np.ndarray):
+        self.diseases = diseases
+        self.baseline = baseline
+        self.scores = scores
+        self.spread = spread
+        self.seed = seed
+        self.n_samples = n_samples
+
+        n_profiles = baseline.shape[0]
+        pairs = n_samples * n_profiles
+        self.rank_flip_rate = rank_flips / pairs if pairs else np.zeros(len(diseases))
+        self.top1_stability = top1_kept / n_samples if n_samples else np.ones(n_profiles)
+        self.top1_flip_rate = np.full(len(diseases), np.nan)
+        base_top = rank_positions(baseline).argmin(axis=1)
+        for d_idx in np.unique(base_top):
+            self.top1_flip_rate[d_idx] = 1.0 - self.top1_stability[base_top == d_idx].mean()
+
+    def score_interval(self, level: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (low, high) (N, D) percentile bounds of the kept perturbed scores."""
+        tail = (1.0 - level) / 2.0 * 100.0
+        low, high = np.percentile(self.scores, [tail, 100.0 - tail], axis=0)
+        return low, high
+
+    def summary(self, level: float = 0.95) -> List[Dict[str, Any]]:
+        """One dict per disease: flip rates plus mean and max interval width over profiles."""
+        low, high = self.score_interval(level)
+        width = high - low
+        rows = []
+        for d_idx, disease in enumerate(self.diseases):
+            top1 = self.top1_flip_rate[d_idx]
+            rows.append({
+                "disease": disease,
+                "rank_flip_rate": float(self.rank_flip_rate[d_idx]),
+                "top1_flip_rate": None if np.isnan(top1) else float(top1),
+                "mean_interval_width": float(width[:, d_idx].mean()) if width.size else 0.0,
+                "max_interval_width": float(width[:, d_idx].max()) if width.size else 0.0,
+            })
+        return rows
+
+
+def run_sensitivity(profiles: Iterable[Dict[str, Any]], n_samples: int = DEFAULT_SAMPLES,
+                    spread: float = DEFAULT_SPREAD, seed: int = 0, workers: Optional[int] = None,
+                    ckb: Optional[CompiledKB] = None, block_size: Optional[int] = None,
+                    max_score_cells: int = MAX_SCORE_CELLS) -> SensitivityReport:
+    """Score ``profiles`` under ``n_samples`` CF perturbations of ``ckb`` (default: the engine's KB).
+
+    ``workers`` > 1 spreads the sample blocks over a process pool; the
+    report is the same for any worker count. The report keeps the scores of
+    at most ``max_score_cells // (profiles * diseases)`` draws for its
+    score intervals; ValueError if not even one draw fits.
+    """
+    if not 0.0 <= spread < 1.0:
+        raise ValueError("spread must be in [0, 1)")
+    ckb = ckb if ckb is not None else get_compiled_kb()
+    presence = ckb.encode_batch(list(profiles))
+    n_profiles, n_diseases = presence.shape[0], len(ckb.diseases)
+    cells = max(1, n_profiles * n_diseases)
+    if cells > max_score_cells:
+        raise ValueError(f"{n_profiles} profiles x {n_diseases} diseases exceed max_score_cells "
+                         f"({max_score_cells}); score fewer profiles per run")
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_CELLS // cells)
+    starts = range(0, n_samples, block_size)
+    sizes = [min(block_size, n_samples - start) for start in starts]
+    n_kept = min(n_samples, max_score_cells // cells)
+    keeps = [min(size, max(0, n_kept - start)) for start, size in zip(starts, sizes)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    baseline = ckb.percentages(presence)
+    base_ranks = rank_positions(baseline)
+
+    rank_flips = np.zeros(n_diseases, dtype=np.int64)
+    top1_kept = np.zeros(n_profiles, dtype=np.int64)
+    kept_scores = []
+
+    def add(block: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> None:
+        flips, kept_top, scores = block
+        rank_flips[:] += flips
+        top1_kept[:] += kept_top
+        if len(scores):
+            kept_scores.append(scores)
+
+    if workers is not None and workers > 1 and len(sizes) > 1:
+        with SharedCompiledKB(ckb) as shared:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared.spec, presence, base_ranks)) as pool:
+                for block in pool.map(_worker_block, sizes, [spread] * len(sizes), seeds, keeps):
+                    add(block)
+    else:
+        for size, s, keep in zip(sizes, seeds, keeps):
+            add(_score_block(ckb.cf, presence, base_ranks, size, spread, s, keep))
+
+    scores = (np.concatenate(kept_scores) if kept_scores
+              else np.zeros((0, n_profiles, n_diseases), dtype=np.float32))
+    return SensitivityReport(ckb.diseases, baseline, scores, spread, seed, n_samples, rank_flips, top1_kept)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Monte Carlo sensitivity of disease rankings to CF changes.")
+    parser.add_argument("input", nargs="?", help="JSONL/CSV profiles (default: every distinguishable profile)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="input format (default: from extension)")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="perturbed KB copies to draw")
+    parser.add_argument("--spread", type=float, default=DEFAULT_SPREAD, help="relative CF perturbation (0.2 = +/-20%%)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (0 = one per CPU)")
+    parser.add_argument("--level", type=float, default=0.95, help="score interval coverage")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+        with open(args.input, newline="" if fmt == "csv" else None) as fh:
+            profiles = list(read_profiles(fh, fmt))
+    else:
+        profiles = list(enumerate_profiles())
+    workers = args.workers or os.cpu_count()
+    report = run_sensitivity(profiles, args.samples, args.spread, args.seed, workers)
+
+    print(f"{len(profiles)} profiles x {report.n_samples} samples, CF spread +/-{args.spread:.0%}")
+    print(f"Profiles keeping their top-1 disease in every sample: "
+          f"{np.mean(report.top1_stability == 1.0):.1%}")
+    print(f"{'Disease':24s} {'rank flips':>10s} {'top-1 flips':>11s} {'mean CI':>8s} {'max CI':>8s}")
+    for row in report.summary(args.level):
+        top1 = "-" if row["top1_flip_rate"] is None else f"{row['top1_flip_rate']:.1%}"
+        print(f"{row['disease']:24s} {row['rank_flip_rate']:>10.1%} {top1:>11s} "
+              f"{row['mean_interval_width']:>8.1f} {row['max_interval_width']:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Sharded diagnosis: the knowledge base split across worker processes.
+
+Usage (remote shards):
+  python sharded.py --host 0.0.0.0 --port 7100 --authkey SECRET
+
+A ShardedDiagnosis coordinator partitions the diseases of a CompiledKB into
+contiguous ranges and ships each range to one shard. Every query is
+broadcast to all shards, each shard returns its local top-k, and the
+coordinator merges them into the global ranking.
+
+Design notes:
+- Shards are multiprocessing.connection servers (TCP, authenticated), so the
+  same coordinator drives shards it spawns locally or shards started on
+  other hosts with the command above. The KB slice travels in the "load"
+  message; a shard needs no KB file of its own.
+- The coordinator encodes each profile once, including derived facts, and
+  broadcasts only the present symptom indices. Shards share the full symptom
+  list, so the indices mean the same thing everywhere.
+- Shards score through the inverted index (CompiledKB.top_k /
+  percentages_sparse). A disease's sum does not depend on which other
+  diseases are in the KB, and every engine path uses the same summation
+  order (inference_engine.sum_present_cfs), so each score equals the
+  single-process one bit for bit, whichever path diagnose() takes.
+- Ranges are contiguous and cut to balance rule counts. Merging the shard
+  lists by (score desc, KB index asc) therefore reproduces diagnose()
+  exactly, including KB order between ties.
+- Requests are sent to every shard before any reply is read, so the shards
+  score in parallel.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from inference_engine import CompiledKB, _check_top_k, get_compiled_kb
+from parallel import TopKBatchDiagnosis
+from results import RankedResults
+
+Address = Tuple[str, int]
+
+SHARD_START_TIMEOUT = 30.0
+
+
+def partition_diseases(ckb: CompiledKB, n_shards: int) -> List[Tuple[int, int]]:
+    """Split the diseases into ``n_shards`` contiguous (start, stop) ranges of similar rule count."""
+    n_diseases = len(ckb.diseases)
+    n_shards = max(1, min(n_shards, n_diseases))
+    rules = np.cumsum(np.count_nonzero(ckb.cf, axis=1) + 1)
+    targets = rules[-1] * np.arange(1, n_shards) / n_shards
+    cuts = np.searchsorted(rules, targets, side="right")
+    # Keep every shard non-empty even when a few diseases hold most rules
+    cuts = np.maximum(cuts, np.arange(1, n_shards))
+    cuts = np.minimum(cuts, n_diseases - n_shards + np.arange(1, n_shards))
+    cuts = np.maximum.accumulate(cuts)
+    bounds = [0] + [int(c) for c in cuts] + [n_diseases]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _shard_payload(ckb: CompiledKB, start: int, stop: int) -> Dict[str, Any]:
+    return {
+        "offset": start,
+        "diseases": ckb.diseases[start:stop],
+        "symptoms": ckb.symptoms,
+        "cf": np.ascontiguousarray(ckb.cf[start:stop]),
+        "max_scores": ckb.max_scores[start:stop].copy(),
+        "penalty_base": ckb.penalty_base[start:stop].copy(),
+        "version": ckb.version,
+    }
+
+
+def _shard_top_k(ckb: CompiledKB, offset: int, s_indices: List[int],
+                 k: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Local ranking of one profile: (global disease indices, percentages), best first."""
+    k = _check_top_k(k)
+    if k is None or k >= len(ckb.diseases):
+        percents = ckb.percentages_sparse(s_indices)
+        order = np.argsort(-percents, kind="stable")[:k]
+        return order + offset, percents[order]
+    d_idx, percents = ckb.top_k(s_indices, k)
+    return d_idx + offset, percents
+
+
+def _serve_connection(conn: Connection) -> bool:
+    """Answer coordinator requests on one connection.
+
+    Returns True after a "close" request, False when the coordinator disconnects.
+    """
+    ckb: Optional[CompiledKB] = None
+    offset = 0
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return False
+        op = request[0]
+        try:
+            if op == "load":
+                payload = request[1]
+                ckb = CompiledKB.from_arrays(payload["diseases"], payload["symptoms"], payload["cf"],
+                                             version=payload["version"], max_scores=payload["max_scores"],
+                                             penalty_base=payload["penalty_base"])
+                offset = payload["offset"]
+                reply: Any = len(ckb.diseases)
+            elif op == "rank":
+                if ckb is None:
+                    raise RuntimeError("shard has no KB loaded")
+                _, batch, k = request
+                reply = [_shard_top_k(ckb, offset, s_indices, k) for s_indices in batch]
+            elif op == "close":
+                conn.send(("ok", None))
+                return True
+            else:
+                raise ValueError(f"unknown request {op!r}")
+        except Exception as exc:
+            conn.send(("error", f"{type(exc).__name__}: {exc}"))
+        else:
+            conn.send(("ok", reply))
+
+
+def serve_shard(host: str = "127.0.0.1", port: int = 0, authkey: bytes = b"",
+                ready: Optional[Any] = None) -> None:
+    """Run one shard server, serving coordinators one at a time until one sends "close".
+
+    ``ready``, if given, is a queue that receives the bound (host, port).
+    """
+    with Listener((host, port), authkey=authkey) as listener:
+        if ready is not None:
+            ready.put(listener.address)
+        while True:
+            with listener.accept() as conn:
+                if _serve_connection(conn):
+                    return
+
+
+def _run_local_shard(ready, authkey: bytes) -> None:
+    with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+        ready.put(listener.address)
+        with listener.accept() as conn:
+            _serve_connection(conn)
+
+
+class ShardedDiagnosis:
+    """Coordinator that scores profiles against a KB split over shard processes.
+
+    With ``addresses`` it connects to already running shard servers (see
+    serve_shard); otherwise it starts ``n_shards`` local processes. Use as a
+    context manager, or call close(), to stop them.
+    """
+
+    def __init__(self, n_shards: Optional[int] = None, ckb: Optional[CompiledKB] = None,
+                 addresses: Optional[Sequence[Address]] = None, authkey: Optional[bytes] = None):
+        self._authkey = authkey if authkey is not None else os.urandom(16)
+        self._processes: List[multiprocessing.Process] = []
+        self._conns: List[Connection] = []
+        try:
+            if addresses is None:
+                addresses = self._start_local(n_shards or os.cpu_count() or 1)
+            self.addresses: List[Address] = list(addresses)
+            self._conns = [Client(address, authkey=self._authkey) for address in self.addresses]
+            self.load(ckb)
+        except BaseException:
+            self.close()
+            raise
+
+    def _start_local(self, n_shards: int) -> List[Address]:
+        ready = multiprocessing.Queue()
+        for _ in range(n_shards):
+            process = multiprocessing.Process(target=_run_local_shard, args=(ready, self._authkey), daemon=True)
+            process.start()
+            self._processes.append(process)
+        return [ready.get(timeout=SHARD_START_TIMEOUT) for _ in range(n_shards)]
+
+    @property
+    def n_shards(self) -> int:
+        return len(self._conns)
+
+    def load(self, ckb: Optional[CompiledKB] = None) -> None:
+        """(Re)partition ``ckb`` (default: the engine's current KB) over the shards."""
+        self.ckb = ckb if ckb is not None else get_compiled_kb()
+        self.ranges = partition_diseases(self.ckb, self.n_shards)
+        # A KB smaller than the shard count leaves the extra shards idle
+        self._active = self._conns[: len(self.ranges)]
+        for conn, (start, stop) in zip(self._active, self.ranges):
+            conn.send(("load", _shard_payload(self.ckb, start, stop)))
+        self._gather(self._active)
+
+    def _gather(self, conns: Sequence[Connection]) -> List[Any]:
+        replies = []
+        for shard, conn in enumerate(conns):
+            status, reply = conn.recv()
+            if status != "ok":
+                raise RuntimeError(f"shard {shard} ({self.addresses[shard]}): {reply}")
+            replies.append(reply)
+        return replies
+
+    def _rank(self, batch: List[List[int]], top_k: Optional[int]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Scatter the encoded profiles, gather and merge the per-shard rankings."""
+        top_k = _check_top_k(top_k)
+        for conn in self._active:
+            conn.send(("rank", batch, top_k))
+        per_shard = self._gather(self._active)
+        merged = []
+        for row in range(len(batch)):
+            d_idx = np.concatenate([shard[row][0] for shard in per_shard])
+            scores = np.concatenate([shard[row][1] for shard in per_shard])
+            order = np.lexsort((d_idx, -scores))[:top_k]
+            merged.append((d_idx[order], scores[order]))
+        return merged
+
+    def diagnose(self, patient_profile: Dict[str, Any], top_k: Optional[int] = None) -> RankedResults:
+        """Same result as inference_engine.diagnose() for this coordinator's KB."""
+        (d_idx, scores), = self._rank([self.ckb.encode_indices(patient_profile)], top_k)
+        diseases = self.ckb.diseases
+        return RankedResults(((diseases[i], float(s)) for i, s in zip(d_idx, scores)), self.ckb.version)
+
+    def diagnose_batch(self, profiles: Sequence[Dict[str, Any]], top_k: Optional[int] = None) -> TopKBatchDiagnosis:
+        """Score many profiles in one round trip per shard.
+
+        ``result.ranked(i)`` equals ``diagnose(profiles[i])[:top_k]``.
+        """
+        top_k = _check_top_k(top_k)
+        merged = self._rank([self.ckb.encode_indices(p) for p in profiles], top_k)
+        width = len(self.ckb.diseases) if top_k is None else min(top_k, len(self.ckb.diseases))
+        order = np.zeros((len(merged), width), dtype=np.intp)
+        scores = np.zeros((len(merged), width))
+        for row, (d_idx, percents) in enumerate(merged):
+            order[row], scores[row] = d_idx, percents
+        return TopKBatchDiagnosis(self.ckb.diseases, scores, order, self.ckb.version)
+
+    def close(self) -> None:
+        """Disconnect from the shards and stop the ones this coordinator started."""
+        for conn in self._conns:
+            try:
+                if self._processes:
+                    conn.send(("close",))
+                    conn.recv()
+                conn.close()
+            except (OSError, EOFError):
+                pass
+        self._conns = []
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self) -> "ShardedDiagnosis":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run one diagnosis KB shard server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7100)
+    parser.add_argument("--authkey", default=os.environ.get("SHARD_AUTHKEY", ""),
+                        help="shared secret (default: $SHARD_AUTHKEY)")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("an authkey is required (--authkey or SHARD_AUTHKEY)")
+    print(f"Shard listening on {args.host}:{args.port}")
+    serve_shard(args.host, args.port, args.authkey.encode())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
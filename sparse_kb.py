@@ -0,0 +1,305 @@
+"""
+Compact sparse storage of very large knowledge bases.
+
+A CompiledKB keeps a dense disease x symptom float64 matrix, and the nested
+KB dicts it is built from hold a float and an explanation string per rule.
+For catalogs with millions of rules (most diseases using a handful of the
+symptoms) a SparseKB stores one CSR row per disease instead:
+
+  indptr       int64, n_diseases + 1 row pointers
+  indices      int32 symptom index per rule, ascending within a row
+  data         the CF per rule: float64, float32, or uint8 fixed point
+               (CF = q / 255, so only CFs in [0, 1])
+  explain_ids  int32 per rule, into ``strings``, the interned explanation
+               table (each distinct explanation is stored once)
+
+i.e. 9 (uint8) to 16 (float64) bytes per rule plus the shared strings.
+
+Design notes:
+- Scoring runs on the CSR arrays: the present symptoms are looked up per
+  rule (``presence[indices]``) and summed per row with np.add.reduceat.
+  uint8 CFs are summed as integers, so their sums are exact and only the
+  final scale is rounded. Batches are chunked so the (profiles x rules)
+  intermediate stays under MAX_KERNEL_CELLS.
+- Quantisation changes scores, so every SparseKB records, per disease, the
+  summed absolute CF error E against the float64 CFs it was built from.
+  score_tolerance() turns that into a guaranteed bound on the percentage
+  difference from the float64 engine:
+
+      |percent - reference| <= 350 * E / (max_score - E) + 0.1
+
+  (raw scores move by at most 2E and the max score by E, |raw|/max <= 1.5,
+  and each side's rounding to 0.1 adds 0.05). Diseases whose reference
+  scores differ by more than the two bounds combined keep their order.
+  check_rankings() verifies this on a set of profiles.
+- Profiles are encoded through the same ProfileSchema as CompiledKB, and
+  derived facts (knowledge_base.DERIVED_FACTS) are supported the same way.
+"""
+
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from inference_engine import PENALTY_FRACTION, CompiledKB, _normalise, _select_top_k
+from knowledge_base import MULTI_VALUED_FIELDS
+from profile_schema import ProfileSchema
+from results import RankedResults
+from rule_network import DerivedRules, RuleNetwork
+
+CF_DTYPES = ("float64", "float32", "uint8")
+UINT8_SCALE = 255
+MAX_KERNEL_CELLS = 4_000_000
+
+Rule = Tuple[str, str, float, str]
+
+
+def _quantise(cf: np.ndarray, cf_dtype: str) -> np.ndarray:
+    if cf_dtype == "uint8":
+        if cf.size and (cf.min() < 0.0 or cf.max() > 1.0):
+            raise ValueError("uint8 CF storage needs every CF in [0, 1]")
+        return np.rint(cf * UINT8_SCALE).astype(np.uint8)
+    if cf_dtype in ("float32", "float64"):
+        return cf.astype(cf_dtype)
+    raise ValueError(f"cf_dtype must be one of {CF_DTYPES}, not {cf_dtype!r}")
+
+
+def _dequantise(data: np.ndarray) -> np.ndarray:
+    if data.dtype == np.uint8:
+        return data / UINT8_SCALE
+    return data.astype(np.float64)
+
+
+class SparseKB:
+    """CSR knowledge base with optionally quantised CFs and interned explanations.
+
+    Build one with from_rules(), from_kb() or from_compiled().
+    """
+
+    def __init__(self, diseases: Sequence[str], symptoms: Sequence[str], indptr: np.ndarray,
+                 indices: np.ndarray, data: np.ndarray, explain_ids: np.ndarray, strings: Sequence[str],
+                 cf_error: Optional[np.ndarray] = None, version: int = 0,
+                 derived: Optional[DerivedRules] = None):
+        self.diseases: Tuple[str, ...] = tuple(diseases)
+        self.symptoms: Tuple[str, ...] = tuple(symptoms)
+        self.symptom_index: Dict[str, int] = {s: i for i, s in enumerate(self.symptoms)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.explain_ids = explain_ids
+        self.strings: Tuple[str, ...] = tuple(strings)
+        self.version = version
+        self.cf_dtype = data.dtype.name
+        self.cf_error = np.zeros(len(self.diseases)) if cf_error is None else cf_error
+        self._starts = indptr[:-1][np.diff(indptr) > 0]
+        self._nonempty = np.flatnonzero(np.diff(indptr) > 0)
+
+        values = self.cf_values()
+        self.max_scores = self._row_sums(np.clip(values, 0.0, None))
+        self.penalty_base = PENALTY_FRACTION * self._row_sums(values)
+
+        needed = [s for s in self.symptoms if s in derived] if derived else []
+        self.network: Optional[RuleNetwork] = RuleNetwork(derived, needed) if needed else None
+        keys = list(self.symptoms)
+        if self.network is not None:
+            keys = [k for k in keys + sorted(self.network.conditions) if k not in self.network.rules]
+        self.schema = ProfileSchema(keys, MULTI_VALUED_FIELDS)
+
+    @classmethod
+    def from_rules(cls, rules: Iterable[Rule], cf_dtype: str = "float32", version: int = 0,
+                   derived: Optional[DerivedRules] = None) -> "SparseKB":
+        """Build from a stream of (disease, symptom, cf, explain) rules.
+
+        Rules are accumulated in flat typed arrays, never as per-rule
+        objects. Diseases keep their first-seen order and symptoms are
+        sorted (as knowledge_base.get_symptom_keys() does); a repeated
+        (disease, symptom) rule replaces the earlier one.
+        """
+        disease_ids: Dict[str, int] = {}
+        symptom_ids: Dict[str, int] = {}
+        string_ids: Dict[str, int] = {}
+        rule_d, rule_s, rule_e, rule_cf = array("i"), array("i"), array("i"), array("d")
+        for disease, symptom, cf, explain in rules:
+            rule_d.append(disease_ids.setdefault(disease, len(disease_ids)))
+            rule_s.append(symptom_ids.setdefault(symptom, len(symptom_ids)))
+            rule_e.append(string_ids.setdefault(explain or "", len(string_ids)))
+            rule_cf.append(float(cf))
+
+        symptoms = sorted(symptom_ids)
+        remap = np.empty(len(symptoms), dtype=np.int32)
+        remap[[symptom_ids[s] for s in symptoms]] = np.arange(len(symptoms), dtype=np.int32)
+        d_idx = np.frombuffer(rule_d, dtype=np.int32) if rule_d else np.zeros(0, dtype=np.int32)
+        s_idx = remap[np.frombuffer(rule_s, dtype=np.int32)] if rule_s else np.zeros(0, dtype=np.int32)
+        e_idx = np.frombuffer(rule_e, dtype=np.int32) if rule_e else np.zeros(0, dtype=np.int32)
+        cf = np.frombuffer(rule_cf, dtype=np.float64) if rule_cf else np.zeros(0)
+
+        # Sort by (disease, symptom, arrival) and keep the last of each duplicate
+        order = np.lexsort((np.arange(len(d_idx)), s_idx, d_idx))
+        d_idx, s_idx, e_idx, cf = d_idx[order], s_idx[order], e_idx[order], cf[order]
+        last = np.ones(len(d_idx), dtype=bool)
+        last[:-1] = (d_idx[1:] != d_idx[:-1]) | (s_idx[1:] != s_idx[:-1])
+        d_idx, s_idx, e_idx, cf = d_idx[last], s_idx[last], e_idx[last], cf[last]
+
+        indptr = np.zeros(len(disease_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(d_idx, minlength=len(disease_ids)), out=indptr[1:])
+        return cls._quantised(list(disease_ids), symptoms, indptr, s_idx, cf, e_idx, list(string_ids),
+                              cf_dtype, version, derived)
+
+    @classmethod
+    def from_kb(cls, kb: Dict[str, Dict[str, Any]], cf_dtype: str = "float32", version: int = 0,
+                derived: Optional[DerivedRules] = None) -> "SparseKB":
+        """Build from a KB in the KNOWLEDGE_BASE shape."""
+        def rules():
+            for disease, disease_rules in kb.items():
+                for symptom, rule in disease_rules.items():
+                    if isinstance(rule, dict):
+                        yield disease, symptom, rule.get("cf", 0.0), rule.get("explain", "")
+                    else:
+                        yield disease, symptom, rule, ""
+        return cls.from_rules(rules(), cf_dtype, version, derived)
+
+    @classmethod
+    def from_compiled(cls, ckb: CompiledKB, cf_dtype: str = "float32") -> "SparseKB":
+        """Convert a CompiledKB, keeping its disease and symptom order and version."""
+        d_idx, s_idx = np.nonzero(ckb.cf)
+        indptr = np.zeros(len(ckb.diseases) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(d_idx, minlength=len(ckb.diseases)), out=indptr[1:])
+        string_ids: Dict[str, int] = {}
+        e_idx = np.fromiter((string_ids.setdefault(ckb.explains.get((d, s), ""), len(string_ids))
+                             for d, s in zip(d_idx.tolist(), s_idx.tolist())), dtype=np.int32, count=len(d_idx))
+        return cls._quantised(ckb.diseases, ckb.symptoms, indptr, s_idx.astype(np.int32), ckb.cf[d_idx, s_idx],
+                              e_idx, list(string_ids), cf_dtype, ckb.version, ckb.derived)
+
+    @classmethod
+    def _quantised(cls, diseases, symptoms, indptr, indices, cf, explain_ids, strings, cf_dtype, version,
+                   derived) -> "SparseKB":
+        data = _quantise(np.asarray(cf, dtype=np.float64), cf_dtype)
+        self = cls(diseases, symptoms, indptr, indices, data, explain_ids, strings, version=version, derived=derived)
+        self.cf_error = self._row_sums(np.abs(self.cf_values() - cf))
+        return self
+
+    @property
+    def n_rules(self) -> int:
+        return len(self.indices)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the rule arrays and the explanation table."""
+        arrays = (self.indptr, self.indices, self.data, self.explain_ids)
+        return sum(a.nbytes for a in arrays) + sum(len(s.encode("utf-8")) for s in self.strings)
+
+    def cf_values(self) -> np.ndarray:
+        """The stored CFs as float64, one per rule."""
+        return _dequantise(self.data)
+
+    def _row_sums(self, per_rule: np.ndarray) -> np.ndarray:
+        """Sum per-rule values (last axis) into per-disease values; empty rows sum to 0."""
+        out = np.zeros(per_rule.shape[:-1] + (len(self.diseases),), dtype=per_rule.dtype)
+        if len(self._starts):
+            out[..., self._nonempty] = np.add.reduceat(per_rule, self._starts, axis=-1)
+        return out
+
+    def _support(self, present: np.ndarray) -> np.ndarray:
+        """Summed CF of the present symptoms per disease, for a (..., n_symptoms) boolean array."""
+        hits = present[..., self.indices]
+        if self.data.dtype == np.uint8:
+            return self._row_sums(np.where(hits, self.data, 0).astype(np.int64)) / UINT8_SCALE
+        return self._row_sums(np.where(hits, self.data.astype(np.float64), 0.0))
+
+    def _normalised(self, support: np.ndarray) -> np.ndarray:
+        return _normalise((1.0 + PENALTY_FRACTION) * support - self.penalty_base, self.max_scores)
+
+    def encode(self, patient_profile: Dict[str, Any]) -> np.ndarray:
+        """Boolean presence vector of one profile, derived facts included."""
+        present = self.schema.present(patient_profile)
+        if self.network is not None:
+            present = self.network.closure(present)
+        vector = np.zeros(len(self.symptoms), dtype=bool)
+        vector[[self.symptom_index[k] for k in present if k in self.symptom_index]] = True
+        return vector
+
+    def encode_batch(self, profiles, text: bool = False) -> np.ndarray:
+        """(N, n_symptoms) boolean presence matrix; accepts what ProfileSchema.encode accepts."""
+        base = self.schema.encode(profiles, text)
+        presence = np.zeros((base.shape[0], len(self.symptoms)), dtype=bool)
+        key_index = self.schema.key_index
+        for key, col in key_index.items():
+            s_idx = self.symptom_index.get(key)
+            if s_idx is not None:
+                presence[:, s_idx] = base[:, col]
+        if self.network is not None:
+            absent = np.zeros(base.shape[0], dtype=bool)
+            derived = self.network.derive_columns(lambda f: base[:, key_index[f]] if f in key_index else absent)
+            for fact, col in derived.items():
+                if fact in self.symptom_index:
+                    presence[:, self.symptom_index[fact]] = col
+        return presence
+
+    def percentages(self, presence: np.ndarray) -> np.ndarray:
+        """Percentages for one presence vector or an (N, n_symptoms) matrix of them."""
+        presence = np.asarray(presence, dtype=bool)
+        if presence.ndim == 1:
+            return self._normalised(self._support(presence))
+        rows = max(1, MAX_KERNEL_CELLS // max(1, self.n_rules))
+        out = np.empty((presence.shape[0], len(self.diseases)))
+        for start in range(0, presence.shape[0], rows):
+            out[start:start + rows] = self._normalised(self._support(presence[start:start + rows]))
+        return out
+
+    def diagnose(self, patient_profile: Dict[str, Any], top_k: Optional[int] = None) -> RankedResults:
+        """Ranked (disease, percent) list, best first; ties keep KB order."""
+        percents = self.percentages(self.encode(patient_profile))
+        if top_k is None:
+            order = np.argsort(-percents, kind="stable")
+        else:
+            order, _ = _select_top_k(np.arange(len(percents)), percents, top_k)
+        return RankedResults(((self.diseases[i], float(percents[i])) for i in order), self.version)
+
+    def rules(self, d_idx: int) -> List[Tuple[str, float, str]]:
+        """(symptom, cf, explanation) of every rule of one disease, in symptom order."""
+        lo, hi = self.indptr[d_idx], self.indptr[d_idx + 1]
+        values = _dequantise(self.data[lo:hi])
+        return [(self.symptoms[s], float(cf), self.strings[e])
+                for s, cf, e in zip(self.indices[lo:hi].tolist(), values.tolist(), self.explain_ids[lo:hi].tolist())]
+
+    def score_tolerance(self) -> np.ndarray:
+        """Per-disease bound on |percent - float64 percent|, in percentage points."""
+        room = self.max_scores - self.cf_error
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = np.where(room > 0.0, 350.0 * self.cf_error / room, 100.0)
+        return np.minimum(bound, 100.0) + 0.1
+
+
+def check_rankings(sparse: SparseKB, reference: CompiledKB, profiles) -> Dict[str, Any]:
+    """Score ``profiles`` with both KBs and check the sparse scores against the stated tolerance.
+
+    The two KBs must list the same diseases in the same order. Returns
+    max_abs_diff (percentage points), within_tolerance (every score inside
+    score_tolerance()), order_violations (disease pairs whose reference
+    scores differ by more than their combined tolerance but are ranked the
+    other way round) and top1_agreement (fraction of profiles with the same
+    top disease).
+    """
+    if sparse.diseases != reference.diseases:
+        raise ValueError("Both knowledge bases must list the same diseases in the same order")
+    profiles = list(profiles)
+    expected = reference.percentages(reference.encode_batch(profiles))
+    actual = sparse.percentages(sparse.encode_batch(profiles))
+    tolerance = sparse.score_tolerance()
+    diff = np.abs(actual - expected)
+
+    violations = 0
+    order = np.argsort(-actual, axis=1, kind="stable")
+    for row in range(len(profiles)):
+        ref, tol = expected[row, order[row]], tolerance[order[row]]
+        # A later disease beating an earlier one by more than both tolerances
+        later_best = np.maximum.accumulate((ref - tol)[::-1])[::-1]
+        violations += int(np.count_nonzero(later_best[1:] > ref[:-1] + tol[:-1]))
+    return {
+        "profiles": len(profiles),
+        "max_abs_diff": float(diff.max()) if diff.size else 0.0,
+        "max_tolerance": float(tolerance.max()) if tolerance.size else 0.0,
+        "within_tolerance": bool(np.all(diff <= tolerance + 1e-9)),
+        "order_violations": violations,
+        "top1_agreement": float(np.mean(order[:, 0] == np.argmax(expected, axis=1))) if len(profiles) else 1.0,
+    }
@@ -0,0 +1,25 @@
+import io
+import json
+
+from batch_score import read_profiles, score_stream
+from inference_engine import diagnose
+
+
+def test_score_stream_csv_matches_diagnose():
+    csv_text = (
+        "id,fever,cough,shortness_of_breath,wheezing,chest_pain,fatigue,loss_taste_smell,smoking_history\n"
+        "a,high,dry,true,false,false,true,true,false\n"
+        "b,none,,1,1,0,0,0,1\n"
+        "c,low,blood,no,no,no,yes,no,yes\n"
+    )
+    out = io.StringIO()
+    stats = score_stream(read_profiles(io.StringIO(csv_text), "csv"), out, chunk_size=2, top_k=2)
+
+    assert stats["rows"] == 3
+    assert stats["chunks"] == 2
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["id"] for r in records] == ["a", "b", "c"]
+
+    expected_a = diagnose({"fever": "high", "cough": "dry", "shortness_of_breath": True,
+                           "fatigue": True, "loss_taste_smell": True})
+    assert [tuple(pair) for pair in records[0]["ranking"]] == expected_a[:2]
@@ -0,0 +1,47 @@
+from benchmarks.run_benchmarks import bench_kb_size, find_regressions
+from benchmarks.synthetic import engine_symptom_keys, synthetic_kb, synthetic_profiles
+from inference_engine import compile_knowledge_base, diagnose, get_compiled_kb
+from knowledge_base import KNOWLEDGE_BASE
+
+
+def test_synthetic_generators_are_reproducible_and_hit_rules():
+    kb = synthetic_kb(50, extra_symptoms=5, rules_per_disease=4, seed=3)
+    assert kb == synthetic_kb(50, extra_symptoms=5, rules_per_disease=4, seed=3)
+    assert len(kb) == 50
+    assert all(len(rules) == 4 for rules in kb.values())
+
+    ckb = compile_knowledge_base(kb)
+    assert set(engine_symptom_keys()) <= set(ckb.symptoms)
+    profiles = list(synthetic_profiles(20, seed=1))
+    assert profiles == list(synthetic_profiles(20, seed=1))
+    assert ckb.encode_batch(profiles).any()
+
+    # Profiles drawn from the generated KB's schema also hit the padding symptoms
+    padding = [ckb.symptom_index[f"synthetic{i}"] for i in range(5)]
+    assert set(ckb.schema.boolean) >= {f"synthetic{i}" for i in range(5)}
+    assert not ckb.encode_batch(profiles)[:, padding].any()
+    drawn = list(synthetic_profiles(20, seed=1, schema=ckb.schema))
+    assert ckb.encode_batch(drawn)[:, padding].any(axis=0).all()
+
+
+def test_bench_kb_size_restores_engine_state():
+    metrics = bench_kb_size(5, calls=3, batch_size=4)
+    assert metrics["kb5.diagnose.cold.p50_us"]["better"] == "lower"
+    assert metrics["kb5.diagnose_batch.profiles_per_sec"]["better"] == "higher"
+    assert list(get_compiled_kb().diseases) == list(KNOWLEDGE_BASE)
+    assert diagnose({"fever": "high"})[0][0] in KNOWLEDGE_BASE
+
+
+def test_find_regressions_respects_direction_and_threshold():
+    baseline = {"metrics": {
+        "lat": {"value": 100.0, "unit": "us", "better": "lower"},
+        "tput": {"value": 1000.0, "unit": "profiles/s", "better": "higher"},
+        "gone": {"value": 1.0, "unit": "us", "better": "lower"},
+    }}
+    ok = {"metrics": {"lat": {"value": 120.0}, "tput": {"value": 900.0}}}
+    assert find_regressions(ok, baseline, 0.25) == []
+
+    slow = {"metrics": {"lat": {"value": 130.0}, "tput": {"value": 700.0}}}
+    regressions = find_regressions(slow, baseline, 0.25)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("lat:")
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from diagnosis_service import DiagnosisService
+from inference_engine import diagnose
+
+
+async def _post(port, path, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_concurrent_requests_are_micro_batched():
+    profiles = [
+        {"fever": "high", "cough": "dry", "loss_taste_smell": True},
+        {"fever": "none", "wheezing": True, "shortness_of_breath": True},
+        {"fever": "low", "cough": "blood", "fatigue": True},
+    ] * 5
+
+    async def scenario():
+        service = DiagnosisService(batch_window_ms=50, max_batch=100)
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            singles = await asyncio.gather(*(_post(port, "/diagnose?top_k=2", p) for p in profiles))
+            batch = await _post(port, "/diagnose/batch", profiles[:3])
+            bad = await _post(port, "/diagnose", [1, 2])
+            negative = await _post(port, "/diagnose/batch?top_k=-1", profiles[:3])
+        return service, singles, batch, bad, negative
+
+    service, singles, batch, bad, negative = asyncio.run(scenario())
+    for (status, payload), profile in zip(singles, profiles):
+        assert status == 200
+        assert [tuple(pair) for pair in payload["ranking"]] == diagnose(profile)[:2]
+    assert service.batcher.batches < len(profiles)
+
+    status, payload = batch
+    assert status == 200
+    assert [tuple(pair) for pair in payload["rankings"][1]] == diagnose(profiles[1])
+    assert bad[0] == 400
+    assert negative[0] == 400
+
+
+async def _send(port, raw):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split()[1])
+
+
+def test_bad_content_length_is_rejected_with_400():
+    async def scenario():
+        service = DiagnosisService()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return [
+                await _send(port, f"POST /diagnose HTTP/1.1\r\nContent-Length: {value}\r\n"
+                                  f"Connection: close\r\n\r\n{{}}".encode())
+                for value in ("abc", "-5", "2")
+            ]
+
+    assert asyncio.run(scenario()) == [400, 400, 200]
+
+
+def test_batch_scoring_does_not_block_the_event_loop(monkeypatch):
+    import threading
+
+    import diagnosis_service
+
+    release = threading.Event()
+    real_diagnose_batch = diagnosis_service.diagnose_batch
+
+    def slow_diagnose_batch(profiles, top_k=None):
+        assert release.wait(5), "the event loop was blocked while a batch was scored"
+        return real_diagnose_batch(profiles, top_k=top_k)
+
+    monkeypatch.setattr(diagnosis_service, "diagnose_batch", slow_diagnose_batch)
+
+    async def scenario():
+        service = DiagnosisService()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            batch = asyncio.ensure_future(_post(port, "/diagnose/batch?top_k=1", [{"fever": "high"}]))
+            await asyncio.sleep(0.05)
+            health = await _send(port, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+            release.set()
+            return health, await batch
+
+    health, (status, payload) = asyncio.run(scenario())
+    assert health == 200 and status == 200
+    assert [tuple(pair) for pair in payload["rankings"][0]] == diagnose({"fever": "high"})[:1]
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+from diagnosis_session import DiagnosisSession
+from inference_engine import (
+    compile_knowledge_base, diagnose, diagnose_with_explanation, get_compiled_kb, use_compiled_kb,
+)
+from test_inference import all_profiles
+
+
+def test_session_tracks_diagnose_through_random_edits():
+    profiles = list(all_profiles())
+    rng = random.Random(3)
+    session = DiagnosisSession()
+    for _ in range(400):
+        profile = rng.choice(profiles)
+        session.update(profile)
+        assert session.ranked() == diagnose(profile)
+    expected = diagnose_with_explanation(profile)
+    for (d, p, expl), (d2, p2, expl2) in zip(session.ranked_with_explanation(), expected):
+        assert (d, p) == (d2, p2)
+        assert dict(expl) == dict(expl2)
+
+
+def test_toggle_touches_only_affected_diseases_and_what_if_is_side_effect_free():
+    session = DiagnosisSession({"fever": "high"})
+    ckb = get_compiled_kb()
+    before = session.ranked()
+    rescored = session.diseases_rescored
+
+    hypothetical = session.what_if("loss_taste_smell")
+    assert hypothetical == diagnose({"fever": "high", "loss_taste_smell": True})
+    assert session.ranked() == before
+    assert not session.is_present("loss_taste_smell")
+
+    assert session.toggle("wheezing") is True
+    affected = len(ckb.inverted_index()[ckb.symptom_index["wheezing"]][0])
+    assert session.diseases_rescored == rescored + 2 * len(
+        ckb.inverted_index()[ckb.symptom_index["loss_taste_smell"]][0]) + affected
+    assert session.ranked(2) == diagnose({"fever": "high", "wheezing": True})[:2]
+    with pytest.raises(KeyError):
+        session.set_symptom("sneezing")
+
+
+def test_session_matches_sparse_scoring_on_large_synthetic_kb():
+    ckb = compile_knowledge_base(synthetic_kb(3000, extra_symptoms=4, seed=5))
+    use_compiled_kb(ckb)
+    try:
+        session = DiagnosisSession()
+        for profile in synthetic_profiles(60, seed=9, schema=ckb.schema):
+            session.update(profile)
+            for k in (1, 7, 250):
+                assert session.ranked(k) == diagnose(profile, top_k=k)
+            assert session.ranked() == diagnose(profile)
+        top = [(d, p, dict(e)) for d, p, e in session.ranked_with_explanation(5)]
+        assert top == [(d, p, dict(e)) for d, p, e in diagnose_with_explanation(profile)[:5]]
+        present = session.present
+        session.rebase(compile_knowledge_base(synthetic_kb(3000, extra_symptoms=4, seed=6)))
+        assert session.present == present
+    finally:
+        use_compiled_kb(None)
@@ -0,0 +1,77 @@
+import asyncio
+
+import inference_engine
+from diagnosis_service import DiagnosisService
+from engine_metrics import Histogram
+from inference_engine import diagnose, diagnose_batch, diagnose_with_explanation
+
+
+def test_metrics_record_paths_rules_and_batches():
+    profile = {"fever": "high", "cough": "dry", "fatigue": True}
+    assert inference_engine.get_metrics() is None
+    metrics = inference_engine.enable_metrics()
+    inference_engine.configure_result_cache(0)
+    inference_engine.set_answer_table_enabled(False)
+    try:
+        diagnose(profile)
+        diagnose(profile, top_k=2)
+        diagnose_with_explanation(profile)
+        diagnose_batch([profile, {}, profile])
+        inference_engine.set_answer_table_enabled(True)
+        diagnose(profile)
+        snap = inference_engine.metrics_snapshot()
+        text = inference_engine.metrics_prometheus()
+    finally:
+        inference_engine.disable_metrics()
+        inference_engine.configure_result_cache(4096)
+        inference_engine.set_answer_table_enabled(True)
+
+    assert snap["calls"] == {
+        "diagnose": {"full": 1, "table": 1, "top_k": 1},
+        "diagnose_batch": {"batch": 1},
+        "diagnose_with_explanation": {"full": 1},
+    }
+    ckb = inference_engine.get_compiled_kb()
+    per_profile = int(ckb.symptom_rule_counts()[ckb.encode_indices(profile)].sum())
+    rules = snap["histograms"]["rules_evaluated"]
+    assert rules["diagnose"]["sum"] == 2 * per_profile
+    assert rules["diagnose_batch"]["sum"] == 2 * per_profile
+    assert snap["histograms"]["batch_size"]["diagnose_batch"]["sum"] == 3
+    assert snap["histograms"]["call_seconds"]["diagnose"]["count"] == 3
+    assert snap["cache"]["maxsize"] == 0
+
+    assert 'diagnosis_engine_calls_total{entry="diagnose",source="top_k"} 1' in text
+    assert 'diagnosis_engine_call_seconds_bucket{entry="diagnose",le="+Inf"} 3' in text
+    assert "# TYPE diagnosis_engine_cache_hit_rate gauge" in text
+
+    diagnose(profile)
+    assert metrics.snapshot()["calls"]["diagnose"]["table"] == 1
+
+
+def test_histogram_quantiles_and_cumulative_buckets():
+    hist = Histogram((1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0, 10.0):
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap["buckets"] == [(1.0, 1), (2.0, 3), (4.0, 4)]
+    assert snap["count"] == 5
+    assert 1.0 <= hist.quantile(0.5) <= 2.0
+
+
+def test_service_exposes_prometheus_metrics():
+    async def scenario():
+        service = DiagnosisService()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            raw = await reader.read()
+            writer.close()
+        return raw
+
+    head, _, body = asyncio.run(scenario()).partition(b"\r\n\r\n")
+    assert b" 200 " in head.split(b"\r\n")[0]
+    assert b"text/plain" in head
+    assert b"diagnosis_engine_cache_hits_total" in body
@@ -0,0 +1,65 @@
+import copy
+import io
+import json
+
+from batch_score import read_profiles
+from evaluate import ScoreCache, evaluate_cases
+from inference_engine import compile_knowledge_base, diagnose
+from knowledge_base import KNOWLEDGE_BASE
+from test_inference import all_profiles
+
+
+def _labelled(profiles, ranker):
+    return [dict(p, label=ranker(p)[0][0]) for p in profiles]
+
+
+def test_accuracy_recall_and_confusion_on_streamed_cases():
+    profiles = list(all_profiles())[::5]
+    cases = _labelled(profiles, diagnose)
+    cases.append(dict(profiles[0], label="Common cold"))
+    stream = io.StringIO("\n".join(json.dumps(c) for c in cases))
+
+    report = evaluate_cases(read_profiles(stream, "jsonl"), chunk_size=17)
+    assert report.cases == len(cases)
+    assert report.hits[1] == len(profiles)
+    assert report.accuracy(3) == len(profiles) / len(cases)
+    assert report.recall("Common cold", 3) == 0.0
+    top = cases[0]["label"]
+    assert report.recall(top, 1) == 1.0
+    assert report.confusion["Common cold"][top] == 1
+    assert sum(report.confusion[top].values()) == report.per_disease[top]["cases"]
+
+
+def test_kb_edit_rescores_only_changed_disease():
+    profiles = list(all_profiles())
+    cases = _labelled(profiles, diagnose)
+    cache = ScoreCache(":memory:")
+    first = evaluate_cases(cases, cache=cache, chunk_size=300)
+    n_diseases = len(KNOWLEDGE_BASE)
+    assert first.reused == 0
+    assert first.scored == len(cache)
+
+    again = evaluate_cases(cases, cache=cache, chunk_size=300)
+    assert again.scored == 0
+    assert again.hits == first.hits
+
+    edited = copy.deepcopy(KNOWLEDGE_BASE)
+    disease = next(iter(edited))
+    symptom = next(iter(edited[disease]))
+    edited[disease][symptom]["cf"] = round(edited[disease][symptom]["cf"] / 2, 2)
+    ckb = compile_knowledge_base(edited)
+    after = evaluate_cases(cases, cache=cache, ckb=ckb, chunk_size=300)
+    assert after.scored == first.scored // n_diseases
+
+    fresh = evaluate_cases(cases, ckb=ckb)
+    assert after.hits == fresh.hits
+    assert after.confusion == fresh.confusion
+
+
+def test_default_cache_spills_to_a_temporary_file():
+    # An in-memory SQLite database journals in memory; the default cache is on disk
+    cache = ScoreCache()
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] != "memory"
+    cache.store([("fp", "case", 12.5)])
+    assert cache.lookup(["case"], ["fp"]).tolist() == [[12.5]]
+    cache.close()
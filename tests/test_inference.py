@@ -19,3 +19,308 @@ def test_verification_case():
     top_disease, top_score = results[0]
     assert top_disease == "COVID-19"
     assert top_score >= 70
+
+
+BOOL_SYMPTOMS = ("shortness_of_breath", "wheezing", "chest_pain", "fatigue", "loss_taste_smell", "smoking_history")
+
+
+def all_profiles():
+    import itertools
+
+    for fever in ("high", "low", "none", None):
+        for cough in ("dry", "wet", "blood", None):
+            for bits in itertools.product((False, True), repeat=len(BOOL_SYMPTOMS)):
+                profile = {"fever": fever, "cough": cough}
+                profile.update(zip(BOOL_SYMPTOMS, bits))
+                yield profile
+
+
+def reference_diagnose_with_explanation(patient):
+    """The original rule-by-rule walk over KNOWLEDGE_BASE, kept as an oracle."""
+    from knowledge_base import KNOWLEDGE_BASE
+
+    present = set()
+    if patient.get("fever") in ("high", "low", "none"):
+        present.add(f"fever_{patient['fever']}")
+    if patient.get("cough") in ("dry", "wet", "blood"):
+        present.add(f"cough_{patient['cough']}")
+    for sym in BOOL_SYMPTOMS:
+        if patient.get(sym):
+            present.add(sym)
+
+    results = []
+    for disease, rules in KNOWLEDGE_BASE.items():
+        raw_score = 0.0
+        max_score = sum(max(0.0, r["cf"]) for r in rules.values())
+        matched, penalties = [], []
+        for symptom_key, rule in rules.items():
+            if symptom_key in present:
+                raw_score += rule["cf"]
+                matched.append({"symptom": symptom_key, "cf": rule["cf"], "explain": rule["explain"]})
+            else:
+                pen = rule["cf"] * 0.5
+                raw_score -= pen
+                penalties.append({"symptom": symptom_key, "penalty": pen, "cf": rule["cf"], "explain": rule["explain"]})
+        percent = round(max(0.0, min(1.0, raw_score / max_score)) * 100.0, 1)
+        expl = {"raw_score": round(raw_score, 3), "max_score": round(max_score, 3), "percent": percent,
+                "matched": matched, "penalties": penalties}
+        results.append((disease, percent, expl))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results
+
+
+def test_compiled_diagnose_matches_rule_walk():
+    from inference_engine import diagnose_with_explanation
+
+    for patient in all_profiles():
+        expected = reference_diagnose_with_explanation(patient)
+        assert diagnose(patient) == [(d, p) for (d, p, _) in expected]
+
+        actual = diagnose_with_explanation(patient)
+        assert [(d, p) for (d, p, _) in actual] == [(d, p) for (d, p, _) in expected]
+        for (_, _, expl), (_, _, ref) in zip(actual, expected):
+            assert {k: expl[k] for k in ("raw_score", "max_score", "percent")} == \
+                {k: ref[k] for k in ("raw_score", "max_score", "percent")}
+            assert [dict(m) for m in expl["matched"]] == ref["matched"]
+            assert [dict(p) for p in expl["penalties"]] == ref["penalties"]
+
+
+def test_compiled_kb_rebuilds_after_kb_change():
+    import knowledge_base
+    from inference_engine import get_compiled_kb
+
+    before = get_compiled_kb()
+    assert get_compiled_kb() is before
+    knowledge_base.mark_kb_changed()
+    after = get_compiled_kb()
+    assert after is not before
+    assert after.version == knowledge_base.get_kb_version()
+
+
+def test_in_place_kb_edits_are_picked_up_without_notification():
+    import copy
+    import json
+    import pickle
+
+    from inference_engine import diagnose_batch
+    from knowledge_base import KNOWLEDGE_BASE
+
+    patient = {"fever": "high", "cough": "dry", "loss_taste_smell": True}
+    before = diagnose(patient)
+    try:
+        KNOWLEDGE_BASE["Anosmia Syndrome"] = {"loss_taste_smell": {"cf": 1.0, "explain": ""}}
+        assert diagnose(patient)[0] == ("Anosmia Syndrome", 100.0)
+        KNOWLEDGE_BASE["Anosmia Syndrome"]["loss_taste_smell"]["cf"] = 0.5
+        KNOWLEDGE_BASE["Anosmia Syndrome"]["fever_none"] = {"cf": 0.5, "explain": ""}
+        assert dict(diagnose(patient))["Anosmia Syndrome"] == 25.0
+        assert diagnose_batch([patient]).ranked(0) == diagnose(patient)
+    finally:
+        del KNOWLEDGE_BASE["Anosmia Syndrome"]
+    assert diagnose(patient) == before
+
+    for clone in (copy.deepcopy(KNOWLEDGE_BASE), pickle.loads(pickle.dumps(KNOWLEDGE_BASE))):
+        assert type(clone) is dict and type(clone["Asthma"]["wheezing"]) is dict
+        assert clone == KNOWLEDGE_BASE
+    assert json.loads(json.dumps(KNOWLEDGE_BASE)) == KNOWLEDGE_BASE
+
+
+def test_diagnose_batch_matches_diagnose():
+    from inference_engine import diagnose_batch
+
+    profiles = list(all_profiles())
+    batch = diagnose_batch(profiles)
+    assert len(batch) == len(profiles)
+    for row, patient in enumerate(profiles):
+        assert batch.ranked(row) == diagnose(patient)
+
+    columns = {field: [p[field] for p in profiles] for field in profiles[0]}
+    columnar = diagnose_batch(columns, top_k=3)
+    assert columnar.top_indices.shape == (len(profiles), 3)
+    for row, patient in enumerate(profiles):
+        assert columnar.ranked(row) == diagnose(patient)[:3]
+
+
+def test_answer_table_matches_direct_scoring_and_tracks_kb_changes():
+    import knowledge_base
+    import inference_engine
+
+    patient = {"fever": "none", "cough": "dry", "wheezing": True, "shortness_of_breath": True}
+    try:
+        inference_engine.set_answer_table_enabled(False)
+        direct = [diagnose(p) for p in all_profiles()]
+        inference_engine.set_answer_table_enabled(True)
+        assert [diagnose(p) for p in all_profiles()] == direct
+
+        rule = knowledge_base.KNOWLEDGE_BASE["Asthma"]["wheezing"]
+        original_cf = rule["cf"]
+        before = dict(diagnose(patient))["Asthma"]
+        rule["cf"] = 0.1
+        knowledge_base.mark_kb_changed()
+        try:
+            assert dict(diagnose(patient))["Asthma"] < before
+        finally:
+            rule["cf"] = original_cf
+            knowledge_base.mark_kb_changed()
+        assert dict(diagnose(patient))["Asthma"] == before
+    finally:
+        inference_engine.set_answer_table_enabled(True)
+
+
+def test_result_cache_ignores_demographics_and_returns_immutable_results():
+    import pytest
+    import knowledge_base
+    from inference_engine import clear_result_cache, diagnose_with_explanation, get_cache_stats
+
+    clear_result_cache()
+    patient = {"fever": "high", "cough": "wet", "chest_pain": True}
+    first = diagnose_with_explanation(dict(patient, age=30, gender="Female"))
+    second = diagnose_with_explanation(dict(patient, age=70, gender="Male"))
+    assert first == second
+    assert first[0][2]._evidence is None, "explanations should be built lazily"
+    stats = get_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    expl = second[0][2]
+    with pytest.raises(TypeError):
+        expl["percent"] = 0.0
+    with pytest.raises(TypeError):
+        expl["matched"][0]["cf"] = 0.0
+    second.clear()
+    assert diagnose_with_explanation(patient) == first
+
+    knowledge_base.mark_kb_changed()
+    diagnose_with_explanation(patient)
+    assert get_cache_stats()["size"] == 1
+
+
+def test_explanations_serialise_without_the_compiled_kb():
+    import json
+    import pickle
+    from inference_engine import diagnose_with_explanation
+
+    patient = {"fever": "high", "cough": "dry", "loss_taste_smell": True}
+    results = diagnose_with_explanation(patient)
+    expected = reference_diagnose_with_explanation(patient)
+    restored = pickle.loads(pickle.dumps(results[:3]))
+    assert restored[0][2]._ckb is None and results[0][2]._ckb is not None
+    assert [(d, p, dict(e)) for d, p, e in restored] == [(d, p, dict(e)) for d, p, e in results[:3]]
+    assert pickle.loads(pickle.dumps(results[0])) == restored[0]
+
+    for (d, p, expl), (d2, p2, expl2) in zip(results, expected):
+        assert json.loads(json.dumps([d, p, dict(expl)])) == json.loads(json.dumps([d2, p2, expl2]))
+        assert expl.as_dict() == json.loads(json.dumps(expl2))
+    assert repr(restored[0][2]) == repr(results[0][2])
+
+
+def test_result_cache_never_serves_another_kb_with_the_same_version():
+    import knowledge_base
+    from inference_engine import CompiledKB, diagnose_with_explanation, get_compiled_kb, use_compiled_kb
+
+    patient = {"fever": "high", "wheezing": True}
+    bundled = diagnose(patient)
+    diagnose_with_explanation(patient)
+    # Same symptoms (so the same profile bitmask) and the same version, but
+    # different diseases: only the instance tells the two KBs apart.
+    renamed = {f"Other {d}": rules for d, rules in knowledge_base.KNOWLEDGE_BASE.items()}
+    other = CompiledKB(renamed, version=get_compiled_kb().version, derived=get_compiled_kb().derived)
+    use_compiled_kb(other)
+    try:
+        assert {d for d, _ in diagnose(patient)} == set(other.diseases)
+        assert {d for d, _, _ in diagnose_with_explanation(patient)} == set(other.diseases)
+    finally:
+        use_compiled_kb(None)
+    assert diagnose(patient) == bundled
+
+
+def test_inverted_index_scoring_matches_dense_scoring():
+    from inference_engine import compile_knowledge_base
+
+    ckb = compile_knowledge_base()
+    for patient in all_profiles():
+        dense = ckb.percentages(ckb.encode(patient))
+        sparse = ckb.percentages_sparse(ckb.encode_indices(patient))
+        assert dense.tolist() == sparse.tolist()
+
+    touched, _ = ckb.score_present([ckb.symptom_index["loss_taste_smell"]])
+    assert [ckb.diseases[i] for i in touched] == ["COVID-19"]
+
+
+def test_top_k_matches_prefix_of_full_ranking():
+    import random
+    import numpy as np
+    from inference_engine import compile_knowledge_base, diagnose
+
+    for patient in list(all_profiles())[::7]:
+        assert diagnose(patient, top_k=2) == diagnose(patient)[:2]
+
+    rng = random.Random(7)
+    symptoms = [f"s{i}" for i in range(40)]
+    kb = {
+        f"D{i}": {s: {"cf": round(rng.random(), 1), "explain": ""} for s in rng.sample(symptoms, rng.randint(1, 6))}
+        for i in range(2000)
+    }
+    ckb = compile_knowledge_base(kb)
+    for _ in range(100):
+        present = sorted(rng.sample(range(40), rng.randint(0, 5)))
+        k = rng.choice([1, 3, 10])
+        full = ckb.percentages_sparse(present)
+        expected = np.argsort(-full, kind="stable")[:k]
+        d_idx, scores = ckb.top_k(present, k)
+        assert d_idx.tolist() == expected.tolist()
+        assert scores.tolist() == full[expected].tolist()
+
+
+def test_top_k_must_be_a_non_negative_integer():
+    import numpy as np
+    import pytest
+    from diagnosis_session import DiagnosisSession
+    from inference_engine import diagnose_batch, diagnose_records
+
+    patient = {"fever": "high", "cough": "dry"}
+    for bad in (-1, 2.5, "3", True):
+        with pytest.raises(ValueError):
+            diagnose(patient, top_k=bad)
+        with pytest.raises(ValueError):
+            diagnose_batch([patient], top_k=bad)
+        with pytest.raises(ValueError):
+            diagnose_records(patient, top_k=bad)
+        with pytest.raises(ValueError):
+            DiagnosisSession(patient).ranked(bad)
+    assert diagnose(patient, top_k=0) == [] == DiagnosisSession(patient).ranked(0)
+    assert diagnose(patient, top_k=np.int64(2)) == diagnose(patient)[:2]
+    assert diagnose_batch([patient], top_k=0).ranked(0) == []
+
+
+def test_every_scoring_path_agrees_on_synthetic_kbs():
+    import inference_engine
+    from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+    from diagnosis_session import DiagnosisSession
+    from inference_engine import compile_knowledge_base, diagnose_batch, use_compiled_kb
+
+    # 600 diseases fit the answer table; 3000 do not, so diagnose() ranks
+    # through the inverted index there.
+    for n_diseases in (600, 3000):
+        ckb = compile_knowledge_base(synthetic_kb(n_diseases, seed=1))
+        profiles = list(synthetic_profiles(150, seed=2))
+        use_compiled_kb(ckb)
+        try:
+            inference_engine.set_answer_table_enabled(False)
+            inference_engine.clear_result_cache()
+            sparse = [diagnose(p) for p in profiles]
+            inference_engine.set_answer_table_enabled(True)
+            inference_engine.clear_result_cache()
+            assert [diagnose(p) for p in profiles] == sparse
+            inference_engine.clear_result_cache()
+            assert [diagnose(p, top_k=5) for p in profiles] == [r[:5] for r in sparse]
+
+            batch = diagnose_batch(profiles)
+            assert [batch.ranked(row) for row in range(len(profiles))] == sparse
+
+            session = DiagnosisSession(ckb=ckb)
+            for patient, expected in zip(profiles, sparse):
+                session.update(patient)
+                assert session.ranked() == expected
+        finally:
+            use_compiled_kb(None)
+            inference_engine.set_answer_table_enabled(True)
+            inference_engine.clear_result_cache()
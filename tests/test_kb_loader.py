@@ -0,0 +1,131 @@
+import csv
+import json
+import mmap
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import kb_loader
+from inference_engine import diagnose, use_compiled_kb
+from knowledge_base import KNOWLEDGE_BASE
+from test_inference import all_profiles
+
+
+def _rule_rows():
+    return [
+        {"disease": d, "symptom": s, "cf": r["cf"], "explain": r["explain"]}
+        for d, rules in KNOWLEDGE_BASE.items()
+        for s, r in rules.items()
+    ]
+
+
+def test_json_csv_and_sqlite_sources_load_the_same_kb(tmp_path):
+    json_path = tmp_path / "kb.json"
+    json_path.write_text(json.dumps(KNOWLEDGE_BASE))
+
+    csv_path = tmp_path / "kb.csv"
+    with open(csv_path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=["disease", "symptom", "cf", "explain"])
+        writer.writeheader()
+        writer.writerows(_rule_rows())
+
+    db_path = tmp_path / "kb.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE rules (disease TEXT, symptom TEXT, cf REAL, explain TEXT)")
+    conn.executemany("INSERT INTO rules VALUES (:disease, :symptom, :cf, :explain)", _rule_rows())
+    conn.commit()
+    conn.close()
+
+    for path in (json_path, csv_path, db_path):
+        assert kb_loader.load_kb(str(path)) == KNOWLEDGE_BASE
+
+
+def test_compiled_cache_is_reused_and_scores_match(tmp_path):
+    source = tmp_path / "kb.json"
+    source.write_text(json.dumps(_rule_rows()))
+
+    ckb = kb_loader.load_compiled_kb(str(source))
+    cache = str(source) + ".kbc"
+    first_mtime = os.stat(cache).st_mtime_ns
+    again = kb_loader.load_compiled_kb(str(source))
+    assert os.stat(cache).st_mtime_ns == first_mtime
+    assert again.version == ckb.version
+    assert not again.cf.flags.writeable
+
+    expected = [diagnose(p) for p in all_profiles()]
+    use_compiled_kb(again)
+    try:
+        assert [diagnose(p) for p in all_profiles()] == expected
+        d_idx = again.diseases.index("COVID-19")
+        s_idx = again.symptom_index["loss_taste_smell"]
+        assert again.explains[(d_idx, s_idx)] == KNOWLEDGE_BASE["COVID-19"]["loss_taste_smell"]["explain"]
+    finally:
+        use_compiled_kb(None)
+
+
+def test_invalid_cf_is_rejected(tmp_path):
+    source = tmp_path / "bad.json"
+    source.write_text(json.dumps({"Flu": {"fever_high": {"cf": 1.5, "explain": ""}}}))
+    with pytest.raises(ValueError, match="outside"):
+        kb_loader.load_compiled_kb(str(source))
+
+
+def test_cache_stores_rules_and_densifies_only_on_demand(tmp_path):
+    from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+    from diagnosis_session import DiagnosisSession
+    from inference_engine import compile_knowledge_base, diagnose_batch, diagnose_with_explanation
+
+    kb = synthetic_kb(3000, extra_symptoms=4, seed=2)
+    source = tmp_path / "kb.json"
+    source.write_text(json.dumps(kb))
+    loaded = kb_loader.load_compiled_kb(str(source))
+    reference = compile_knowledge_base(kb_loader.load_kb(str(source)))
+    with open(str(source) + ".kbc", "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        arrays = kb_loader._read_header(mm)[0]["arrays"]
+    assert "cf" not in arrays
+    assert arrays["rule_cf"]["shape"] == [sum(len(rules) for rules in kb.values())]
+
+    profiles = list(synthetic_profiles(40, seed=4, schema=reference.schema))
+    try:
+        use_compiled_kb(reference)
+        expected = [diagnose(p) for p in profiles]
+        use_compiled_kb(loaded)
+        assert [diagnose(p) for p in profiles] == expected
+        assert [diagnose(p, top_k=5) for p in profiles] == [ranking[:5] for ranking in expected]
+        for (d_idx, cfs), (ref_idx, ref_cfs) in zip(loaded.inverted_index(), reference.inverted_index()):
+            assert d_idx.tolist() == ref_idx.tolist() and cfs.tolist() == ref_cfs.tolist()
+        assert loaded.symptom_rule_counts().tolist() == reference.symptom_rule_counts().tolist()
+        batch = diagnose_batch(profiles)
+        assert [batch.ranked(i) for i in range(len(profiles))] == expected
+        session = DiagnosisSession(profiles[0])
+        session.update(profiles[1])
+        assert session.ranked() == expected[1]
+        top = [(d, p, dict(e)) for d, p, e in diagnose_with_explanation(profiles[1])[:3]]
+        use_compiled_kb(reference)
+        assert top == [(d, p, dict(e)) for d, p, e in diagnose_with_explanation(profiles[1])[:3]]
+        assert loaded._cf is None
+    finally:
+        use_compiled_kb(None)
+    assert np.array_equal(loaded.cf, reference.cf) and not loaded.cf.flags.writeable
+
+
+def test_rule_triplets_give_the_dense_top_k_bounds():
+    from inference_engine import CompiledKB
+
+    rng = np.random.default_rng(3)
+    cf = np.round(rng.uniform(-0.5, 1.0, (300, 40)), 2) * (rng.random((300, 40)) < 0.3)
+    cf[:5] = 0.0
+    rule_disease, rule_symptom = np.nonzero(cf)
+    order = rng.permutation(len(rule_disease))
+    sparse = CompiledKB.from_rules([f"D{i}" for i in range(300)], [f"s{i}" for i in range(40)],
+                                   rule_disease[order], rule_symptom[order], cf[rule_disease, rule_symptom][order])
+    dense = CompiledKB.from_arrays(sparse.diseases, sparse.symptoms, cf)
+    assert np.array_equal(sparse.max_scores, dense.max_scores)
+    assert np.array_equal(sparse.penalty_base, dense.penalty_base)
+    every = np.arange(300)
+    for n_present in (1, 3, 16, 30):
+        assert np.array_equal(sparse._upper_bounds(every, n_present), dense._upper_bounds(every, n_present))
+    assert np.array_equal(sparse.cf_rows(every[::7]), cf[::7])
+    assert sparse._cf is None
@@ -0,0 +1,71 @@
+import json
+import os
+
+import inference_engine
+import knowledge_base
+from inference_engine import diagnose
+from kb_registry import KBRegistry
+
+
+def test_registry_swaps_snapshot_when_source_changes(tmp_path):
+    source = tmp_path / "kb.json"
+    kb = json.loads(json.dumps(knowledge_base.KNOWLEDGE_BASE))
+    source.write_text(json.dumps(kb))
+    patient = {"fever": "none", "wheezing": True, "shortness_of_breath": True}
+
+    registry = KBRegistry(str(source)).install()
+    try:
+        before = diagnose(patient)
+        old_snapshot = registry.snapshot
+        assert before.kb_version == old_snapshot.version
+        assert registry.check() is False
+
+        kb["Asthma"]["wheezing"]["cf"] = 0.1
+        source.write_text(json.dumps(kb))
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert registry.check() is True
+
+        after = diagnose(patient)
+        assert after.kb_version == registry.version != old_snapshot.version
+        assert dict(after)["Asthma"] < dict(before)["Asthma"]
+        # The old snapshot is untouched, so in-flight work on it stays consistent
+        assert old_snapshot.cf[old_snapshot.diseases.index("Asthma"), old_snapshot.symptom_index["wheezing"]] == 0.9
+
+        source.write_text("{not json")
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000))
+        assert registry.check() is False
+        assert registry.last_error is not None
+        assert diagnose(patient) == after
+    finally:
+        inference_engine.set_kb_provider(None)
+
+
+def test_registry_compiles_python_kb_module():
+    registry = KBRegistry(knowledge_base.__file__)
+    assert registry.snapshot.diseases == tuple(knowledge_base.KNOWLEDGE_BASE)
+    assert registry.snapshot.cf.tolist() == inference_engine.compile_knowledge_base().cf.tolist()
+
+
+def test_reloaded_snapshot_with_repeated_version_is_not_served_from_cache(tmp_path):
+    source = tmp_path / "kb_module.py"
+    kb = json.loads(json.dumps(knowledge_base.KNOWLEDGE_BASE))
+    source.write_text(f"KNOWLEDGE_BASE = {kb!r}\n")
+    stat = os.stat(source)
+    patient = {"fever": "none", "wheezing": True, "shortness_of_breath": True}
+
+    registry = KBRegistry(str(source)).install()
+    try:
+        before = diagnose(patient)
+        # Same size and mtime: the new snapshot gets the same version number
+        kb["Asthma"]["wheezing"]["cf"] = 0.1
+        source.write_text(f"KNOWLEDGE_BASE = {kb!r}\n")
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        old_version = registry.version
+        assert registry.reload() is True
+        assert registry.version == old_version
+
+        after = diagnose(patient)
+        assert dict(after)["Asthma"] < dict(before)["Asthma"]
+    finally:
+        inference_engine.set_kb_provider(None)
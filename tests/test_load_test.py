@@ -0,0 +1,43 @@
+import pytest
+
+from benchmarks.load_test import AppUser, ProfileMix, Recorder, parse_mix, run_load
+from inference_engine import get_profile_schema
+
+
+def test_profile_mix_is_reproducible_and_parses_weights():
+    assert parse_mix("clinical=3,triage") == {"clinical": 3.0, "triage": 1.0}
+    for bad in ("sick=1", "clinical=x", "clinical=0", "triage=-1"):
+        with pytest.raises(ValueError):
+            parse_mix(bad)
+
+    draws = [ProfileMix("clinical=0.5,triage=0.3,random=0.2", seed=4).draw() for _ in range(2)]
+    assert draws[0] == draws[1]
+    mix = ProfileMix("clinical", seed=1)
+    profiles = [mix.draw() for _ in range(50)]
+    assert get_profile_schema().encode(profiles).any(axis=1).mean() > 0.8
+
+    triage = ProfileMix("triage", seed=2)
+    assert all(1 <= get_profile_schema().encode([triage.draw()]).sum() <= 2 for _ in range(20))
+
+
+def test_engine_load_run_reports_latency_and_process_stats():
+    report = run_load("engine", users=2, processes=1, duration=0.6, entry="diagnose", interval=0.2)
+    stats = report["ops"]["diagnose"]
+    assert stats["count"] > 0 and stats["errors"] == 0
+    assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+    assert report["throughput"]["sessions"] == stats["count"]
+    assert len(report["timeline"]) == 3
+    assert report["timeline"][-1]["t"] == pytest.approx(0.6)
+    assert "worker-0" in report["processes"]
+    assert report["processes"]["worker-0"]["rss_mb_max"] > 0
+
+
+def test_app_user_runs_a_full_assessment():
+    recorder = Recorder()
+    user = AppUser({}, ProfileMix("clinical", seed=0))
+    user.session(recorder)
+    payload = recorder.payload()
+    assert payload["errors"] == {}
+    assert payload["sessions"] == 1
+    assert len(payload["ops"]["app.load"][1]) == 1
+    assert len(payload["ops"]["app.analyze"][1]) == 1
@@ -0,0 +1,23 @@
+import pytest
+
+from inference_engine import diagnose
+from parallel import diagnose_parallel, iter_diagnose_parallel
+from test_inference import all_profiles
+
+
+def test_diagnose_parallel_preserves_order_and_scores():
+    profiles = list(all_profiles())
+    result = diagnose_parallel(profiles, workers=2, chunk_size=100, top_k=2)
+    assert len(result) == len(profiles)
+    for row in (0, 1, 99, 100, 513, len(profiles) - 1):
+        assert result.ranked(row) == diagnose(profiles[row])[:2]
+
+    full = diagnose_parallel(profiles[:50], workers=2, chunk_size=7)
+    for row, patient in enumerate(profiles[:50]):
+        assert full.ranked(row) == diagnose(patient)
+
+    for bad in (-1, 1.5):
+        with pytest.raises(ValueError):
+            diagnose_parallel(profiles[:5], workers=2, top_k=bad)
+        with pytest.raises(ValueError):
+            iter_diagnose_parallel(profiles[:5], workers=2, top_k=bad)
@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+
+from inference_engine import compile_knowledge_base, diagnose_batch, get_compiled_kb
+from knowledge_base import DERIVED_FACTS, KNOWLEDGE_BASE, MULTI_VALUED_FIELDS
+from profile_schema import ProfileSchema, read_csv_columns
+from test_inference import BOOL_SYMPTOMS, all_profiles
+
+
+def test_schema_is_derived_from_symptom_keys(monkeypatch):
+    schema = get_compiled_kb().schema
+    assert schema.multi_valued == {"cough": ("blood", "dry", "wet"), "fever": ("high", "low", "none")}
+    assert set(schema.boolean) == set(BOOL_SYMPTOMS)
+    assert schema.n_profiles == len(list(schema.profiles())) == 1024
+
+    # A new flag needs no code changes; a new valued field is declared
+    monkeypatch.setitem(MULTI_VALUED_FIELDS, "sputum", ("green", "clear"))
+    kb = dict(KNOWLEDGE_BASE)
+    kb["Bronchitis"] = {"sputum_green": 0.6, "sputum_clear": 0.2, "night_sweats": 0.3, "cough_wet": 0.7}
+    ckb = compile_knowledge_base(kb)
+    assert ckb.schema.multi_valued["sputum"] == ("clear", "green")
+    assert "night_sweats" in ckb.schema.boolean
+    assert ckb.schema.present({"sputum": "green", "night_sweats": True, "cough": "wet"}) == {
+        "sputum_green", "night_sweats", "cough_wet",
+    }
+
+
+def test_undeclared_keys_sharing_a_prefix_stay_booleans():
+    kb = dict(KNOWLEDGE_BASE)
+    kb["Angina"] = {"pain_chest": 0.8, "pain_abdomen": -0.3, "synthetic_0": 0.1, "synthetic_1": 0.1}
+    schema = compile_knowledge_base(kb).schema
+    assert set(schema.multi_valued) == {"cough", "fever"}
+    assert {"pain_chest", "pain_abdomen", "synthetic_0", "synthetic_1"} <= set(schema.boolean)
+    assert schema.present({"pain_chest": True, "pain_abdomen": True, "synthetic_1": 1}) == {
+        "pain_chest", "pain_abdomen", "synthetic_1",
+    }
+    assert ProfileSchema(["fever_high", "fever_low"]).multi_valued == {}
+
+
+def test_columnar_inputs_match_dict_encoding():
+    profiles = list(all_profiles())
+    ckb = get_compiled_kb()
+    expected = np.array([ckb.encode(p) for p in profiles])
+    assert np.array_equal(ckb.encode_batch(profiles), expected)
+
+    columns = {field: [p[field] for p in profiles] for field in profiles[0]}
+    assert np.array_equal(ckb.encode_batch(columns), expected)
+
+    dtype = [("fever", "U4"), ("cough", "U5")] + [(b, "?") for b in BOOL_SYMPTOMS]
+    records = np.array([tuple(p[f] or "" for f in ("fever", "cough")) + tuple(p[b] for b in BOOL_SYMPTOMS)
+                        for p in profiles], dtype=dtype)
+    assert np.array_equal(ckb.encode_batch(records), expected)
+
+    # CSV text: case and whitespace are normalised, flags parsed as yes/no
+    lines = [",".join(dtype_name for dtype_name, _ in dtype)]
+    for p in profiles:
+        cells = [(p["fever"] or "").upper(), f" {p['cough'] or ''} "] + ["Yes" if p[b] else "no" for b in BOOL_SYMPTOMS]
+        lines.append(",".join(cells))
+    text_columns = read_csv_columns(io.StringIO("\n".join(lines) + "\n"))
+    assert np.array_equal(ckb.encode_batch(text_columns, text=True), expected)
+    batch = diagnose_batch(text_columns, top_k=2, text=True)
+    assert batch.ranked(5) == diagnose_batch(profiles[5:6], top_k=2).ranked(0)
+
+
+def test_derived_facts_are_encoded_from_columns():
+    kb = dict(KNOWLEDGE_BASE)
+    kb["Smoker COPD"] = {"chronic_airway_risk": 0.9, "fatigue": 0.2}
+    ckb = compile_knowledge_base(kb, derived=DERIVED_FACTS)
+    schema = ckb.schema
+    assert "chronic_airway_risk" not in schema.key_index
+    assert "airway_obstruction" not in schema.key_index
+
+    profiles = list(all_profiles())
+    expected = np.array([ckb.encode(p) for p in profiles])
+    columns = {field: np.array([p[field] for p in profiles], dtype=object) for field in profiles[0]}
+    assert np.array_equal(ckb.encode_batch(profiles), expected)
+    assert np.array_equal(ckb.encode_batch(columns), expected)
+    assert expected[:, ckb.symptom_index["chronic_airway_risk"]].any()
+    assert ProfileSchema(schema.keys).keys == schema.keys
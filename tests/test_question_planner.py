@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from inference_engine import diagnose, get_compiled_kb
+from question_planner import build_question_tree, next_question, rank_questions
+
+
+def test_rank_questions_covers_unasked_fields():
+    schema = get_compiled_kb().schema
+    ranked = rank_questions({})
+    assert {q.field for q in ranked} == set(schema.multi_valued) | set(schema.boolean)
+    gains = [q.gain for q in ranked]
+    assert gains == sorted(gains, reverse=True) and gains[0] > 0.0
+    for question in ranked:
+        assert sum(p for _, p in question.answers) == pytest.approx(1.0)
+
+    partial = {"fever": "high", "cough": "dry", "wheezing": False}
+    fields = [q.field for q in rank_questions(partial)]
+    assert not set(partial) & set(fields)
+    assert next_question(partial) == fields[0]
+    # Once COVID-19 stands out, anosmia is what separates it from the rest
+    assert fields[0] == "loss_taste_smell"
+
+
+def test_question_tree_matches_live_planning():
+    tree = build_question_tree(top_k=3)
+    assert tree.kb_version == get_compiled_kb().version
+    assert tree.next_question({}) == next_question({})
+    json.dumps(tree.as_dict())
+
+    # Follow every branch: each node asks what live planning would ask there,
+    # and its ranking is diagnose()'s top-k for the answers so far.
+    stack = [({}, tree.root)]
+    while stack:
+        profile, node = stack.pop()
+        assert node.ranking == tuple(diagnose(profile, top_k=3))
+        assert node.field == next_question(profile, top_k=3)
+        for answer, child in node.children.items():
+            stack.append(({**profile, node.field: answer}, child))
+
+    shallow = build_question_tree(max_depth=2)
+    assert shallow.depth == 2 and len(shallow) < len(tree)
+    assert shallow.next_question({"cough": "wet", shallow.root.children["wet"].field: True}) is None
@@ -0,0 +1,30 @@
+from inference_engine import diagnose, diagnose_batch, diagnose_records
+from parallel import diagnose_parallel
+from results import DiagnosisRecord
+from test_inference import all_profiles
+
+
+def test_compact_batch_results_round_trip_to_tuples():
+    profiles = list(all_profiles())
+    compact = diagnose_batch(profiles, top_k=3).compact()
+
+    assert compact.scores.dtype.itemsize == 4
+    assert compact.disease_indices.dtype.itemsize == 1
+    assert compact.nbytes == len(profiles) * 3 * 5
+    tuples = compact.to_tuples()
+    for row, patient in enumerate(profiles):
+        expected = diagnose(patient)[:3]
+        assert compact.ranked(row) == expected
+        assert tuples[row] == expected
+
+    parallel = diagnose_parallel(profiles[:40], workers=2, chunk_size=16, top_k=3).compact()
+    assert parallel.to_tuples() == tuples[:40]
+
+
+def test_diagnosis_records_are_slotted():
+    patient = {"fever": "high", "cough": "dry", "loss_taste_smell": True}
+    records = diagnose_records(patient, top_k=2)
+    assert [r.as_tuple() for r in records] == diagnose(patient)[:2]
+    assert not hasattr(records[0], "__dict__")
+    assert records[0].explanation["percent"] == records[0].percent
+    assert records[0] == DiagnosisRecord(*records[0].as_tuple())
@@ -0,0 +1,86 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from diagnosis_session import DiagnosisSession
+from inference_engine import compile_knowledge_base, diagnose, diagnose_batch, use_compiled_kb
+from knowledge_base import DERIVED_FACTS, KNOWLEDGE_BASE
+from rule_network import RuleNetwork
+from test_inference import all_profiles
+
+BASE_FACTS = sorted({c for rule in DERIVED_FACTS.values() for alt in rule["when"] for c in alt} - set(DERIVED_FACTS))
+
+
+def test_working_memory_matches_closure_under_random_edits():
+    network = RuleNetwork(DERIVED_FACTS)
+    assert network.derived_facts.index("airway_obstruction") < network.derived_facts.index("chronic_airway_risk")
+    assert network.closure({"wheezing", "shortness_of_breath", "smoking_history"}) >= {
+        "airway_obstruction", "chronic_airway_risk"}
+
+    wm = network.working_memory()
+    rng = random.Random(0)
+    for _ in range(500):
+        fact = rng.choice(BASE_FACTS)
+        changed = wm.retract_fact(fact) if fact in wm.asserted else wm.assert_fact(fact)
+        assert fact in changed
+        assert wm.facts == network.closure(wm.asserted)
+
+
+def test_shared_prefixes_and_cycle_detection():
+    rules = {
+        "a": {"when": [["x", "y", "z"]]},
+        "b": {"when": [["x", "y", "w"]]},
+        "c": {"when": [["a", "b"]]},
+    }
+    network = RuleNetwork(rules)
+    # x and y are joined once for both a and b: x, x&y, x&y&z, x&y&w, a, a&b
+    assert network.n_nodes == 6
+    assert RuleNetwork(rules, needed=["a"]).rules.keys() == {"a"}
+    with pytest.raises(ValueError):
+        RuleNetwork({"a": {"when": [["b"]]}, "b": {"when": [["a", "x"]]}})
+    with pytest.raises(ValueError):
+        RuleNetwork({"a": {"when": []}})
+
+
+def _chained_kb():
+    kb = copy.deepcopy(KNOWLEDGE_BASE)
+    kb["Pneumonia"]["lower_respiratory_infection"] = {"cf": 0.8, "explain": "Infection below the larynx."}
+    kb["COPD"]["chronic_airway_risk"] = {"cf": 0.9, "explain": "Obstruction in a smoker."}
+    return kb
+
+
+def test_engine_scores_derived_facts_like_symptoms():
+    assert compile_knowledge_base().network is None
+    kb = _chained_kb()
+    ckb = compile_knowledge_base(kb, derived=DERIVED_FACTS)
+    assert set(ckb.network.rules) == {"lower_respiratory_infection", "chronic_airway_risk", "airway_obstruction"}
+
+    profiles = list(all_profiles())
+    use_compiled_kb(ckb)
+    try:
+        batch = diagnose_batch(profiles)
+        columns = {key: [p.get(key) for p in profiles] for key in profiles[-1]}
+        assert np.array_equal(ckb.encode_batch(columns), ckb.encode_batch(profiles))
+        session = DiagnosisSession()
+        for row in range(0, len(profiles), 7):
+            profile = profiles[row]
+            ranked = diagnose(profile)
+            assert batch.ranked(row) == ranked
+            session.update(profile)
+            assert session.ranked() == ranked
+
+        session = DiagnosisSession({"fever": "none", "smoking_history": True, "wheezing": True})
+        assert not session.is_present("chronic_airway_risk")
+        assert session.what_if("shortness_of_breath")[0][0] == "COPD"
+        session.set_symptom("shortness_of_breath")
+        assert session.is_present("chronic_airway_risk") and session.is_present("airway_obstruction")
+        with pytest.raises(ValueError):
+            session.set_symptom("airway_obstruction")
+    finally:
+        use_compiled_kb(None)
+
+    pneumonia = dict(diagnose_batch([{"fever": "high", "cough": "wet"}]).ranked(0))["Pneumonia"]
+    chained = ckb.percentages(ckb.encode({"fever": "high", "cough": "wet"}))[ckb.diseases.index("Pneumonia")]
+    assert chained > pneumonia
@@ -0,0 +1,47 @@
+import numpy as np
+
+from inference_engine import diagnose
+from sensitivity import run_sensitivity
+from test_inference import all_profiles
+
+
+def test_zero_spread_reproduces_diagnose_and_never_flips():
+    profiles = list(all_profiles())[::37]
+    report = run_sensitivity(profiles, n_samples=5, spread=0.0)
+    for row, profile in enumerate(profiles):
+        expected = dict(diagnose(profile))
+        assert dict(zip(report.diseases, report.baseline[row].tolist())) == expected
+    assert np.array_equal(report.scores, np.broadcast_to(report.baseline, report.scores.shape).astype(np.float32))
+    assert not report.rank_flip_rate.any()
+    assert (report.top1_stability == 1.0).all()
+
+
+def test_perturbed_runs_are_seeded_and_worker_independent():
+    profiles = list(all_profiles())[::11]
+    serial = run_sensitivity(profiles, n_samples=60, spread=0.2, seed=7, block_size=16)
+    pooled = run_sensitivity(profiles, n_samples=60, spread=0.2, seed=7, block_size=16, workers=2)
+    assert serial.scores.shape == (60, len(profiles), len(serial.diseases))
+    assert np.array_equal(serial.scores, pooled.scores)
+    assert serial.rank_flip_rate.any()
+
+    low, high = serial.score_interval(0.9)
+    assert (low <= high).all()
+    rows = serial.summary()
+    assert [r["disease"] for r in rows] == list(serial.diseases)
+    assert all(0.0 <= r["rank_flip_rate"] <= 1.0 for r in rows)
+
+
+def test_capped_score_storage_keeps_exact_flip_statistics():
+    import pytest
+
+    profiles = list(all_profiles())[::13]
+    full = run_sensitivity(profiles, n_samples=50, spread=0.3, seed=2, block_size=8)
+    cells = len(profiles) * len(full.diseases)
+    capped = run_sensitivity(profiles, n_samples=50, spread=0.3, seed=2, block_size=8, workers=2,
+                             max_score_cells=12 * cells)
+    assert capped.n_samples == 50
+    assert np.array_equal(capped.scores, full.scores[:12])
+    assert np.array_equal(capped.rank_flip_rate, full.rank_flip_rate)
+    assert np.array_equal(capped.top1_stability, full.top1_stability)
+    with pytest.raises(ValueError):
+        run_sensitivity(profiles, n_samples=5, max_score_cells=cells - 1)
@@ -0,0 +1,79 @@
+import multiprocessing
+
+import pytest
+
+from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+from inference_engine import (
+    compile_knowledge_base, diagnose, get_compiled_kb, use_compiled_kb,
+)
+from sharded import ShardedDiagnosis, partition_diseases, serve_shard
+from test_inference import all_profiles
+
+
+def test_partition_covers_kb_in_order():
+    ckb = compile_knowledge_base(synthetic_kb(50, seed=3))
+    for n_shards in (1, 3, 7, 50, 80):
+        ranges = partition_diseases(ckb, n_shards)
+        assert len(ranges) == min(n_shards, 50)
+        assert ranges[0][0] == 0 and ranges[-1][1] == 50
+        assert all(start < stop for start, stop in ranges)
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_sharded_matches_single_process():
+    profiles = list(all_profiles())
+    with ShardedDiagnosis(3) as sharded:
+        for patient in profiles[::7]:
+            result = sharded.diagnose(patient)
+            assert result == diagnose(patient)
+            assert result.kb_version == get_compiled_kb().version
+            assert sharded.diagnose(patient, top_k=2) == diagnose(patient, top_k=2)
+        batch = sharded.diagnose_batch(profiles, top_k=3)
+        for row, patient in enumerate(profiles):
+            assert batch.ranked(row) == diagnose(patient)[:3]
+        for bad in (-1, "2"):
+            with pytest.raises(ValueError):
+                sharded.diagnose(profiles[0], top_k=bad)
+            with pytest.raises(ValueError):
+                sharded.diagnose_batch(profiles[:3], top_k=bad)
+
+        # Reload a synthetic KB small enough for the answer table, and compare
+        # against diagnose() with default settings: ties between shards must
+        # keep KB order, and the table and shard sums must agree.
+        ckb = compile_knowledge_base(synthetic_kb(600, seed=5))
+        sharded.load(ckb)
+        use_compiled_kb(ckb)
+        try:
+            profiles = list(synthetic_profiles(200, seed=2))
+            full = sharded.diagnose_batch(profiles)
+            top = sharded.diagnose_batch(profiles, top_k=10)
+            for row, patient in enumerate(profiles):
+                expected = diagnose(patient)
+                assert full.ranked(row) == expected
+                assert top.ranked(row) == expected[:10]
+            for patient in profiles[:20]:
+                assert sharded.diagnose(patient, top_k=10) == diagnose(patient, top_k=10)
+        finally:
+            use_compiled_kb(None)
+
+
+def test_coordinator_connects_to_running_shards():
+    authkey = b"test-shards"
+    ready = multiprocessing.Queue()
+    servers = [multiprocessing.Process(target=serve_shard, kwargs={"authkey": authkey, "ready": ready}, daemon=True)
+               for _ in range(2)]
+    for server in servers:
+        server.start()
+    addresses = [ready.get(timeout=30) for _ in servers]
+
+    profiles = list(all_profiles())[:64]
+    with ShardedDiagnosis(addresses=addresses, authkey=authkey) as sharded:
+        assert sharded.n_shards == 2
+        batch = sharded.diagnose_batch(profiles)
+        for row, patient in enumerate(profiles):
+            assert batch.ranked(row) == diagnose(patient)
+    # Servers outlive a coordinator that did not start them
+    assert all(server.is_alive() for server in servers)
+    for server in servers:
+        server.terminate()
+        server.join()
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import synthetic_kb, synthetic_profiles
+from inference_engine import compile_knowledge_base, diagnose, get_compiled_kb
+from knowledge_base import DERIVED_FACTS, KNOWLEDGE_BASE
+from sparse_kb import SparseKB, check_rankings
+from test_inference import all_profiles
+
+
+def test_float64_storage_matches_engine():
+    sparse = SparseKB.from_kb(KNOWLEDGE_BASE, cf_dtype="float64")
+    ckb = get_compiled_kb()
+    assert sparse.diseases == ckb.diseases and sparse.symptoms == ckb.symptoms
+    for patient in list(all_profiles())[::5]:
+        assert sparse.diagnose(patient) == diagnose(patient)
+        assert sparse.diagnose(patient, top_k=2) == diagnose(patient, top_k=2)
+
+    d_idx = ckb.diseases.index("COVID-19")
+    rules = {symptom: (cf, text) for symptom, cf, text in sparse.rules(d_idx)}
+    expected = KNOWLEDGE_BASE["COVID-19"]["loss_taste_smell"]
+    assert rules["loss_taste_smell"] == (expected["cf"], expected["explain"])
+    # Each distinct explanation is stored once
+    assert len(sparse.strings) == len({r["explain"] for rules in KNOWLEDGE_BASE.values() for r in rules.values()})
+
+
+@pytest.mark.parametrize("cf_dtype", ["float32", "uint8"])
+def test_quantised_rankings_within_tolerance(cf_dtype):
+    report = check_rankings(SparseKB.from_kb(KNOWLEDGE_BASE, cf_dtype), get_compiled_kb(), all_profiles())
+    assert report["within_tolerance"] and report["order_violations"] == 0
+
+    kb = synthetic_kb(2000, extra_symptoms=40, rules_per_disease=12, seed=4)
+    sparse = SparseKB.from_kb(kb, cf_dtype)
+    assert sparse.data.dtype == np.dtype(cf_dtype) and sparse.indices.dtype == np.int32
+    ckb = compile_knowledge_base(kb)
+    report = check_rankings(sparse, ckb, synthetic_profiles(100, seed=1, schema=ckb.schema))
+    assert report["within_tolerance"] and report["order_violations"] == 0
+    if cf_dtype == "float32":
+        assert report["max_tolerance"] < 0.11
+
+
+def test_from_rules_keeps_last_duplicate_and_derived_facts():
+    rules = [("A", "fever_high", 0.5, "x"), ("B", "cough_wet", 0.4, "y"), ("A", "fever_high", 0.8, "z"),
+             ("B", "lower_respiratory_infection", 0.9, "y")]
+    sparse = SparseKB.from_rules(rules, cf_dtype="float64", derived=DERIVED_FACTS)
+    assert sparse.diseases == ("A", "B") and sparse.n_rules == 3
+    assert sparse.rules(0) == [("fever_high", 0.8, "z")]
+    assert sparse.strings == ("x", "y", "z")
+
+    kb = {"A": {"fever_high": {"cf": 0.8, "explain": "z"}},
+          "B": {"cough_wet": {"cf": 0.4, "explain": "y"}, "lower_respiratory_infection": {"cf": 0.9, "explain": "y"}}}
+    ckb = compile_knowledge_base(kb, derived=DERIVED_FACTS)
+    profiles = list(all_profiles())
+    assert np.array_equal(sparse.percentages(sparse.encode_batch(profiles)),
+                          ckb.percentages(ckb.encode_batch(profiles)))
+
+    with pytest.raises(ValueError):
+        SparseKB.from_rules([("A", "x", 1.5, "")], cf_dtype="uint8")